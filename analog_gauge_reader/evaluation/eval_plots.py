@@ -3,6 +3,8 @@ from matplotlib import patches
 import matplotlib.pyplot as plt
 import matplotlib
 
+from plot_utils import save_figure
+
 matplotlib.use('Agg')
 
 
@@ -18,12 +20,9 @@ class EvalPlotter:
         plt.figure()
         plt.imshow(self.image)
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_bounding_box_img(self, ann_boxes, pred_boxes, title):
-
-        plt.figure()
-
         # pylint: disable-next=unused-variable
         fig, ax = plt.subplots(1)
 
@@ -54,11 +53,9 @@ class EvalPlotter:
         plt.legend(handles=[green_patch, red_patch])
 
         path = os.path.join(self.run_path, f"{title}_bbox_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_key_points(self, ann_keypoints, pred_keypoints, title):
-        plt.figure()
-
         # pylint: disable-next=unused-variable
         fig, ax = plt.subplots(1)
 
@@ -81,11 +78,9 @@ class EvalPlotter:
         plt.legend(handles=[green_patch, red_patch])
 
         path = os.path.join(self.run_path, f"{title}_keypoint_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_segmentation(self, annotation, prediction):
-        plt.figure()
-
         # pylint: disable-next=unused-variable
         fig, (ax1, ax2) = plt.subplots(nrows=1, ncols=2, figsize=(10, 5))
 
@@ -100,11 +95,9 @@ class EvalPlotter:
         plt.legend(handles=[green_patch, red_patch])
 
         path = os.path.join(self.run_path, "needle_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_segmentation_debug(self, annotation, prediction):
-        plt.figure()
-
         # pylint: disable-next=unused-variable
         fig, (ax1, ax2) = plt.subplots(nrows=1, ncols=2, figsize=(10, 5))
 
@@ -113,4 +106,4 @@ class EvalPlotter:
         ax2.imshow(prediction)
 
         path = os.path.join(self.run_path, "needle_results_debug.jpg")
-        plt.savefig(path)
+        save_figure(path)
@@ -2,25 +2,39 @@ import argparse
 import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 
 import numpy as np
 from PIL import Image
 
 import constants
-from eval_plots import EvalPlotter
 
 # Append path of parent directory to system to import all modules correctly
 parent_dir = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
 sys.path.append(parent_dir)
 
 # pylint: disable=wrong-import-position
+from eval_plots import EvalPlotter
 from pipeline import crop_image, RESOLUTION
 from key_point_detection.key_point_extraction import key_point_metrics, PCK_KEY, \
     MEAN_DIST_KEY, NON_ASSIGNED_KEY
 
 IOU_THRESHOLD = 0.5
 
+# needle polygons of the annotations, rasterized only when the image is evaluated
+NEEDLE_POLYGON_KEY = "Needle polygons"
+
+# names of the metric lists returned for each image
+GAUGE_IOU_LIST = 'gauge_iou'
+NEEDLE_IOU_LIST = 'needle_iou'
+NOTCH_METRICS_LIST = 'notch_metrics'
+START_METRICS_LIST = 'start_notch_metrics'
+END_METRICS_LIST = 'end_notch_metrics'
+OCR_DETECTIONS_LIST = 'ocr_detections'
+METRIC_LISTS = (GAUGE_IOU_LIST, NEEDLE_IOU_LIST, NOTCH_METRICS_LIST,
+                START_METRICS_LIST, END_METRICS_LIST, OCR_DETECTIONS_LIST)
+
 
 # label-studio annotations are always in scale 0,100 so need to rescale
 def convert_bbox_annotation(single_bbox_dict, img_width, img_height):
@@ -160,10 +174,15 @@ def polygon_to_mask(polygon, img_shape):
     return mask
 
 
-def convert_segmenation_annotation(polygon, img_width, img_height):
+def scale_segmentation_polygon(polygon, img_width, img_height):
     for point in polygon:
         point[0] *= img_width / 100
         point[1] *= img_height / 100
+    return polygon
+
+
+def convert_segmenation_annotation(polygon, img_width, img_height):
+    polygon = scale_segmentation_polygon(polygon, img_width, img_height)
     return polygon_to_mask(polygon, (img_height, img_width))
 
 
@@ -192,7 +211,8 @@ def get_annotations_segmenatation(data):
             'height': img_height
         }
 
-        segmentation_annotation[constants.NEEDLE_MASK_KEY] = []
+        # full size masks are large, they are rasterized per image in evaluate_image
+        segmentation_annotation[NEEDLE_POLYGON_KEY] = []
 
         for annotation in data_point['annotations'][0]['result']:
 
@@ -202,10 +222,9 @@ def get_annotations_segmenatation(data):
                     img_height == annotation['original_height']
 
             segmenation_annotation = annotation['value']['points']
-            segmentation_mask = convert_segmenation_annotation(
-                segmenation_annotation, img_width, img_height)
-            segmentation_annotation[constants.NEEDLE_MASK_KEY].append(
-                segmentation_mask)
+            segmentation_annotation[NEEDLE_POLYGON_KEY].append(
+                scale_segmentation_polygon(segmenation_annotation, img_width,
+                                           img_height))
 
         annotation_dict[image_name] = segmentation_annotation
 
@@ -258,8 +277,10 @@ def get_annotations_from_json(bbox_path, key_point_path, segmentation_path):
             key_point_dict[key][constants.KEYPOINT_START_KEY],
             constants.KEYPOINT_END_KEY:
             key_point_dict[key][constants.KEYPOINT_END_KEY],
-            constants.NEEDLE_MASK_KEY:
-            seg_dict[key][constants.NEEDLE_MASK_KEY]
+            NEEDLE_POLYGON_KEY: {
+                'polygons': seg_dict[key][NEEDLE_POLYGON_KEY],
+                'size': seg_dict[key][constants.IMG_SIZE_KEY]
+            }
         }
 
     return full_annotations
@@ -511,55 +532,68 @@ def rescale_needle_segmentation(masks, crop_box):
     return mask
 
 
-def main(bbox_path, key_point_path, segmentation_path, run_path):
+class _NoPlotter:
+    """
+    Stands in for the EvalPlotter when no plots are written.
+    """
+    def __getattr__(self, name):
+        return _no_plot
 
-    annotations_dict = get_annotations_from_json(bbox_path, key_point_path,
-                                                 segmentation_path)
-    predictions_dict = get_predictions(run_path)
 
-    assert set(predictions_dict.keys()) == set(annotations_dict.keys())
+def _no_plot(*args, **kwargs):
+    pass
 
-    full_eval_dict = {}
 
-    gauge_iou_list = []
-    needle_iou_list = []
-    notch_metrics_list = []
-    start_notch_metrics_list = []
-    end_notch_metrics_list = []
-    ocr_detections_list = []
+def crop_border(box):
+    """
+    Padding that crop_image adds to make the crop of the xyxy box square,
+    as (top, bottom, left, right).
+    """
+    height = int(box[3] - box[1])
+    width = int(box[2] - box[0])
+    delta = abs(height - width)
+    if height > width:
+        return 0, 0, delta // 2, delta - (delta // 2)
+    return delta // 2, delta - (delta // 2), 0, 0
 
-    for image_name in annotations_dict:
 
-        annotation_dict = annotations_dict[image_name]
-        prediction_dict = predictions_dict[image_name]
+def evaluate_image(image_name, annotation_dict, prediction_dict, run_path,
+                   plot=True):
+    """
+    Compare the prediction of one image with its annotation.
+    Runs in a worker process of main, so it only changes its own copies.
+    :return: eval dict of the image and dict with the metric lists of this image
+    """
+    metric_lists = {key: [] for key in METRIC_LISTS}
+
+    eval_dict = {}
 
-        if prediction_dict == constants.FAILED:
-            print("Skip failed image")
-            continue
+    eval_path = os.path.join(run_path, image_name, "eval")
+    os.makedirs(eval_path, exist_ok=True)
+
+    pred_gauge_bbox = prediction_dict[constants.GAUGE_DET_KEY]
+    pred_gauge_bbox_list = [
+        pred_gauge_bbox['x'], pred_gauge_bbox['y'],
+        pred_gauge_bbox['x'] + pred_gauge_bbox['width'],
+        pred_gauge_bbox['y'] + pred_gauge_bbox['height']
+    ]
 
+    if plot:
         # get corresponding image for plots
         image_path = prediction_dict[constants.ORIGINAL_IMG_KEY]
         image = Image.open(image_path).convert("RGB")
         image = np.asarray(image)
-
-        eval_dict = {}
-
-        eval_path = os.path.join(run_path, image_name, "eval")
-        os.makedirs(eval_path, exist_ok=True)
         plotter = EvalPlotter(eval_path, image)
+    else:
+        plotter = _NoPlotter()
 
-        # compare gauge detection
-        compare_gauge_detecions(annotation_dict[constants.GAUGE_DET_KEY],
-                                prediction_dict[constants.GAUGE_DET_KEY],
-                                plotter, eval_dict, gauge_iou_list)
-
-        # Crop and rescale image
-        pred_gauge_bbox = prediction_dict[constants.GAUGE_DET_KEY]
-        pred_gauge_bbox_list = [
-            pred_gauge_bbox['x'], pred_gauge_bbox['y'],
-            pred_gauge_bbox['x'] + pred_gauge_bbox['width'],
-            pred_gauge_bbox['y'] + pred_gauge_bbox['height']
-        ]
+    # compare gauge detection
+    compare_gauge_detecions(annotation_dict[constants.GAUGE_DET_KEY],
+                            pred_gauge_bbox, plotter, eval_dict,
+                            metric_lists[GAUGE_IOU_LIST])
+
+    # Crop and rescale image, the image itself is only needed for the plots
+    if plot:
         cropped_img, border = crop_image(image, pred_gauge_bbox_list, True)
         # resize
         cropped_img = cv2.resize(cropped_img,
@@ -567,67 +601,126 @@ def main(bbox_path, key_point_path, segmentation_path, run_path):
                                  interpolation=cv2.INTER_CUBIC)
         plotter.set_image(cropped_img)
         plotter.plot_image('cropped')
+    else:
+        border = crop_border(pred_gauge_bbox_list)
+
+    # Crop and rescale all annotations
+    for bbox in annotation_dict[constants.OCR_NUM_KEY]:
+        rescale_bbox(bbox, pred_gauge_bbox, border)
+    if annotation_dict[constants.OCR_UNIT_KEY] is not None:
+        rescale_bbox(annotation_dict[constants.OCR_UNIT_KEY], pred_gauge_bbox,
+                     border)
+    rescale_point(annotation_dict[constants.KEYPOINT_START_KEY],
+                  pred_gauge_bbox, border)
+    rescale_point(annotation_dict[constants.KEYPOINT_END_KEY], pred_gauge_bbox,
+                  border)
+    for point in annotation_dict[constants.KEYPOINT_NOTCH_KEY]:
+        rescale_point(point, pred_gauge_bbox, border)
+    needle_polygons = annotation_dict[NEEDLE_POLYGON_KEY]
+    needle_masks = [
+        polygon_to_mask(needle_polygons['polygons'][0],
+                        (needle_polygons['size']['height'],
+                         needle_polygons['size']['width']))
+    ]
+    needle_masks[0] = rescale_needle_segmentation(needle_masks,
+                                                  pred_gauge_bbox_list)
+
+    # compare key points
+    compare_notches(annotation_dict[constants.KEYPOINT_NOTCH_KEY],
+                    prediction_dict[constants.KEYPOINT_NOTCH_KEY], plotter,
+                    eval_dict, metric_lists[NOTCH_METRICS_LIST])
+
+    compare_single_keypoint(annotation_dict[constants.KEYPOINT_START_KEY],
+                            prediction_dict[constants.KEYPOINT_START_KEY],
+                            plotter, eval_dict, True,
+                            metric_lists[START_METRICS_LIST])
+
+    compare_single_keypoint(annotation_dict[constants.KEYPOINT_END_KEY],
+                            prediction_dict[constants.KEYPOINT_END_KEY],
+                            plotter, eval_dict, False,
+                            metric_lists[END_METRICS_LIST])
+
+    # compare OCR number detection
+    if prediction_dict[constants.OCR_NUM_KEY] == constants.FAILED:
+        print("Skip failed ocr comparison")
+        eval_dict[constants.OCR_NUM_KEY] = constants.FAILED
+    else:
+        compare_ocr_numbers(annotation_dict[constants.OCR_NUM_KEY],
+                            prediction_dict[constants.OCR_NUM_KEY], plotter,
+                            eval_dict, metric_lists[OCR_DETECTIONS_LIST])
+
+    # compare OCR unit detection
+
+    # compare needle segmentations
+    if prediction_dict[constants.NEEDLE_MASK_KEY] == constants.FAILED:
+        print("Skip failed needle comparison")
+        eval_dict[constants.NEEDLE_IOU_KEY] = constants.FAILED
+    else:
+        compare_needle_segmentations(needle_masks,
+                                     prediction_dict[constants.NEEDLE_MASK_KEY],
+                                     plotter, eval_dict,
+                                     metric_lists[NEEDLE_IOU_LIST])
+
+    # maybe compare line fit and ellipse fit
 
-        # Crop and rescale all annotations
-        for bbox in annotation_dict[constants.OCR_NUM_KEY]:
-            rescale_bbox(bbox, pred_gauge_bbox, border)
-        if annotation_dict[constants.OCR_UNIT_KEY] is not None:
-            rescale_bbox(annotation_dict[constants.OCR_UNIT_KEY],
-                         pred_gauge_bbox, border)
-        rescale_point(annotation_dict[constants.KEYPOINT_START_KEY],
-                      pred_gauge_bbox, border)
-        rescale_point(annotation_dict[constants.KEYPOINT_END_KEY],
-                      pred_gauge_bbox, border)
-        for point in annotation_dict[constants.KEYPOINT_NOTCH_KEY]:
-            rescale_point(point, pred_gauge_bbox, border)
-        annotation_dict[constants.NEEDLE_MASK_KEY][0] = \
-            rescale_needle_segmentation(annotation_dict[constants.NEEDLE_MASK_KEY],
-                      pred_gauge_bbox_list)
-
-        # compare key points
-        compare_notches(annotation_dict[constants.KEYPOINT_NOTCH_KEY],
-                        prediction_dict[constants.KEYPOINT_NOTCH_KEY], plotter,
-                        eval_dict, notch_metrics_list)
-
-        compare_single_keypoint(annotation_dict[constants.KEYPOINT_START_KEY],
-                                prediction_dict[constants.KEYPOINT_START_KEY],
-                                plotter, eval_dict, True,
-                                start_notch_metrics_list)
-
-        compare_single_keypoint(annotation_dict[constants.KEYPOINT_END_KEY],
-                                prediction_dict[constants.KEYPOINT_END_KEY],
-                                plotter, eval_dict, False,
-                                end_notch_metrics_list)
-
-        # compare OCR number detection
-        if prediction_dict[constants.OCR_NUM_KEY] == constants.FAILED:
-            print("Skip failed ocr comparison")
-            eval_dict[constants.OCR_NUM_KEY] = constants.FAILED
-        else:
-            compare_ocr_numbers(annotation_dict[constants.OCR_NUM_KEY],
-                                prediction_dict[constants.OCR_NUM_KEY],
-                                plotter, eval_dict, ocr_detections_list)
-
-        # compare OCR unit detection
-
-        # compare needle segmentations
-        if prediction_dict[constants.NEEDLE_MASK_KEY] == constants.FAILED:
-            print("Skip failed needle comparison")
-            eval_dict[constants.NEEDLE_IOU_KEY] = constants.FAILED
-        else:
-            compare_needle_segmentations(
-                annotation_dict[constants.NEEDLE_MASK_KEY],
-                prediction_dict[constants.NEEDLE_MASK_KEY], plotter, eval_dict,
-                needle_iou_list)
-
-        # maybe compare line fit and ellipse fit
+    # Save eval_dict to image specific folder
+    outfile_path = os.path.join(eval_path, "evaluation.json")
+    write_json(outfile_path, eval_dict)
+
+    return eval_dict, metric_lists
+
+
+def _evaluate_image_job(job):
+    return evaluate_image(*job)
+
+
+def main(bbox_path,
+         key_point_path,
+         segmentation_path,
+         run_path,
+         plot=True,
+         workers=None):
+    """
+    :param plot: write the comparison plots of every image
+    :param workers: processes that evaluate images at the same time,
+        None uses all cores, 1 evaluates in this process
+    """
 
+    annotations_dict = get_annotations_from_json(bbox_path, key_point_path,
+                                                 segmentation_path)
+    predictions_dict = get_predictions(run_path)
+
+    assert set(predictions_dict.keys()) == set(annotations_dict.keys())
+
+    jobs = []
+    for image_name in annotations_dict:
+        if predictions_dict[image_name] == constants.FAILED:
+            print("Skip failed image")
+            continue
+        jobs.append((image_name, annotations_dict[image_name],
+                     predictions_dict[image_name], run_path, plot))
+
+    if workers == 1:
+        results = list(map(_evaluate_image_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_evaluate_image_job, jobs))
+
+    # merge in the order of the annotations, independent of the workers
+    full_eval_dict = {}
+    metric_lists = {key: [] for key in METRIC_LISTS}
+    for job, (eval_dict, image_metric_lists) in zip(jobs, results):
         # Add eval dict to full
-        full_eval_dict[image_name] = eval_dict
+        full_eval_dict[job[0]] = eval_dict
+        for key in METRIC_LISTS:
+            metric_lists[key].extend(image_metric_lists[key])
 
-        # Save eval_dict to image specific folder
-        outfile_path = os.path.join(eval_path, "evaluation.json")
-        write_json(outfile_path, eval_dict)
+    gauge_iou_list = metric_lists[GAUGE_IOU_LIST]
+    needle_iou_list = metric_lists[NEEDLE_IOU_LIST]
+    notch_metrics_list = metric_lists[NOTCH_METRICS_LIST]
+    start_notch_metrics_list = metric_lists[START_METRICS_LIST]
+    end_notch_metrics_list = metric_lists[END_METRICS_LIST]
+    ocr_detections_list = metric_lists[OCR_DETECTIONS_LIST]
 
     # calculate averages
     gauge_iou_avg = np.average(np.array(gauge_iou_list))
@@ -684,10 +777,21 @@ def read_args():
                         type=str,
                         required=True,
                         help="Path to run folder")
+    parser.add_argument('--no_plots',
+                        action='store_true',
+                        help="Only compute the metrics, without comparison plots")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help="Images evaluated in parallel, default all cores")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = read_args()
-    main(args.bbox_true_path, args.keypoint_true_path,
-         args.segmentation_true_path, args.run_path)
+    main(args.bbox_true_path,
+         args.keypoint_true_path,
+         args.segmentation_true_path,
+         args.run_path,
+         plot=not args.no_plots,
+         workers=args.workers)
@@ -1,10 +1,10 @@
-from ultralytics import YOLO
-import numpy as np
-import cv2
-from scipy import odr
+import os
 
-# hard coded model path to detect gauge center
-GAUGE_CENTER_MODEL_PATH = "analog_gauge_reader/models/center.pt"
+from model_registry import get_yolo_model
+
+# model to detect the gauge center, relative to this module so it does not depend on the working directory
+GAUGE_CENTER_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                       os.pardir, "models", "center.pt")
 
 
 def detect_gauge_center(image, model_path=GAUGE_CENTER_MODEL_PATH):
@@ -14,11 +14,8 @@ def detect_gauge_center(image, model_path=GAUGE_CENTER_MODEL_PATH):
     :param model_path: path to yolov8 detection model
     :return: detection of center
     """
-    # load model
-    try:
-        model = YOLO(model_path)
-    except:
-        print("Center detection model path is wrong")
+    # loaded once per process
+    model = get_yolo_model(model_path)
 
     # run inference
     results = model.predict(image)
@@ -1,4 +1,4 @@
-from ultralytics import YOLO
+from model_registry import get_yolo_model
 
 
 def detection_gauge_face(img, model_path='best.pt'):
@@ -8,15 +8,37 @@ def detection_gauge_face(img, model_path='best.pt'):
     :param model_path: path to yolov8 detection model
     :return: highest confidence box for further processing and list of all boxes for visualization
     '''
-    model = YOLO(model_path)  # load model
+    model = get_yolo_model(model_path)  # loaded once per process
 
     results = model(img)  # run inference, detects gauge face and needle
 
+    detection = _get_gauge_face_boxes(results[0])
+    if detection is None:
+        raise Exception("No gauge detected in image")
+
+    return detection
+
+
+def detection_gauge_face_batch(imgs, model_path='best.pt'):
+    '''
+    same as detection_gauge_face, but for a list of images in one forward pass
+    :param imgs: list of numpy images
+    :param model_path: path to yolov8 detection model
+    :return: list with (box, box_list) per image, None where no gauge was detected
+    '''
+    model = get_yolo_model(model_path)  # loaded once per process
+
+    results = model(imgs)
+
+    return [_get_gauge_face_boxes(result) for result in results]
+
+
+def _get_gauge_face_boxes(result):
     # get list of detected boxes, already sorted by confidence
-    boxes = results[0].boxes
+    boxes = result.boxes
 
     if len(boxes) == 0:
-        raise Exception("No gauge detected in image")
+        return None
 
     # get highest confidence box which is of a gauge face
     gauge_face_box = boxes[0]
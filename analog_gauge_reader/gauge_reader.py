@@ -0,0 +1,913 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from gauge_detection.detection_inference import detection_gauge_face_batch
+from gauge_center_detection.gauge_center_inference import detect_gauge_center
+from key_point_detection.key_point_inference import KeyPointInference, detect_key_points
+from key_point_detection.key_point_extraction import MEAN_SHIFT_METHOD
+from geometry.circle_fit import fit_circle_robust
+from geometry.circle import fit_circle, get_line_circle_points, \
+    get_point_from_angle, get_polar_angles, get_theta_middles, get_circle_error
+from angle_reading_fit.angle_converter import AngleConverter
+from angle_reading_fit.line_fit import line_fit, line_fit_ransac
+from segmentation.segmenation_inference import get_start_end_line, segment_gauge_needle_batch, \
+    get_fitted_line, cut_off_line
+from evaluation import constants
+from model_registry import preload_models
+from stage_graph import Stage, run_stages, thread_budget, create_stage_executor
+
+RESOLUTION = (
+    448, 448
+)  # make sure both dimensions are multiples of 14 for keypoint detection
+
+# Several flags to set or unset for pipeline
+WRAP_AROUND_FIX = True
+RANSAC = True
+# fit the circle robustly to the notches, spurious key points are left out
+CIRCLE_RANSAC = True
+
+# Tracking mode: readings until detection and key points run again,
+# minimal correlation of the crop with the cached one and its size
+TRACKING_REFRESH_INTERVAL = 30
+TRACKING_MIN_CORRELATION = 0.8
+TRACKING_REFERENCE_SIZE = (64, 64)
+
+# Change gate: size of the grayscale gauge crop that is compared between frames
+CHANGE_GATE_SIZE = (32, 32)
+
+# parallel_stages: key points and segmentation run at the same time on every read,
+# the center only runs for reads with keep_details
+N_PARALLEL_STAGES = 2
+
+
+def crop_image(img, box, flag=False, two_dimensional=False):
+    """
+    crop image
+    :param img: orignal image
+    :param box: in the xyxy format
+    :return: cropped image
+    """
+    img = np.copy(img)
+    if two_dimensional:
+        cropped_img = img[box[1]:box[3],
+                          box[0]:box[2]]  # image has format [y, x]
+    else:
+        cropped_img = img[box[1]:box[3],
+                          box[0]:box[2], :]  # image has format [y, x, rgb]
+
+    height = int(box[3] - box[1])
+    width = int(box[2] - box[0])
+
+    # want to preserve aspect ratio but make image square, so do padding
+    if height > width:
+        delta = height - width
+        left, right = delta // 2, delta - (delta // 2)
+        top = bottom = 0
+    else:
+        delta = width - height
+        top, bottom = delta // 2, delta - (delta // 2)
+        left = right = 0
+
+    pad_color = [0, 0, 0]
+    new_img = cv2.copyMakeBorder(cropped_img,
+                                 top,
+                                 bottom,
+                                 left,
+                                 right,
+                                 cv2.BORDER_CONSTANT,
+                                 value=pad_color)
+
+    if flag:
+        return new_img, (top, bottom, left, right)
+    return new_img
+
+
+class Calibration:
+    """
+    Scale of one gauge: the values at the start and end notch and the unit.
+    """
+    def __init__(self, start_marking, end_marking, unit):
+        self.start_marking = start_marking
+        self.end_marking = end_marking
+        self.unit = unit
+
+    @classmethod
+    def from_camera_details(cls, camera_details):
+        return cls(camera_details["start_marking"],
+                   camera_details["end_marking"], camera_details["unit"])
+
+
+class ChangeGate:
+    """
+    Skips reading a frame if the gauge looks the same as in the last full reading.
+    threshold is the mean absolute difference in gray levels (0-255) of the
+    downsampled gauge crops, below it the last reading is carried forward.
+    After refresh_period seconds the gauge is read again in any case.
+    """
+    def __init__(self, threshold, refresh_period):
+        self.threshold = threshold
+        self.refresh_period = refresh_period
+
+    @classmethod
+    def from_camera_details(cls, camera_details):
+        """
+        Gate of a camera in config_calibration.json,
+        None if the camera has no change_threshold.
+        """
+        if camera_details.get("change_threshold") is None:
+            return None
+        return cls(camera_details["change_threshold"],
+                   camera_details.get("forced_refresh", 600))
+
+
+class Reading:
+    """
+    Result of reading one frame.
+    If the reading failed, value is None and failure holds the reason.
+    details holds the intermediate results of all stages if they were requested.
+    carried_forward is set if the frame was skipped by the change gate
+    and the value is the one of the last full reading.
+    """
+    def __init__(self, value, unit, errors=None, failure=None, details=None,
+                 carried_forward=False):
+        self.value = value
+        self.unit = unit
+        self.errors = errors if errors is not None else {}
+        self.failure = failure
+        self.details = details if details is not None else {}
+        self.carried_forward = carried_forward
+
+    def is_valid(self):
+        return self.failure is None
+
+    def to_dict(self):
+        return {
+            "value": self.value,
+            "unit": self.unit,
+            "carried_forward": self.carried_forward
+        }
+
+
+class _GatedReading:
+    """
+    Last full reading of a camera with the gauge crop it was read from.
+    """
+    def __init__(self, box, gate_image, reading):
+        self.box = box
+        self.gate_image = gate_image
+        self.reading = reading
+        self.time = time.time()
+
+
+class GaugeGeometry:
+    """
+    Everything of a gauge that only changes when the camera moves:
+    the gauge box, the key points, the fitted circle and the zero angle.
+    In tracking mode it is cached per camera.
+    """
+    def __init__(self, box, all_boxes, reference, heatmaps, key_point_list,
+                 circle_params, circle_error, center=None):
+        self.box = box
+        self.all_boxes = all_boxes
+        # small grayscale crop to check if the camera moved
+        self.reference = reference
+        self.heatmaps = heatmaps
+        self.key_point_list = key_point_list
+        self.circle_params = circle_params
+        self.circle_error = circle_error
+        # set for the whole batch by _set_key_point_angles,
+        # start and end stay None if the key point was not found
+        self.theta_start = None
+        self.theta_end = None
+        self.theta_zero = None
+        self.center = center
+        # readings made with this geometry
+        self.n_reads = 0
+
+
+class GaugeReader:
+    """
+    Long lived gauge reading engine.
+    All models are loaded in the constructor, read() then only does the
+    computation for one frame and never touches the disk.
+
+    In tracking mode the geometry of every camera is cached and only the
+    needle segmentation runs for each frame. Detection and key points run
+    again after refresh_interval readings, when the crop at the cached box
+    does not correlate with the cached one anymore or when a reading fails.
+
+    Cameras with a ChangeGate skip all networks while the gauge crop does not
+    change, the last reading is then returned as carried forward.
+    """
+    def __init__(self,
+                 detection_model_path,
+                 key_point_model_path,
+                 segmentation_model_path,
+                 calibration=None,
+                 center_model_path=None,
+                 key_point_method=MEAN_SHIFT_METHOD,
+                 tracking=False,
+                 refresh_interval=TRACKING_REFRESH_INTERVAL,
+                 min_correlation=TRACKING_MIN_CORRELATION,
+                 parallel_stages=False):
+        """
+        :param calibration: default calibration used if read() gets none
+        :param center_model_path: if given, also detect the gauge center.
+            It is only used for debug plots, so the model is loaded and run
+            only for reads with keep_details.
+        :param key_point_method: 'mean_shift' or 'nms', see full_key_point_extraction
+        :param tracking: cache the geometry of frames read with a camera id
+        :param refresh_interval: readings until the geometry is recomputed
+        :param min_correlation: normalized cross correlation with the cached
+            crop, below it the camera counts as moved
+        :param parallel_stages: run key points and segmentation at the same
+            time on a thread pool, the center detection of debug reads waits
+            for a free thread. Load the models with parallel_stage_threads()
+            threads beforehand, so the stages do not compete for the cores.
+        """
+        self.detection_model_path = detection_model_path
+        self.segmentation_model_path = segmentation_model_path
+        self.center_model_path = center_model_path
+        self.calibration = calibration
+        self.key_point_method = key_point_method
+        self.tracking = tracking
+        self.refresh_interval = refresh_interval
+        self.min_correlation = min_correlation
+        self._geometries = {}
+        self._gated_readings = {}
+        # seconds of the stages of the last read, see StageTimings
+        self.stage_timings = None
+
+        self._stage_executor = None
+        if parallel_stages:
+            self._stage_executor = create_stage_executor(N_PARALLEL_STAGES)
+
+        # device and precision are whatever the registry is configured with
+        # the center model is loaded on the first read that needs it
+        preload_models(detection_model_path, key_point_model_path,
+                       segmentation_model_path)
+        self.key_point_inferencer = KeyPointInference(key_point_model_path)
+
+    def read(self, frame, calibration=None, keep_details=False,
+             camera_id=None, gate=None):
+        """
+        Read the gauge in one frame.
+        :param frame: numpy RGB image
+        :param calibration: overrides the calibration of the reader
+        :param keep_details: keep intermediate results in reading.details,
+            needed for plots and the full evaluation results
+        :param camera_id: camera of the frame, the geometry is only
+            tracked for frames with a camera id
+        :param gate: ChangeGate of the camera, needs a camera id
+        :return: Reading
+        """
+        return self.read_batch([frame], [calibration], keep_details,
+                               [camera_id], [gate])[0]
+
+    def read_batch(self, frames, calibrations=None, keep_details=False,
+                   camera_ids=None, gates=None):
+        """
+        Read the gauges in several frames, for example of different cameras.
+        Every network runs once for the whole batch, only the geometry is
+        done per frame.
+        :param frames: list of numpy RGB images
+        :param calibrations: list with one calibration per frame,
+            None entries use the calibration of the reader
+        :param keep_details: see read()
+        :param camera_ids: list with one camera id per frame or None
+        :param gates: list with one ChangeGate or None per frame or None
+        :return: list with one Reading per frame
+        """
+        if calibrations is None:
+            calibrations = [None] * len(frames)
+        calibrations = [
+            self.calibration if calibration is None else calibration
+            for calibration in calibrations
+        ]
+        if any(calibration is None for calibration in calibrations):
+            raise ValueError("No calibration given for gauge reading")
+        if camera_ids is None:
+            camera_ids = [None] * len(frames)
+        if gates is None:
+            gates = [None] * len(frames)
+
+        readings = [None] * len(frames)
+        details_list = [{} for _ in frames]
+        crops = [None] * len(frames)
+        geometries = [None] * len(frames)
+
+        # ------------------Change gate-------------------------
+        for index, (frame, camera_id) in enumerate(zip(frames, camera_ids)):
+            readings[index] = self._carry_forward(frame, camera_id,
+                                                  gates[index])
+        changed_indices = [
+            index for index, reading in enumerate(readings)
+            if reading is None
+        ]
+
+        # ------------------Tracking-------------------------
+        for index in changed_indices:
+            frame, camera_id = frames[index], camera_ids[index]
+            geometry = self._tracked_geometry(camera_id)
+            if geometry is None:
+                continue
+            cropped_resized_img = _crop_resized(frame, geometry.box)
+            if self._has_moved(geometry, cropped_resized_img):
+                logging.info("Camera %s moved, detect gauge again", camera_id)
+                del self._geometries[camera_id]
+                continue
+            crops[index] = cropped_resized_img
+            geometries[index] = geometry
+
+        full_indices = [
+            index for index in changed_indices if geometries[index] is None
+        ]
+
+        # ------------------Gauge detection-------------------------
+        logging.info("Start Gauge Detection")
+
+        detections = []
+        if full_indices:
+            detections = detection_gauge_face_batch(
+                [frames[index] for index in full_indices],
+                self.detection_model_path)
+
+        boxes = {}
+        for index, detection in zip(full_indices, detections):
+            if detection is None:
+                logging.error("No gauge detected in image")
+                readings[index] = Reading(None, calibrations[index].unit,
+                                          failure="No gauge detected in image")
+                continue
+            boxes[index] = detection
+            crops[index] = _crop_resized(frames[index], detection[0])
+        detected_indices = list(boxes.keys())
+
+        logging.info("Finish Gauge Detection")
+
+        read_indices = [
+            index for index in changed_indices if crops[index] is not None
+        ]
+        if not read_indices:
+            return readings
+
+        # ------------------Key points, center and segmentation-------------------------
+        # all of them only need the crops, with parallel_stages they run at the same time
+        stages = [
+            Stage("segmentation",
+                  lambda read_crops: segment_gauge_needle_batch(
+                      read_crops, self.segmentation_model_path),
+                  consumes=("read_crops", ),
+                  produces=("needle_masks", ))
+        ]
+        if detected_indices:
+            stages.append(
+                Stage("key_points",
+                      self.key_point_inferencer.predict_heatmaps_batch,
+                      consumes=("images", ),
+                      produces=("heatmaps", )))
+            if self.center_model_path is not None:
+                stages.append(
+                    Stage("center",
+                          lambda images: [
+                              detect_gauge_center(image, self.center_model_path)
+                              for image in images
+                          ],
+                          consumes=("images", ),
+                          produces=("center_boxes", )))
+        # the center is only used for the debug plots
+        wanted = ["needle_masks", "heatmaps"]
+        if keep_details:
+            wanted.append("center_boxes")
+        values, self.stage_timings = run_stages(
+            stages, {
+                "read_crops": [crops[index] for index in read_indices],
+                "images": [crops[index] for index in detected_indices]
+            }, self._stage_executor, wanted)
+        needle_masks = values["needle_masks"]
+
+        # ------------------Key point extraction and circle fitting-------------------------
+        center_boxes = values.get("center_boxes",
+                                  [None] * len(detected_indices))
+        for index, heatmaps, center_box in zip(detected_indices,
+                                               values.get("heatmaps", []),
+                                               center_boxes):
+            box, all_boxes = boxes[index]
+            try:
+                geometries[index] = self._fit_geometry(crops[index], heatmaps,
+                                                       box, all_boxes,
+                                                       center_box)
+            # pylint: disable=broad-except
+            # one frame must not void the readings of the other cameras in the batch
+            except Exception as err:
+                logging.exception("Geometry of frame %d failed", index)
+                readings[index] = Reading(None,
+                                          calibrations[index].unit,
+                                          failure=f"Geometry failed: {err}")
+                continue
+            if geometries[index] is None:
+                readings[index] = Reading(
+                    None,
+                    calibrations[index].unit,
+                    failure="Not enough key points for circle fit")
+            elif self.tracking and camera_ids[index] is not None:
+                self._geometries[camera_ids[index]] = geometries[index]
+        _set_key_point_angles([
+            geometries[index] for index in detected_indices
+            if geometries[index] is not None
+        ])
+
+        # ------------------Needle line fit-------------------------
+        needle_lines = {}
+        errors_list = {}
+        for index, needle_mask in zip(read_indices, needle_masks):
+            geometry = geometries[index]
+            if geometry is None:
+                continue
+            geometry.n_reads += 1
+            details = None
+            if keep_details:
+                details = details_list[index]
+                details['image'] = frames[index]
+                details['cropped_img'] = crops[index]
+                _add_geometry_details(details, geometry)
+            errors = errors_list[index] = {
+                "circle fit error": geometry.circle_error
+            }
+            if needle_mask is None:
+                logging.error("Segmentation failed, no needle found")
+                errors[constants.SEGMENTATION_FAILED_KEY] = True
+                readings[index] = Reading(
+                    None, calibrations[index].unit, errors,
+                    "Segmentation failed, no needle found", details)
+                continue
+            try:
+                needle_line = _fit_needle_line(needle_mask, errors, details)
+            # pylint: disable=broad-except
+            except Exception as err:
+                logging.exception("Needle line of frame %d failed", index)
+                readings[index] = Reading(None,
+                                          calibrations[index].unit,
+                                          failure=f"Needle reading failed: {err}",
+                                          details=details)
+                continue
+            if geometry.theta_start is None:
+                logging.error("Start or end key point not found")
+                readings[index] = Reading(None, calibrations[index].unit,
+                                          errors,
+                                          "Start or end key point not found",
+                                          details)
+                continue
+            needle_lines[index] = needle_line
+
+        # ------------------Project needles to circle-------------------------
+        # one call for the needles of all frames
+        needle_indices = list(needle_lines.keys())
+        if needle_indices:
+            circle_params = np.array(
+                [geometries[index].circle_params for index in needle_indices])
+            needle_points, intersects = get_line_circle_points(
+                [needle_lines[index][0] for index in needle_indices],
+                [needle_lines[index][1] for index in needle_indices],
+                circle_params)
+            needle_angles = get_polar_angles(needle_points, circle_params)
+
+        # ------------------Fit line to angles and get reading of needle-------------------------
+        for position, index in enumerate(needle_indices):
+            details = details_list[index] if keep_details else None
+            errors = errors_list[index]
+            if not intersects[position]:
+                logging.error("Needle line and circle do not intersect!")
+                errors[constants.OCR_NONE_DETECTED_KEY] = True
+                readings[index] = Reading(
+                    None, calibrations[index].unit, errors,
+                    "Needle line and circle do not intersect", details)
+                continue
+            try:
+                readings[index] = self._fit_reading(geometries[index],
+                                                    needle_points[position],
+                                                    needle_angles[position],
+                                                    calibrations[index],
+                                                    errors, details)
+            # pylint: disable=broad-except
+            except Exception as err:
+                logging.exception("Needle reading of frame %d failed", index)
+                readings[index] = Reading(None,
+                                          calibrations[index].unit,
+                                          failure=f"Needle reading failed: {err}",
+                                          details=details)
+
+        for index in read_indices:
+            geometry = geometries[index]
+            if geometry is None:
+                continue
+            # a failed reading might come from an outdated geometry
+            if not readings[index].is_valid():
+                self._geometries.pop(camera_ids[index], None)
+                self._gated_readings.pop(camera_ids[index], None)
+            elif gates[index] is not None and camera_ids[index] is not None:
+                self._gated_readings[camera_ids[index]] = _GatedReading(
+                    geometry.box, _gate_image(frames[index], geometry.box),
+                    readings[index])
+        return readings
+
+    def close(self):
+        """
+        Stop the stage threads of parallel_stages.
+        """
+        if self._stage_executor is not None:
+            self._stage_executor.shutdown()
+            self._stage_executor = None
+
+    def reset_tracking(self, camera_id=None):
+        """
+        Forget the cached geometry and the last gated reading
+        of one camera or of all cameras.
+        """
+        if camera_id is None:
+            self._geometries.clear()
+            self._gated_readings.clear()
+        else:
+            self._geometries.pop(camera_id, None)
+            self._gated_readings.pop(camera_id, None)
+
+    def _carry_forward(self, frame, camera_id, gate):
+        """
+        Last reading of the camera if the gauge did not change since, else None.
+        The crop is always compared with the one of the last full reading,
+        so slow changes add up until they pass the threshold.
+        """
+        if gate is None or camera_id is None:
+            return None
+        last = self._gated_readings.get(camera_id)
+        if last is None or time.time() - last.time >= gate.refresh_period:
+            return None
+        difference = mean_absolute_difference(
+            last.gate_image, _gate_image(frame, last.box))
+        if difference >= gate.threshold:
+            logging.info("Gauge of camera %s changed by %.1f, read again",
+                         camera_id, difference)
+            return None
+        return Reading(last.reading.value,
+                       last.reading.unit,
+                       dict(last.reading.errors),
+                       carried_forward=True)
+
+    def _tracked_geometry(self, camera_id):
+        if not self.tracking or camera_id is None:
+            return None
+        geometry = self._geometries.get(camera_id)
+        if geometry is not None and geometry.n_reads >= self.refresh_interval:
+            logging.info("Refresh geometry of camera %s", camera_id)
+            del self._geometries[camera_id]
+            return None
+        return geometry
+
+    def _has_moved(self, geometry, cropped_resized_img):
+        correlation = normalized_cross_correlation(
+            geometry.reference, _reference_image(cropped_resized_img))
+        return correlation < self.min_correlation
+
+    def _fit_geometry(self, cropped_resized_img, heatmaps, box, all_boxes,
+                      center_box=None):
+        """
+        Geometry of one gauge, from the key point heatmaps to the fitted circle.
+        The angles are set afterwards for the whole batch.
+        :return: GaugeGeometry, None if there are too few key points for a circle
+        """
+        center = None
+        if center_box is not None:
+            center = [(center_box[0] + center_box[2]) / 2,
+                      (center_box[1] + center_box[3]) / 2]
+
+        # ------------------Key Point Extraction-------------------------
+        key_point_list = detect_key_points(heatmaps, self.key_point_method)
+
+        key_points = key_point_list[1]
+
+        # ------------------Circle Fitting-------------------------
+        # key points can be hidden, e.g. by the needle or a hand
+        if len(key_points) < 3:
+            logging.error("Only %d key points found, can not fit circle",
+                          len(key_points))
+            return None
+
+        logging.info("Start circle fitting")
+
+        if CIRCLE_RANSAC:
+            circle_params, inlier_mask = fit_circle_robust(
+                key_points[:, 0], key_points[:, 1])
+            logging.info("%d of %d key points are circle inliers",
+                         np.count_nonzero(inlier_mask), len(inlier_mask))
+            circle_error = get_circle_error(key_points[inlier_mask],
+                                            circle_params)
+        else:
+            circle_params = fit_circle(key_points[:, 0], key_points[:, 1])
+            circle_error = get_circle_error(key_points, circle_params)
+
+        logging.info("Finish circle fitting")
+
+        return GaugeGeometry(box, all_boxes,
+                             _reference_image(cropped_resized_img), heatmaps,
+                             key_point_list, circle_params, circle_error,
+                             center)
+
+    def _fit_reading(self, geometry, point_needle_circle, needle_angle,
+                     calibration, errors, details):
+        """
+        Reading of one frame from the angle of its needle on the circle.
+        :param errors: dict with the errors of the frame so far
+        :param details: dict to fill with intermediate results or None
+        """
+        keep_details = details is not None
+
+        # ------------------Fit line to angles and get reading of needle-------------------------
+
+        angle_converter = AngleConverter(geometry.theta_zero)
+
+        angle_number_list = [
+            (angle_converter.convert_angle(geometry.theta_start),
+             calibration.start_marking),
+            (angle_converter.convert_angle(geometry.theta_end),
+             calibration.end_marking),
+        ]
+        angle_number_arr = np.array(angle_number_list)
+
+        if RANSAC:
+            reading_line_coeff, inlier_mask, outlier_mask = line_fit_ransac(
+                angle_number_arr[:, 0], angle_number_arr[:, 1])
+        else:
+            reading_line_coeff = line_fit(angle_number_arr[:, 0],
+                                          angle_number_arr[:, 1])
+            inlier_mask = outlier_mask = None
+
+        reading_line = np.poly1d(reading_line_coeff)
+        reading_line_res = np.sum(
+            abs(
+                np.polyval(reading_line_coeff, angle_number_arr[:, 0]) -
+                angle_number_arr[:, 0]))
+        reading_line_mean_err = reading_line_res / len(angle_number_arr)
+        errors["Mean residual on fitted angle line"] = reading_line_mean_err
+
+        needle_angle_conv = angle_converter.convert_angle(needle_angle)
+
+        reading = reading_line(needle_angle_conv)
+
+        if keep_details:
+            details['needle_point'] = point_needle_circle
+            details['angle_fit'] = (angle_number_arr,
+                                    (needle_angle_conv, reading),
+                                    reading_line, inlier_mask, outlier_mask)
+
+        return Reading(reading, calibration.unit, errors, details=details)
+
+
+def parallel_stage_threads():
+    """
+    Threads per model for a reader with parallel_stages, the cores are split
+    between the stages that run on every read.
+    Pass it to preload_models before the reader is built.
+    """
+    return thread_budget(N_PARALLEL_STAGES)
+
+
+def _fit_needle_line(needle_mask, errors, details):
+    """
+    Line through the needle mask of one frame.
+    :return: line coefficients and the x coordinates of the needle ends
+    """
+    needle_mask_x, needle_mask_y = needle_mask
+
+    needle_line_coeffs, needle_error = get_fitted_line(
+        needle_mask_x, needle_mask_y)
+    needle_line_start_x, needle_line_end_x = get_start_end_line(
+        needle_mask_x)
+    needle_line_start_y, needle_line_end_y = get_start_end_line(
+        needle_mask_y)
+
+    needle_line_start_x, needle_line_end_x = cut_off_line(
+        [needle_line_start_x, needle_line_end_x], needle_line_start_y,
+        needle_line_end_y, needle_line_coeffs)
+
+    errors["Needle line residual variance"] = needle_error
+
+    if details is not None:
+        details['needle_mask'] = (needle_mask_x, needle_mask_y)
+        details['needle_line'] = (needle_line_coeffs,
+                                  (needle_line_start_x, needle_line_end_x))
+    return needle_line_coeffs, (needle_line_start_x, needle_line_end_x)
+
+
+def _set_key_point_angles(geometries):
+    """
+    Angles of the start and end key point and the zero angle
+    of new geometries, computed for all of them at once.
+    """
+    if not geometries:
+        return
+    circle_params = np.array([geometry.circle_params for geometry in geometries])
+    # the nms extraction finds no point if the notch is covered
+    found = np.array([
+        geometry.key_point_list[0].shape == (1, 2)
+        and geometry.key_point_list[2].shape == (1, 2)
+        for geometry in geometries
+    ])
+    start_end_points = np.full((len(geometries), 2, 2), np.nan)
+    for position, geometry in enumerate(geometries):
+        if found[position]:
+            start_end_points[position] = np.vstack(
+                (geometry.key_point_list[0], geometry.key_point_list[2]))
+    theta_start_end = get_polar_angles(start_end_points, circle_params[:, None])
+
+    # Find bottom point to set there the zero for wrap around
+    bottom_middle = np.array((RESOLUTION[0] / 2, RESOLUTION[1]))
+    theta_zero = get_polar_angles(bottom_middle, circle_params)
+    if WRAP_AROUND_FIX:
+        theta_zero = np.where(
+            found,
+            get_theta_middles(theta_start_end[:, 0], theta_start_end[:, 1]),
+            theta_zero)
+
+    for position, geometry in enumerate(geometries):
+        if found[position]:
+            geometry.theta_start, geometry.theta_end = theta_start_end[position]
+        geometry.theta_zero = theta_zero[position]
+
+
+def _crop_resized(frame, box):
+    # crop image to only gauge face and resize it to the model input
+    cropped_img = crop_image(frame, box)
+    return cv2.resize(cropped_img,
+                      dsize=RESOLUTION,
+                      interpolation=cv2.INTER_CUBIC)
+
+
+def _reference_image(cropped_resized_img):
+    gray = cv2.cvtColor(cropped_resized_img, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray,
+                      dsize=TRACKING_REFERENCE_SIZE,
+                      interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def _gate_image(frame, box):
+    # small grayscale gauge crop for the change gate
+    gray = cv2.cvtColor(frame[box[1]:box[3], box[0]:box[2]],
+                        cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, dsize=CHANGE_GATE_SIZE,
+                      interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def mean_absolute_difference(image_1, image_2):
+    """
+    Mean absolute difference of two images of the same size, 0 for identical images.
+    """
+    return float(np.mean(np.abs(image_1 - image_2)))
+
+
+def normalized_cross_correlation(image_1, image_2):
+    """
+    Correlation of two images of the same size, 1 for identical images.
+    Does not change with brightness or contrast.
+    """
+    image_1 = image_1 - np.mean(image_1)
+    image_2 = image_2 - np.mean(image_2)
+    norm = np.sqrt(np.sum(image_1**2) * np.sum(image_2**2))
+    if norm == 0:
+        return 0.0
+    return float(np.sum(image_1 * image_2) / norm)
+
+
+def _add_geometry_details(details, geometry):
+    details['box'] = geometry.box
+    details['all_boxes'] = geometry.all_boxes
+    if geometry.center is not None:
+        details['center'] = geometry.center
+    details['heatmaps'] = geometry.heatmaps
+    details['key_point_list'] = geometry.key_point_list
+    details['circle_params'] = geometry.circle_params
+    details['zero_point'] = get_point_from_angle(geometry.theta_zero,
+                                                 geometry.circle_params)
+
+
+def plot_reading(plotter, reading):
+    """
+    Plot all intermediate results of a reading made with keep_details.
+    Stages that did not run because the reading failed are skipped.
+    :param plotter: Plotter from plots_circle or OverlayRenderer from plots_overlay,
+        set to the original image
+    """
+    details = reading.details
+    if 'all_boxes' not in details:
+        return
+
+    plotter.plot_bounding_box_img(details['all_boxes'])
+    plotter.set_image(details['cropped_img'])
+    plotter.plot_image('cropped')
+
+    plotter.plot_heatmaps(details['heatmaps'])
+    key_point_list = details['key_point_list']
+    plotter.plot_key_points(key_point_list)
+
+    circle_params = details['circle_params']
+    plotter.plot_circle(key_point_list[1], circle_params, 'key_points')
+    start_end_points = np.vstack((key_point_list[0], key_point_list[2]))
+    if 'center' in details:
+        plotter.plot_zero_point_circle(np.array(details['zero_point']),
+                                       start_end_points, circle_params,
+                                       details['center'])
+    else:
+        plotter.plot_zero_point_circle(np.array(details['zero_point']),
+                                       start_end_points, circle_params)
+
+    if 'needle_mask' not in details:
+        return
+    needle_mask_x, needle_mask_y = details['needle_mask']
+    needle_line_coeffs, needle_line_x = details['needle_line']
+    plotter.plot_segmented_line(needle_mask_x, needle_mask_y, needle_line_x,
+                                needle_line_coeffs)
+
+    if 'needle_point' not in details:
+        return
+    point_needle_circle = details['needle_point']
+    plotter.plot_circle(point_needle_circle.reshape(1, 2), circle_params,
+                        'needle_point')
+
+    angle_number_arr, needle, reading_line, inlier_mask, outlier_mask = \
+        details['angle_fit']
+    if inlier_mask is not None:
+        plotter.plot_linear_fit_ransac(angle_number_arr, needle, reading_line,
+                                       inlier_mask, outlier_mask)
+    else:
+        plotter.plot_linear_fit(angle_number_arr, needle, reading_line)
+
+    print(f"Final reading is: {reading.value} {reading.unit}")
+    plotter.plot_final_reading_circle([], point_needle_circle,
+                                      round(reading.value, 1), circle_params)
+
+
+def get_result_dicts(reading):
+    """
+    Build the content of the result file and, for readings made with
+    keep_details, of the full result file used by the evaluation.
+    """
+    if reading.is_valid():
+        result = [{
+            constants.READING_KEY: reading.value,
+            constants.MEASURE_UNIT_KEY: reading.unit
+        }]
+    else:
+        result = [{constants.READING_KEY: constants.FAILED}]
+
+    details = reading.details
+    result_full = {}
+    if not details:
+        return result, result_full
+
+    image = details['image']
+    box = details['box']
+    result_full[constants.IMG_SIZE_KEY] = {
+        'width': image.shape[1],
+        'height': image.shape[0]
+    }
+    result_full[constants.GAUGE_DET_KEY] = {
+        'x': box[0].item(),
+        'y': box[1].item(),
+        'width': box[2].item() - box[0].item(),
+        'height': box[3].item() - box[1].item(),
+    }
+
+    start_point, key_points, end_point = details['key_point_list']
+    if start_point.shape == (1, 2):
+        result_full[constants.KEYPOINT_START_KEY] = {
+            'x': start_point[0][0],
+            'y': start_point[0][1]
+        }
+    else:
+        result_full[constants.KEYPOINT_START_KEY] = constants.FAILED
+    if end_point.shape == (1, 2):
+        result_full[constants.KEYPOINT_END_KEY] = {
+            'x': end_point[0][0],
+            'y': end_point[0][1]
+        }
+    else:
+        result_full[constants.KEYPOINT_END_KEY] = constants.FAILED
+    result_full[constants.KEYPOINT_NOTCH_KEY] = []
+    for point in key_points:
+        result_full[constants.KEYPOINT_NOTCH_KEY].append({
+            'x': point[0],
+            'y': point[1]
+        })
+
+    if 'needle_mask' in details:
+        needle_mask_x, needle_mask_y = details['needle_mask']
+        result_full[constants.NEEDLE_MASK_KEY] = {
+            'x': needle_mask_x.tolist(),
+            'y': needle_mask_y.tolist()
+        }
+    else:
+        result_full[constants.NEEDLE_MASK_KEY] = constants.FAILED
+
+    return result, result_full
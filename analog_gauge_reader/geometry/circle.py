@@ -89,13 +89,12 @@ def project_point(point, circle_params):
 
 
 def get_circle_error(points, circle_params):
-    mean_dist = 0
-    n_points = len(points)
-    for point in points:
-        proj_point = project_point(point, circle_params)
-        distance = np.linalg.norm(proj_point - point)
-        mean_dist += distance / n_points
-    return mean_dist
+    """
+    Mean distance of the points to their projection on the circle.
+    """
+    distances = np.linalg.norm(project_points(points, circle_params) - points,
+                               axis=-1)
+    return np.mean(distances)
 
 
 # --------------------Intersect Line and Circle------------------------------
@@ -205,3 +204,98 @@ def get_theta_middle(theta_1, theta_2):
         return candidate_1
 
     return candidate_2
+
+
+# --------------------Batched versions------------------------------
+# Same results as the functions above, for arrays of points and circles.
+# points have shape (..., 2) and circle params shape (3,) or (..., 3),
+# leading dimensions broadcast, e.g. (N, 2) points on one circle or
+# one point per circle of a batch of frames.
+
+
+def _split_circle_params(circle_params):
+    circle_params = np.asarray(circle_params, dtype=float)
+    return circle_params[..., 0], circle_params[..., 1], circle_params[..., 2]
+
+
+def get_polar_angles(points, circle_params):
+    """Returns angles in range [0, 2*pi) with shape points.shape[:-1]"""
+    points = np.asarray(points, dtype=float)
+    x0, y0, _ = _split_circle_params(circle_params)
+    theta = np.arctan2(points[..., 1] - y0, points[..., 0] - x0)
+    return np.where(theta < 0, 2 * np.pi + theta, theta)
+
+
+def get_points_from_angles(thetas, circle_params):
+    """Returns points with shape thetas.shape + (2,)"""
+    x0, y0, r = _split_circle_params(circle_params)
+    thetas = np.asarray(thetas, dtype=float)
+    return np.stack((x0 + np.cos(thetas) * r, y0 + np.sin(thetas) * r),
+                    axis=-1)
+
+
+def project_points(points, circle_params):
+    points = np.asarray(points, dtype=float)
+    x0, y0, _ = _split_circle_params(circle_params)
+    thetas = np.arctan2(points[..., 1] - y0, points[..., 0] - x0)
+    return get_points_from_angles(thetas, circle_params)
+
+
+def get_line_circle_points(line_coeffs, x, circle_params):
+    """
+    Batched get_line_circle_point for N lines and circles.
+    :param line_coeffs: (N, 2) slope and intercept of each line
+    :param x: (N, 2) x coordinates of start and end point of each line
+    :param circle_params: (3,) or (N, 3)
+    :return: (N, 2) intersection points, nan where line and circle do not
+        intersect, and a boolean mask of the valid rows
+    """
+    line_coeffs = np.asarray(line_coeffs, dtype=float)
+    x = np.asarray(x, dtype=float)
+    m, n = line_coeffs[:, 0], line_coeffs[:, 1]
+    x0, y0, r = _split_circle_params(circle_params)
+
+    # (1 + m^2) * x^2 + 2 * (m(c - y0) - x0) * x + (x0^2 + (c - y0)^2 - r^2) = 0
+    a = 1 + m**2
+    b = 2 * (m * (n - y0) - x0)
+    c = x0**2 + (n - y0)**2 - r**2
+
+    # find_line_circle_intersection keeps roots with an imaginary part
+    # below 1e-5, that is sqrt(-discriminant) / 2a < 1e-5
+    discriminant = b**2 - 4 * a * c
+    valid = discriminant > -(2 * a * 1e-5)**2
+    sqrt_discriminant = np.sqrt(np.maximum(discriminant, 0))
+    x_intersect = np.stack(((-b + sqrt_discriminant) / (2 * a),
+                            (-b - sqrt_discriminant) / (2 * a)),
+                           axis=1)
+    y_intersect = m[:, None] * x_intersect + n[:, None]
+
+    # pick the intersection closest to the midpoint of the segment
+    midpt_x = (x[:, 0] + x[:, 1]) / 2
+    midpt_y = m * midpt_x + n
+    distances = np.hypot(x_intersect - midpt_x[:, None],
+                         y_intersect - midpt_y[:, None])
+    closest = np.argmin(distances, axis=1)
+    rows = np.arange(len(closest))
+    points = np.stack(
+        (x_intersect[rows, closest], y_intersect[rows, closest]), axis=1)
+    points[~valid] = np.nan
+    return points, valid
+
+
+def get_theta_middles(theta_1, theta_2):
+    """
+    Batched get_theta_middle.
+    """
+    theta_1 = np.asarray(theta_1, dtype=float)
+    theta_2 = np.asarray(theta_2, dtype=float)
+    candidate_1 = (theta_2 + theta_1) / 2
+    candidate_2 = np.where(theta_2 + theta_1 > 2 * np.pi,
+                           (theta_2 + theta_1 - 2 * np.pi) / 2,
+                           (theta_2 + theta_1 + 2 * np.pi) / 2)
+
+    distance_1 = np.minimum(abs(candidate_1 - theta_1),
+                            abs(candidate_1 - theta_2))
+    distance_2 = np.minimum(abs(candidate_2 - theta_1),
+                            abs(candidate_2 - theta_2))
+    return np.where(distance_1 < distance_2, candidate_1, candidate_2)
@@ -0,0 +1,150 @@
+import numpy as np
+
+from geometry.circle import fit_circle
+
+# random 3 point samples tried by RANSAC
+RANSAC_ITERATIONS = 256
+# max distance of an inlier to the circle, in pixels of the 448x448 crop
+INLIER_THRESHOLD = 4.0
+# Levenberg-Marquardt refinement on the inliers
+LM_MAX_ITERATIONS = 50
+LM_TOLERANCE = 1e-8
+# fixed seed, so the same key points always give the same circle
+RANSAC_SEED = 0
+
+
+def fit_circle_robust(x,
+                      y,
+                      n_iterations=RANSAC_ITERATIONS,
+                      threshold=INLIER_THRESHOLD,
+                      seed=RANSAC_SEED):
+    """
+    Fit a circle that ignores spurious key points.
+    RANSAC over circles through 3 random points, all samples are evaluated
+    in one array operation. The circle is then fitted algebraically to the
+    inliers of the best sample and refined geometrically with
+    Levenberg-Marquardt, which minimizes the distances to the circle.
+    :param x: x coordinates of the points
+    :param y: y coordinates of the points
+    :return: circle params (x0, y0, r) and boolean inlier mask
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_points = len(x)
+    if n_points <= 3:
+        return fit_circle(x, y), np.ones(n_points, dtype=bool)
+
+    inlier_mask = _ransac_inliers(x, y, n_iterations, threshold, seed)
+    if np.count_nonzero(inlier_mask) < 3:
+        # no 3 points agree on a circle, fall back to all points
+        inlier_mask = np.ones(n_points, dtype=bool)
+
+    circle_params = fit_circle(x[inlier_mask], y[inlier_mask])
+    circle_params = refine_circle(x[inlier_mask], y[inlier_mask],
+                                  circle_params)
+
+    # the refined circle can take back points the sample circle missed
+    refined_mask = circle_distances(x, y, circle_params) < threshold
+    if np.count_nonzero(refined_mask) >= 3 and not np.array_equal(
+            refined_mask, inlier_mask):
+        inlier_mask = refined_mask
+        circle_params = refine_circle(x[inlier_mask], y[inlier_mask],
+                                      circle_params)
+    return circle_params, inlier_mask
+
+
+def circle_distances(x, y, circle_params):
+    """
+    Absolute distance of each point to the circle.
+    """
+    x0, y0, r = circle_params
+    return np.abs(np.hypot(x - x0, y - y0) - r)
+
+
+def refine_circle(x, y, circle_params, max_iterations=LM_MAX_ITERATIONS):
+    """
+    Levenberg-Marquardt on the geometric residuals |p - c| - r.
+    :param circle_params: initial (x0, y0, r), e.g. from fit_circle
+    :return: refined (x0, y0, r)
+    """
+    params = np.array(circle_params, dtype=float)
+    residuals = _geometric_residuals(x, y, params)
+    cost = residuals @ residuals
+    damping = 1e-3
+    for _ in range(max_iterations):
+        jacobian = _geometric_jacobian(x, y, params)
+        normal = jacobian.T @ jacobian
+        gradient = jacobian.T @ residuals
+        step = np.linalg.solve(normal + damping * np.diag(np.diag(normal)) +
+                               1e-12 * np.eye(3), -gradient)
+        candidate = params + step
+        candidate_residuals = _geometric_residuals(x, y, candidate)
+        candidate_cost = candidate_residuals @ candidate_residuals
+        if candidate_cost < cost:
+            params, residuals = candidate, candidate_residuals
+            converged = cost - candidate_cost <= LM_TOLERANCE * cost
+            cost = candidate_cost
+            damping /= 10
+            if converged:
+                break
+        else:
+            damping *= 10
+            if damping > 1e10:
+                break
+    x0, y0, r = params
+    return x0, y0, abs(r)
+
+
+def _geometric_residuals(x, y, params):
+    x0, y0, r = params
+    return np.hypot(x - x0, y - y0) - r
+
+
+def _geometric_jacobian(x, y, params):
+    x0, y0, _ = params
+    distances = np.maximum(np.hypot(x - x0, y - y0), 1e-12)
+    return np.column_stack(
+        (-(x - x0) / distances, -(y - y0) / distances, -np.ones_like(x)))
+
+
+def _ransac_inliers(x, y, n_iterations, threshold, seed):
+    """
+    Inlier mask of the circle through 3 points with the most inliers,
+    ties go to the smaller sum of inlier distances.
+    """
+    rng = np.random.default_rng(seed)
+    n_points = len(x)
+    # 3 distinct indices per sample
+    samples = np.argsort(rng.random((n_iterations, n_points)), axis=1)[:, :3]
+    centers, radii = _circles_through_points(x[samples], y[samples])
+    valid = np.isfinite(radii)
+    if not np.any(valid):
+        return np.ones(n_points, dtype=bool)
+    centers, radii = centers[valid], radii[valid]
+
+    # (samples, points)
+    distances = np.abs(
+        np.hypot(x[None, :] - centers[:, :1], y[None, :] - centers[:, 1:]) -
+        radii[:, None])
+    inliers = distances < threshold
+    n_inliers = np.count_nonzero(inliers, axis=1)
+    inlier_cost = np.sum(np.where(inliers, distances, 0), axis=1)
+    best = np.lexsort((inlier_cost, -n_inliers))[0]
+    return inliers[best]
+
+
+def _circles_through_points(x, y):
+    """
+    Circumcircles of triangles, x and y have shape (N, 3).
+    :return: centers (N, 2) and radii (N,), nan radius for collinear points
+    """
+    ax, bx, cx = x[:, 0], x[:, 1], x[:, 2]
+    ay, by, cy = y[:, 0], y[:, 1], y[:, 2]
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    a_sq, b_sq, c_sq = ax**2 + ay**2, bx**2 + by**2, cx**2 + cy**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ux = (a_sq * (by - cy) + b_sq * (cy - ay) + c_sq * (ay - by)) / d
+        uy = (a_sq * (cx - bx) + b_sq * (ax - cx) + c_sq * (bx - ax)) / d
+    radii = np.hypot(ax - ux, ay - uy)
+    radii[np.abs(d) < 1e-9] = np.nan
+    return np.column_stack((ux, uy)), radii
@@ -0,0 +1,156 @@
+import os
+import logging
+
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+from key_point_detection.model import load_model, INPUT_SIZE
+
+TORCH_BACKEND = 'torch'
+ONNX_BACKEND = 'onnx'
+BACKENDS = (TORCH_BACKEND, ONNX_BACKEND)
+
+ONNX_OPSET = 17
+
+
+def check_backend(backend, device):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, choose one of {BACKENDS}")
+    if backend == ONNX_BACKEND and device != 'cpu':
+        raise ValueError("The onnx backend only runs on cpu")
+
+
+def _onnx_path(model_path):
+    # same location ultralytics exports to
+    return os.path.splitext(model_path)[0] + '.onnx'
+
+
+def _is_exported(model_path, onnx_path):
+    return os.path.isfile(onnx_path) and \
+        os.path.getmtime(onnx_path) >= os.path.getmtime(model_path)
+
+
+def _session_options(threads):
+    # imported here, onnxruntime is only needed for the onnx backend
+    import onnxruntime as ort  # pylint: disable=import-outside-toplevel
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return options
+
+
+def _has_dynamic_batch(onnx_path):
+    # imported here, onnx is only needed for the onnx backend
+    import onnx  # pylint: disable=import-outside-toplevel
+    # only the graph is read, the weights are not loaded
+    graph = onnx.load(onnx_path, load_external_data=False).graph
+    # dynamic axes have a name instead of a size
+    return bool(graph.input[0].type.tensor_type.shape.dim[0].dim_param)
+
+
+def _set_session(model, onnx_path, options):
+    """
+    ultralytics creates its onnx session without session options,
+    it is replaced by a session created with options.
+    """
+    import onnxruntime as ort  # pylint: disable=import-outside-toplevel
+    # with a dynamic batch the backend only calls session.run
+    model.predictor.model.session = ort.InferenceSession(
+        onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def load_yolo_onnx(model_path, threads=None):
+    """
+    Export a yolo .pt model to onnx once and load the export with ultralytics,
+    which does the same pre- and postprocessing as for the .pt model.
+    The export has a dynamic batch size, so batches run in one call.
+    It is redone whenever the .pt file is newer.
+    :param threads: intra op threads of onnxruntime, None for its default
+    """
+    onnx_path = _onnx_path(model_path)
+    torch_model = YOLO(model_path)
+    # exports of older versions have a fixed batch size of 1
+    if not _is_exported(model_path, onnx_path) or not _has_dynamic_batch(
+            onnx_path):
+        logging.info("Export %s to onnx", model_path)
+        # writes the onnx file next to the .pt file
+        torch_model.export(format='onnx', opset=ONNX_OPSET, dynamic=True)
+
+    model = YOLO(onnx_path, task=torch_model.task)
+    model.overrides['device'] = 'cpu'
+    model.overrides['half'] = False
+
+    # the predictor and its onnx session are only built on the first predict
+    dummy = np.zeros((INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=np.uint8)
+    model.predict(dummy)
+    if threads:
+        _set_session(model, onnx_path, _session_options(threads))
+        model.predict(dummy)
+    return model
+
+
+class OnnxKeyPointModel:
+    """
+    Key point model exported to onnx, called like the torch EncoderDecoder
+    with an image tensor and returning the heatmaps as tensor.
+    """
+    device = torch.device('cpu')
+    dtype = torch.float32
+
+    def __init__(self, onnx_path, threads=None):
+        import onnxruntime as ort  # pylint: disable=import-outside-toplevel
+        self.session = ort.InferenceSession(
+            onnx_path,
+            sess_options=_session_options(threads),
+            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, image_t):
+        heatmaps = self.session.run(
+            None, {self.input_name: image_t.numpy().astype(np.float32)})[0]
+        return torch.from_numpy(heatmaps)
+
+
+def export_key_point_model(model_path, onnx_path=None):
+    """
+    Export the key point model with dynamic batch size to onnx.
+    """
+    if onnx_path is None:
+        onnx_path = _onnx_path(model_path)
+    model = load_model(model_path)
+    model.eval()
+    dummy = torch.zeros((1, 3, *INPUT_SIZE))
+    with torch.no_grad():
+        torch.onnx.export(model,
+                          dummy,
+                          onnx_path,
+                          opset_version=ONNX_OPSET,
+                          input_names=['image'],
+                          output_names=['heatmaps'],
+                          dynamic_axes={
+                              'image': {
+                                  0: 'batch'
+                              },
+                              'heatmaps': {
+                                  0: 'batch'
+                              }
+                          })
+    return onnx_path
+
+
+def load_key_point_onnx(model_path, threads=None):
+    """
+    Export the key point model to onnx once and load it with onnxruntime.
+    The export is redone whenever the .pt file is newer.
+    """
+    onnx_path = _onnx_path(model_path)
+    if not _is_exported(model_path, onnx_path):
+        logging.info("Export %s to onnx", model_path)
+        export_key_point_model(model_path, onnx_path)
+
+    model = OnnxKeyPointModel(onnx_path, threads)
+    model(torch.zeros((1, 3, *INPUT_SIZE)))
+    return model
@@ -0,0 +1,117 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+from key_point_dataset import merge_heatmaps
+
+# same random augmentation as custom_transforms
+AUGMENT_PROBABILITY = 0.9
+MAX_ANGLE = 180
+UPSCALE = 1.2
+JITTER_PROBABILITY = 0.5
+JITTER_RANGE = (0.8, 1.2)
+
+# weights of the grayscale conversion in TF.adjust_contrast
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+class BatchAugmentation:
+    """
+    collate_fn that augments a whole batch of uint8 samples at once,
+    in the DataLoader workers. Rotation, upscaling and the random crop of
+    custom_transforms are combined into one affine warp per sample, which is
+    applied to the image and its heatmaps with a single grid_sample.
+    Brightness and contrast are then changed in place on the float batch.
+    Samples are (image, heatmaps) uint8 tensors of shape C x H x W,
+    e.g. from KeypointStoreDataSet with batch_augmentation=True.
+    """
+    def __init__(self, train=True):
+        self.train = train
+
+    def __call__(self, samples):
+        images = torch.stack([image for image, _ in samples]).float().div_(255)
+        heatmaps = torch.stack([heatmap for _, heatmap in samples
+                                ]).float().div_(255)
+        if self.train:
+            images, heatmaps = augment_batch(images, heatmaps)
+        return images, merge_heatmaps(heatmaps)
+
+
+def augment_batch(images, heatmaps):
+    """
+    :param images: B x 3 x H x W floats between 0 and 1
+    :param heatmaps: B x N x H x W floats between 0 and 1
+    :return: augmented images and heatmaps
+    """
+    batch_size, n_channels, height, width = images.shape
+    augmented = torch.rand(batch_size) < AUGMENT_PROBABILITY
+    if not torch.any(augmented):
+        return images, heatmaps
+
+    # warp image and heatmaps together, channels are stacked
+    theta = random_affine(int(augmented.sum()), height)
+    stacked = torch.cat((images[augmented], heatmaps[augmented]), dim=1)
+    grid = F.affine_grid(theta, list(stacked.shape), align_corners=False)
+    warped = F.grid_sample(stacked,
+                           grid,
+                           mode='bilinear',
+                           padding_mode='zeros',
+                           align_corners=False)
+    images[augmented] = warped[:, :n_channels]
+    heatmaps[augmented] = warped[:, n_channels:]
+
+    jittered = augmented & (torch.rand(batch_size) < JITTER_PROBABILITY)
+    if torch.any(jittered):
+        images[jittered] = jitter(images[jittered])
+    return images, heatmaps
+
+
+def random_affine(n_samples, size):
+    """
+    Affine matrices for affine_grid of a random rotation, an upscale by
+    UPSCALE and a random size x size crop of the upscaled image, like the
+    sequence TF.rotate, Resize and TF.crop in custom_transforms.
+    Maps normalized output coordinates to normalized input coordinates.
+    """
+    angle = torch.randint(-MAX_ANGLE, MAX_ANGLE + 1, (n_samples, )).double()
+    angle = angle * math.pi / 180
+    new_size = int(UPSCALE * size)
+    # top left corner of the crop in the upscaled image
+    offset = torch.randint(0, new_size - size + 1, (n_samples, 2)).double()
+
+    scale = size / new_size
+    center = (size - 1) / 2
+    # crop and upscale: pixel of the crop -> pixel of the rotated image,
+    # in coordinates around the image center
+    translation = scale * (center + offset + 0.5) - 0.5 - center
+
+    # TF.rotate turns counter clockwise, the grid needs the inverse rotation
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    inverse_rotation = torch.stack(
+        (torch.stack((cos, -sin), dim=1), torch.stack((sin, cos), dim=1)),
+        dim=1)
+
+    theta = torch.empty(n_samples, 2, 3, dtype=torch.float64)
+    theta[:, :, :2] = scale * inverse_rotation
+    theta[:, :, 2] = 2 / size * torch.einsum('bij,bj->bi', inverse_rotation,
+                                             translation)
+    return theta.float()
+
+
+def jitter(images):
+    """
+    Random brightness then contrast factor per sample, like
+    TF.adjust_brightness and TF.adjust_contrast. Works in place.
+    """
+    n_samples = images.shape[0]
+    low, high = JITTER_RANGE
+    brightness = torch.empty(n_samples, 1, 1, 1).uniform_(low, high)
+    contrast = torch.empty(n_samples, 1, 1, 1).uniform_(low, high)
+
+    images.mul_(brightness).clamp_(0, 1)
+    weights = torch.tensor(GRAY_WEIGHTS).view(1, 3, 1, 1)
+    mean = (images * weights).sum(dim=1, keepdim=True).mean(dim=(2, 3),
+                                                            keepdim=True)
+    images.mul_(contrast).add_((1 - contrast) * mean).clamp_(0, 1)
+    return images
@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+# Append path of parent directory to system to import all modules correctly
+parent_dir = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
+sys.path.append(parent_dir)
+
+# pylint: disable=wrong-import-position
+from key_point_dataset import KeypointStoreDataSet, TRAIN_PATH, IMG_PATH, \
+    LABEL_PATH, STORE_PATH, build_store, store_is_current
+from batch_augmentation import BatchAugmentation
+
+
+def samples_per_second(dataloader, n_batches):
+    n_samples = 0
+    start = time.perf_counter()
+    for index, (images, _) in enumerate(dataloader):
+        n_samples += len(images)
+        if index + 1 == n_batches:
+            break
+    return n_samples / (time.perf_counter() - start)
+
+
+def main():
+    args = read_args()
+    torch.manual_seed(0)
+
+    store_folder = os.path.join(args.data, TRAIN_PATH, STORE_PATH)
+    image_folder = os.path.join(args.data, TRAIN_PATH, IMG_PATH)
+    annotation_folder = os.path.join(args.data, TRAIN_PATH, LABEL_PATH)
+    if not store_is_current(store_folder, image_folder, annotation_folder):
+        build_store(image_folder, annotation_folder, store_folder)
+
+    # both read the same store, so only the augmentation differs
+    dataloaders = {
+        'per sample (PIL)':
+        DataLoader(KeypointStoreDataSet(store_folder, train=True),
+                   batch_size=args.batch_size,
+                   shuffle=True,
+                   num_workers=args.workers),
+        'batched (grid_sample)':
+        DataLoader(KeypointStoreDataSet(store_folder,
+                                        train=True,
+                                        batch_augmentation=True),
+                   batch_size=args.batch_size,
+                   shuffle=True,
+                   num_workers=args.workers,
+                   collate_fn=BatchAugmentation(train=True)),
+    }
+    for name, dataloader in dataloaders.items():
+        speed = samples_per_second(dataloader, args.batches)
+        print(f"{name}: {speed:.1f} samples/s")
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data',
+                        type=str,
+                        required=True,
+                        help="Base path of data")
+    parser.add_argument('--batches',
+                        type=int,
+                        default=50,
+                        help="Number of batches per augmentation")
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help="DataLoader workers, 0 measures a single core")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
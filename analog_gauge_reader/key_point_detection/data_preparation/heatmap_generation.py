@@ -1,4 +1,5 @@
 import argparse
+import functools
 import json
 import os
 
@@ -125,11 +126,48 @@ def generate_heatmap(key_point_list, img=None, size=(448, 448)):
     return heatmap.numpy()
 
 
+@functools.lru_cache(maxsize=None)
+def gaussian_kernel(sigma=8):
+    """
+    Unnormalized gaussian of add_gaussian_to_heatmap, center value 1.
+    """
+    tmp_size = sigma * 3
+    window = np.arange(2 * tmp_size + 1, dtype=np.float32) - tmp_size
+    profile = np.exp(-window**2 / (2 * sigma**2))
+    return np.outer(profile, profile)
+
+
+def generate_heatmap_array(key_point_list, size=(448, 448), sigma=8):
+    """
+    Same heatmap as generate_heatmap, in numpy without torch.
+    The kernel is computed once and every key point is a single slice maximum.
+    """
+    heatmap = np.zeros(size, dtype=np.float32)
+    kernel = gaussian_kernel(sigma)
+    tmp_size = sigma * 3
+    h, w = size
+    for key_point in key_point_list:
+        x = key_point['x'] * size[0] / 100
+        y = key_point['y'] * size[1] / 100
+        # same window as add_gaussian_to_heatmap
+        x1, y1 = int(x - tmp_size), int(y - tmp_size)
+        x2, y2 = int(x + tmp_size + 1), int(y + tmp_size + 1)
+        img_x_min, img_x_max = max(0, x1), min(x2, w)
+        img_y_min, img_y_max = max(0, y1), min(y2, h)
+        if img_x_min >= img_x_max or img_y_min >= img_y_max:
+            continue
+        region = heatmap[img_y_min:img_y_max, img_x_min:img_x_max]
+        np.maximum(region,
+                   kernel[img_y_min - y1:img_y_max - y1, img_x_min - x1:img_x_max - x1],
+                   out=region)
+    return heatmap
+
+
 def heatmap_from_key_points(annotation, size):
     size = (size, size)
-    heatmap_start = generate_heatmap(annotation['start'], size=size)
-    heatmap_middle = generate_heatmap(annotation['middle'], size=size)
-    heatmap_end = generate_heatmap(annotation['end'], size=size)
+    heatmap_start = generate_heatmap_array(annotation['start'], size=size)
+    heatmap_middle = generate_heatmap_array(annotation['middle'], size=size)
+    heatmap_end = generate_heatmap_array(annotation['end'], size=size)
 
     heatmap = np.stack((heatmap_start, heatmap_middle, heatmap_end), axis=0)
     return heatmap
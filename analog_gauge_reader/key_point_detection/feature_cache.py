@@ -0,0 +1,134 @@
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from model import ENCODER_MODEL_NAME, INPUT_SIZE, N_HEATMAPS, DINO_CHANNELS
+
+FEATURE_PATH = 'features'
+FEATURES_FILE = 'features.npy'
+HEATMAPS_FILE = 'heatmaps.npy'
+# written last, a cache without it is incomplete
+META_FILE = 'meta.json'
+
+# views per image, the first one without augmentation
+N_AUGMENTED_VIEWS = 8
+PATCH_SIZE = 14
+
+
+class FeatureCacheDataSet(Dataset):
+    """
+    Encoder features and target heatmaps written by build_feature_cache.
+    Both are memory mapped and turned into tensors without copying,
+    so an epoch only runs the decoder.
+    """
+    def __init__(self, cache_dir):
+        # copy on write: writable for torch.from_numpy, the file is never changed
+        self.features = np.load(os.path.join(cache_dir, FEATURES_FILE),
+                                mmap_mode='c')
+        self.heatmaps = np.load(os.path.join(cache_dir, HEATMAPS_FILE),
+                                mmap_mode='c')
+        assert len(self.features) == len(self.heatmaps)
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, index):
+        features = torch.from_numpy(self.features[index]).float()
+        heatmaps = torch.from_numpy(self.heatmaps[index]).float().div_(255)
+        return features, heatmaps
+
+
+def feature_cache_is_current(cache_dir, signature):
+    """
+    True if the cache is complete and was built with the same encoder from
+    the data with this signature, see key_point_dataset.data_signature.
+    The number of views is part of the folder name.
+    """
+    meta_path = os.path.join(cache_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta['encoder'] == ENCODER_MODEL_NAME and meta.get(
+        'signature') == signature
+
+
+def build_feature_cache(encoder,
+                        plain_dataset,
+                        augmented_dataset,
+                        cache_dir,
+                        signature,
+                        n_views=N_AUGMENTED_VIEWS,
+                        device='cpu',
+                        batch_size=8,
+                        num_workers=4,
+                        collate_fn=None):
+    """
+    Run the frozen encoder once per view of every image and write the patch
+    features (float16) and the matching target heatmaps (uint8) to memory
+    mapped .npy files in cache_dir.
+    The first view of an image comes from plain_dataset, the other
+    n_views - 1 from augmented_dataset, which augments on every access
+    or, with collate_fn, when its samples are collated.
+    signature identifies the training data, see feature_cache_is_current.
+    """
+    n_images = len(plain_dataset)
+    height, width = INPUT_SIZE[0] // PATCH_SIZE, INPUT_SIZE[1] // PATCH_SIZE
+
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    features = np.lib.format.open_memmap(os.path.join(cache_dir,
+                                                      FEATURES_FILE),
+                                         mode='w+',
+                                         dtype=np.float16,
+                                         shape=(n_views * n_images,
+                                                DINO_CHANNELS, height, width))
+    heatmaps = np.lib.format.open_memmap(os.path.join(cache_dir,
+                                                      HEATMAPS_FILE),
+                                         mode='w+',
+                                         dtype=np.uint8,
+                                         shape=(n_views * n_images,
+                                                N_HEATMAPS) + INPUT_SIZE)
+
+    encoder.to(device)
+    for view in range(n_views):
+        if view == 0:
+            dataloader = DataLoader(plain_dataset,
+                                    batch_size=batch_size,
+                                    shuffle=False,
+                                    num_workers=num_workers)
+        else:
+            dataloader = DataLoader(augmented_dataset,
+                                    batch_size=batch_size,
+                                    shuffle=False,
+                                    num_workers=num_workers,
+                                    collate_fn=collate_fn)
+        index = view * n_images
+        for inputs, annotations in dataloader:
+            with torch.no_grad():
+                batch_features = encoder(inputs.to(device))
+            end = index + len(inputs)
+            features[index:end] = batch_features.half().cpu().numpy()
+            # quantized like the heatmaps of the store
+            heatmaps[index:end] = torch.round(annotations * 255).to(
+                torch.uint8).numpy()
+            index = end
+        print(f"Cached features of view {view + 1}/{n_views}")
+    features.flush()
+    heatmaps.flush()
+    del features, heatmaps
+
+    with open(meta_path, 'w') as f:
+        json.dump(
+            {
+                'encoder': ENCODER_MODEL_NAME,
+                'views': n_views,
+                'images': n_images,
+                'signature': signature
+            }, f)
@@ -1,3 +1,4 @@
+import json
 import os
 import random
 import numpy as np
@@ -19,6 +20,12 @@ RUN_PATH = 'runs'
 VAL_PATH = 'val'
 TEST_PATH = 'test'
 
+STORE_PATH = 'store'
+STORE_IMAGES = 'images.npy'
+STORE_HEATMAPS = 'heatmaps.npy'
+# written last, a store without it is incomplete
+STORE_NAMES = 'names.json'
+
 HEATMAP_PREFIX = "H_"
 KEY_POINT_PREFIX = "K_"
 
@@ -62,12 +69,7 @@ class KeypointImageDataSet(Dataset):
         transformed_image, transformed_annotation = custom_transforms(
             self.train, image, annotations_image, self.debug)
 
-        if N_HEATMAPS == 1:
-            transformed_annotation = torch.max(transformed_annotation,
-                                               axis=0).values.unsqueeze(0)
-        elif N_HEATMAPS == 3:
-            transformed_annotation[1, :, :] = torch.max(transformed_annotation,
-                                                        axis=0).values
+        transformed_annotation = merge_heatmaps(transformed_annotation)
 
         # Convert to tensors
         if self.val:
@@ -78,6 +80,164 @@ class KeypointImageDataSet(Dataset):
         return self.image_files[index][:-4]
 
 
+class KeypointStoreDataSet(Dataset):
+    """
+    Same samples as KeypointImageDataSet, read from a store written by build_store.
+    The arrays are memory mapped, so a sample is a slice of the page cache
+    instead of a decoded image and a heatmap rebuilt on every epoch.
+    Without augmentation the tensors are created from the slices without copying.
+    With batch_augmentation the samples are the uint8 tensors, augmented
+    later for the whole batch by batch_augmentation.BatchAugmentation.
+    """
+    def __init__(self,
+                 store_dir,
+                 train=False,
+                 val=False,
+                 debug=False,
+                 batch_augmentation=False):
+        random.seed(0)
+        # copy on write: writable for torch.from_numpy, the file is never changed
+        self.images = np.load(os.path.join(store_dir, STORE_IMAGES),
+                              mmap_mode='c')
+        self.heatmaps = np.load(os.path.join(store_dir, STORE_HEATMAPS),
+                                mmap_mode='c')
+        with open(os.path.join(store_dir, STORE_NAMES)) as f:
+            self.names = json.load(f)
+
+        self.train = train
+        self.val = val
+
+        self.debug = debug
+        self.batch_augmentation = batch_augmentation
+
+        assert len(self.images) == len(self.heatmaps) == len(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        image = self.images[index]
+        heatmap = self.heatmaps[index]
+
+        if self.batch_augmentation:
+            return torch.from_numpy(image), torch.from_numpy(heatmap)
+
+        if self.train:
+            transformed_image, transformed_annotation = custom_transforms(
+                self.train, Image.fromarray(image.transpose(1, 2, 0)),
+                Image.fromarray(heatmap.transpose(1, 2, 0)),
+                self.debug)
+        else:
+            # same values as ToTensor on the resized images
+            transformed_image = torch.from_numpy(image).float().div_(255)
+            transformed_annotation = torch.from_numpy(heatmap).float().div_(255)
+
+        transformed_annotation = merge_heatmaps(transformed_annotation)
+
+        if self.val:
+            return transformed_image, Image.fromarray(image.transpose(
+                1, 2, 0)), transformed_annotation
+        return transformed_image, transformed_annotation
+
+    def get_name(self, index):
+        return self.names[index]
+
+
+def merge_heatmaps(annotation):
+    """
+    Heatmaps for N_HEATMAPS outputs from the start, middle and end heatmaps,
+    the middle heatmap gets all notches.
+    Works on single samples (3 x H x W) and batches (B x 3 x H x W).
+    """
+    if N_HEATMAPS == 1:
+        return torch.max(annotation, dim=-3, keepdim=True).values
+    if N_HEATMAPS == 3:
+        annotation[..., 1, :, :] = torch.max(annotation, dim=-3).values
+    return annotation
+
+
+def build_store(img_dir, annotations_dir, store_dir):
+    """
+    Decode and resize all images and heatmaps once and write them to
+    memory mapped .npy files in store_dir, as uint8 N x 3 x H x W arrays.
+    Images are resized like in custom_transforms and heatmaps are quantized
+    like in annotations_np_to_img, so the store gives the same tensors as
+    KeypointImageDataSet.
+    """
+    image_files = sorted(os.listdir(img_dir))
+    annotation_files = sorted(os.listdir(annotations_dir))
+    assert len(image_files) == len(annotation_files)
+
+    os.makedirs(store_dir, exist_ok=True)
+    names_path = os.path.join(store_dir, STORE_NAMES)
+    if os.path.exists(names_path):
+        os.remove(names_path)
+
+    shape = (len(image_files), 3) + INPUT_SIZE
+    images = np.lib.format.open_memmap(os.path.join(store_dir, STORE_IMAGES),
+                                       mode='w+',
+                                       dtype=np.uint8,
+                                       shape=shape)
+    heatmaps = np.lib.format.open_memmap(os.path.join(store_dir,
+                                                      STORE_HEATMAPS),
+                                         mode='w+',
+                                         dtype=np.uint8,
+                                         shape=shape)
+    resize = transforms.Resize(INPUT_SIZE,
+                               transforms.InterpolationMode.BILINEAR)
+    for index, (image_file, annotation_file) in enumerate(
+            zip(image_files, annotation_files)):
+        image = Image.open(os.path.join(img_dir, image_file)).convert("RGB")
+        annotation = annotations_np_to_img(
+            np.load(os.path.join(annotations_dir, annotation_file)))
+        images[index] = np.asarray(resize(image)).transpose(2, 0, 1)
+        heatmaps[index] = np.asarray(resize(annotation)).transpose(2, 0, 1)
+    images.flush()
+    heatmaps.flush()
+    del images, heatmaps
+
+    with open(names_path, 'w') as f:
+        json.dump([image_file[:-4] for image_file in image_files], f)
+
+
+def data_signature(img_dir, annotations_dir):
+    """
+    Names of the images and the last modification of any image or label,
+    changes when images or labels are added, removed or changed.
+    """
+    image_files = sorted(os.listdir(img_dir))
+    modified = max((os.path.getmtime(os.path.join(directory, file_name))
+                    for directory in (img_dir, annotations_dir)
+                    for file_name in os.listdir(directory)),
+                   default=0.0)
+    return {
+        'names': [image_file[:-4] for image_file in image_files],
+        'modified': modified
+    }
+
+
+def store_is_current(store_dir, img_dir, annotations_dir):
+    """
+    True if the store in store_dir is complete and was built from the
+    current files, no image or label was added, removed or changed since.
+    """
+    names_path = os.path.join(store_dir, STORE_NAMES)
+    if not os.path.exists(names_path):
+        return False
+    with open(names_path) as f:
+        names = json.load(f)
+    image_files = sorted(os.listdir(img_dir))
+    if names != [image_file[:-4] for image_file in image_files]:
+        return False
+    if len(os.listdir(annotations_dir)) != len(image_files):
+        return False
+    built = os.path.getmtime(names_path)
+    return all(
+        os.path.getmtime(os.path.join(directory, file_name)) <= built
+        for directory in (img_dir, annotations_dir)
+        for file_name in os.listdir(directory))
+
+
 def custom_transforms(train, image, annotation=None, debug=False):
 
     resize = transforms.Resize(INPUT_SIZE,
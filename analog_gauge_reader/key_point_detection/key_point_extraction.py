@@ -1,26 +1,53 @@
 import numpy as np
 from sklearn.cluster import MeanShift, KMeans
+from scipy import ndimage
 from scipy.spatial.distance import cdist
 
 MEAN_DIST_KEY = "mean distance of predicted and true"
 PCK_KEY = "Percentage of true where at least one predicted is close"
 NON_ASSIGNED_KEY = "Percentage non assigned predicted points"
 
+MEAN_SHIFT_METHOD = 'mean_shift'
+NMS_METHOD = 'nms'
+EXTRACTION_METHODS = (MEAN_SHIFT_METHOD, NMS_METHOD)
+
+
+def full_key_point_extraction(heatmaps,
+                              threshold=0.5,
+                              bandwidth=20,
+                              method=MEAN_SHIFT_METHOD):
+    """
+    Extract start, middle and end key points from the three heatmaps.
+    :param method: 'mean_shift' clusters all pixels above the threshold,
+        'nms' takes the local maxima of the heatmap, which is much faster.
+    :param bandwidth: mean shift bandwidth, for nms peaks closer than
+        half the bandwidth are suppressed
+    :return: list [start, middle, end] of arrays with shape (n, 2)
+    """
+    if method not in EXTRACTION_METHODS:
+        raise ValueError(
+            f"Unknown extraction method {method}, choose one of {EXTRACTION_METHODS}")
 
-def full_key_point_extraction(heatmaps, threshold=0.5, bandwidth=20):
     key_point_list = []
     for i in range(heatmaps.shape[0]):
         # middle
         if i == 1:
-            cluster_centers = extract_key_points(heatmaps[i], threshold,
-                                                 bandwidth)
+            if method == NMS_METHOD:
+                cluster_centers = extract_key_points_nms(
+                    heatmaps[i], threshold, bandwidth)
+            else:
+                cluster_centers = extract_key_points(heatmaps[i], threshold,
+                                                     bandwidth)
             key_point_list.append(cluster_centers)
         # start and end
-        elif i == 0:
-            cluster_center = extract_start_end_points(heatmaps[i], threshold, is_start=True)
-            key_point_list.append(cluster_center)
-        elif i == 2:
-            cluster_center = extract_start_end_points(heatmaps[i], threshold, is_start=False)
+        elif i in (0, 2):
+            is_start = i == 0
+            if method == NMS_METHOD:
+                cluster_center = extract_start_end_points_nms(
+                    heatmaps[i], threshold, is_start, bandwidth)
+            else:
+                cluster_center = extract_start_end_points(
+                    heatmaps[i], threshold, is_start)
             key_point_list.append(cluster_center)
     return key_point_list
 
@@ -77,6 +104,85 @@ def extract_key_points(heatmap, threshold, bandwidth):
     return cluster_centers
 
 
+def extract_key_points_nms(heatmap, threshold, bandwidth):
+    """
+    Non maximum suppression with a max filter, every pixel that is the
+    maximum of its window and above the threshold is a peak.
+    The peaks are refined to sub pixel accuracy with the weighted
+    centroid of the heatmap around them.
+    """
+    # normalize heatmap to range 0, 1
+    heatmap = heatmap / np.max(heatmap)
+    window_size = _nms_window_size(bandwidth)
+
+    local_max = ndimage.maximum_filter(heatmap,
+                                       size=window_size,
+                                       mode='constant')
+    peak_mask = (heatmap == local_max) & (heatmap > threshold)
+
+    # a plateau gives several equal maxima next to each other, keep one of them
+    labels, n_peaks = ndimage.label(peak_mask)
+    if n_peaks == 0:
+        return np.empty((0, 2))
+    peaks = ndimage.center_of_mass(peak_mask, labels, range(1, n_peaks + 1))
+    peaks = np.rint(np.array(peaks)).astype(int)
+
+    return _refine_peaks(heatmap, threshold, peaks, window_size)
+
+
+def extract_start_end_points_nms(heatmap, threshold, is_start, bandwidth):
+    """
+    Strongest peak in the same region of the heatmap as for
+    extract_start_end_points, refined like in extract_key_points_nms.
+    """
+    # normalize heatmap to range 0, 1
+    heatmap = heatmap / np.max(heatmap)
+
+    width, height = heatmap.shape
+    rows, cols = np.indices(heatmap.shape)
+    if is_start:
+        mask = (cols <= width * 0.6) & (rows >= height * 0.4)
+    else:
+        mask = (cols >= width * 0.4) & (rows >= height * 0.4)
+    heatmap = np.where(mask, heatmap, 0)
+
+    if np.max(heatmap) <= threshold:
+        return np.empty((0, 2))
+    peak = np.unravel_index(np.argmax(heatmap), heatmap.shape)
+
+    return _refine_peaks(heatmap, threshold, np.array([peak]),
+                         _nms_window_size(bandwidth))
+
+
+def _nms_window_size(bandwidth):
+    # odd size, so the window is centered on the pixel
+    return 2 * (bandwidth // 2) + 1
+
+
+def _refine_peaks(heatmap, threshold, peaks, window_size):
+    """
+    Weighted centroid of the pixels above the threshold in the window
+    around each peak. The window sums come from box filters over the
+    whole heatmap, so all peaks are refined at once.
+    :param peaks: integer array of shape (n, 2) with (row, col)
+    :return: array of shape (n, 2) with (x, y)
+    """
+    weights = np.where(heatmap > threshold, heatmap, 0).astype(np.float64)
+    rows, cols = np.indices(heatmap.shape)
+
+    # box filters give window means, the window size cancels in the ratio
+    weight_sum = ndimage.uniform_filter(weights, window_size, mode='constant')
+    x_sum = ndimage.uniform_filter(weights * cols, window_size, mode='constant')
+    y_sum = ndimage.uniform_filter(weights * rows, window_size, mode='constant')
+
+    peak_rows, peak_cols = peaks[:, 0], peaks[:, 1]
+    total = weight_sum[peak_rows, peak_cols]
+    x = x_sum[peak_rows, peak_cols] / total
+    y = y_sum[peak_rows, peak_cols] / total
+
+    return np.stack((x, y), axis=1)
+
+
 def key_point_metrics(predicted, ground_truth, threshold=10):
     """
     Gives back three different metrics to evaluate the predicted keypoints.
@@ -1,29 +1,56 @@
+import torch
 from PIL import Image
 
-from key_point_detection.key_point_extraction import full_key_point_extraction
-from key_point_detection.model import load_model
+from key_point_detection.key_point_extraction import full_key_point_extraction, \
+    MEAN_SHIFT_METHOD
 from key_point_detection.key_point_dataset import custom_transforms
+from model_registry import get_key_point_model
 
 
 class KeyPointInference:
-    def __init__(self, model_path):
-
-        self.model = load_model(model_path)
+    def __init__(self, model_path, device=None, precision=None):
+        # loaded once per process, constructing this class is cheap
+        self.model = get_key_point_model(model_path, device, precision)
+        if isinstance(self.model, torch.nn.Module):
+            parameter = next(self.model.parameters())
+            self.device = parameter.device
+            self.dtype = parameter.dtype
+        else:
+            # onnx backend
+            self.device = self.model.device
+            self.dtype = self.model.dtype
 
     def predict_heatmaps(self, image):
 
         img = Image.fromarray(image)
         image_t = custom_transforms(train=False, image=img)
-        image_t = image_t.unsqueeze(0)
+        image_t = image_t.unsqueeze(0).to(self.device, self.dtype)
 
-        heatmaps = self.model(image_t)
+        with torch.no_grad():
+            heatmaps = self.model(image_t)
 
-        heatmaps = heatmaps.detach().squeeze(0).numpy()
+        heatmaps = heatmaps.float().cpu().squeeze(0).numpy()
 
         return heatmaps
 
+    def predict_heatmaps_batch(self, images):
+        """
+        Stack all images into one batch and predict their heatmaps in one forward pass.
+        :param images: list of numpy images, all with the model input size
+        :return: numpy array with shape (n_images, n_heatmaps, height, width)
+        """
+        image_t = torch.stack([
+            custom_transforms(train=False, image=Image.fromarray(image))
+            for image in images
+        ]).to(self.device, self.dtype)
+
+        with torch.no_grad():
+            heatmaps = self.model(image_t)
+
+        return heatmaps.float().cpu().numpy()
+
 
-def detect_key_points(heatmaps):
-    key_point_list = full_key_point_extraction(heatmaps, 0.6)
+def detect_key_points(heatmaps, method=MEAN_SHIFT_METHOD):
+    key_point_list = full_key_point_extraction(heatmaps, 0.6, method=method)
 
     return key_point_list
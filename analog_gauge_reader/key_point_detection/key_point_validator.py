@@ -5,6 +5,7 @@ import sys
 import json
 
 import numpy as np
+import torch
 import matplotlib
 import matplotlib.pyplot as plt
 
@@ -15,8 +16,8 @@ sys.path.append(parent_dir)
 from key_point_dataset import KeypointImageDataSet, \
     IMG_PATH, LABEL_PATH, TRAIN_PATH, RUN_PATH, custom_transforms
 from key_point_extraction import full_key_point_extraction, key_point_metrics,  \
-        MEAN_DIST_KEY, PCK_KEY, NON_ASSIGNED_KEY
-from model import load_model, N_HEATMAPS
+        MEAN_DIST_KEY, PCK_KEY, NON_ASSIGNED_KEY, MEAN_SHIFT_METHOD, EXTRACTION_METHODS
+from model import load_model, N_HEATMAPS, PRECISIONS
 
 matplotlib.use('Agg')
 
@@ -31,10 +32,25 @@ TEST_PATH = 'test'
 
 MIDDLE_KEY = "middle"
 START_END_KEY = "start_end"
+TIME_KEY = "mean extraction time in seconds"
+INFERENCE_TIME_KEY = "mean inference time in seconds"
+HEATMAP_DIFF_KEY = "mean absolute heatmap difference to fp32"
+FAILED_KEY = "images without key points"
 
 
 class KeyPointVal:
-    def __init__(self, model, base_path, time_str=None):
+    def __init__(self,
+                 model,
+                 base_path,
+                 time_str=None,
+                 extraction_method=MEAN_SHIFT_METHOD,
+                 compare_extraction=False):
+        """
+        :param extraction_method: key point extraction used for the predictions
+        :param compare_extraction: additionally run all extraction methods
+            on the predicted heatmaps and write their metrics and timings
+            to key_point_extraction_comparison.json
+        """
 
         self.time_str = time_str if time_str is not None else time.strftime(
             "%Y%m%d-%H%M%S")
@@ -48,6 +64,8 @@ class KeyPointVal:
 
         self.base_path = base_path
         self.model = model
+        self.extraction_method = extraction_method
+        self.compare_extraction = compare_extraction
 
         self.train_dataset = KeypointImageDataSet(
             img_dir=train_image_folder,
@@ -63,6 +81,7 @@ class KeyPointVal:
 
     def validate_set(self, path, dataset):
         key_point_metrics_dict = {}
+        comparison_dict = {method: {} for method in EXTRACTION_METHODS}
         for index, data in enumerate(dataset):
             print(index)
             image, original_image, annotation = data
@@ -80,11 +99,16 @@ class KeyPointVal:
             plot_heatmaps(heatmaps, annotation, heatmap_file_path)
 
             # Extract key points
-            key_points_predicted = full_key_point_extraction(heatmaps,
-                                                             threshold=0.6)
+            key_points_predicted = full_key_point_extraction(
+                heatmaps, threshold=0.6, method=self.extraction_method)
             key_points_true = full_key_point_extraction(
                 annotation.detach().numpy(), threshold=0.95)
 
+            if self.compare_extraction:
+                for method in EXTRACTION_METHODS:
+                    comparison_dict[method][image_name] = compare_extraction(
+                        heatmaps, key_points_true, method)
+
             print("key points extracted")
 
             key_point_metrics_dict[image_name] = {}
@@ -118,6 +142,17 @@ class KeyPointVal:
         with open(metrics_file_path, "w") as outfile:
             outfile.write(full_metrics_json)
 
+        if self.compare_extraction:
+            comparison = {
+                method: evaluate_comparison(method_dict)
+                for method, method_dict in comparison_dict.items()
+            }
+            print(json.dumps(comparison, indent=4))
+            comparison_file_path = os.path.join(
+                path, "key_point_extraction_comparison.json")
+            with open(comparison_file_path, "w") as outfile:
+                outfile.write(json.dumps(comparison, indent=4))
+
     def validate(self):
         run_path = os.path.join(self.base_path, RUN_PATH + '_' + self.time_str)
         train_path = os.path.join(run_path, TRAIN_PATH)
@@ -155,6 +190,128 @@ def evaluate_total_metrics(metrics_dict, key):
     return full_metrics_dict
 
 
+def compare_extraction(heatmaps, key_points_true, method):
+    """
+    Time one extraction method on the predicted heatmaps and
+    compute its metrics against the true key points.
+    Metrics are None if the method found no key points.
+    """
+    start = time.perf_counter()
+    key_points = full_key_point_extraction(heatmaps,
+                                           threshold=0.6,
+                                           method=method)
+    elapsed = time.perf_counter() - start
+
+    single_metrics_dict = {TIME_KEY: elapsed}
+    start_end = np.vstack((key_points[0], key_points[2]))
+    if len(key_points[1]) == 0 or len(start_end) == 0:
+        single_metrics_dict[MIDDLE_KEY] = None
+        single_metrics_dict[START_END_KEY] = None
+        return single_metrics_dict
+
+    single_metrics_dict[MIDDLE_KEY] = key_point_metrics(
+        key_points[1], key_points_true[1])
+    single_metrics_dict[START_END_KEY] = key_point_metrics(
+        start_end, np.vstack((key_points_true[0], key_points_true[2])))
+    return single_metrics_dict
+
+
+def evaluate_comparison(method_dict):
+    valid_dict = {
+        name: single_metrics_dict
+        for name, single_metrics_dict in method_dict.items()
+        if single_metrics_dict[MIDDLE_KEY] is not None
+    }
+    full_metrics_dict = {
+        TIME_KEY: np.mean([d[TIME_KEY] for d in method_dict.values()]),
+        FAILED_KEY: len(method_dict) - len(valid_dict),
+    }
+    if valid_dict:
+        full_metrics_dict[MIDDLE_KEY] = evaluate_total_metrics(
+            valid_dict, MIDDLE_KEY)
+        full_metrics_dict[START_END_KEY] = evaluate_total_metrics(
+            valid_dict, START_END_KEY)
+    return full_metrics_dict
+
+
+def compare_precisions(model_path, base_path, precisions, time_str=None):
+    """
+    Load the model with every precision, run it on the validation set
+    and compare the key point metrics, the inference time and the
+    difference of the heatmaps to the fp32 model.
+    Results are written to precision_comparison.json in a new run folder.
+    """
+    time_str = time_str if time_str is not None else time.strftime(
+        "%Y%m%d-%H%M%S")
+    run_path = os.path.join(base_path, RUN_PATH + '_' + time_str)
+    os.makedirs(run_path, exist_ok=True)
+
+    dataset = KeypointImageDataSet(
+        img_dir=os.path.join(base_path, VAL_PATH, IMG_PATH),
+        annotations_dir=os.path.join(base_path, VAL_PATH, LABEL_PATH),
+        train=False,
+        val=True)
+
+    precisions = ['fp32'] + [p for p in precisions if p != 'fp32']
+    models = {}
+    for precision in precisions:
+        models[precision] = load_model(model_path, precision)
+        models[precision].eval()
+
+    metrics_dicts = {precision: {} for precision in precisions}
+    inference_times = {precision: [] for precision in precisions}
+    heatmap_diffs = {precision: [] for precision in precisions}
+    for index, data in enumerate(dataset):
+        image, _, annotation = data
+        image_name = dataset.get_name(index)
+        key_points_true = full_key_point_extraction(
+            annotation.detach().numpy(), threshold=0.95)
+
+        heatmaps_fp32 = None
+        for precision in precisions:
+            start = time.perf_counter()
+            with torch.no_grad():
+                heatmaps = models[precision](image.unsqueeze(0))
+            inference_times[precision].append(time.perf_counter() - start)
+            heatmaps = heatmaps.float().numpy().squeeze(0)
+
+            if heatmaps_fp32 is None:
+                heatmaps_fp32 = heatmaps
+            heatmap_diffs[precision].append(
+                np.mean(np.abs(heatmaps - heatmaps_fp32)))
+
+            key_points_predicted = full_key_point_extraction(heatmaps,
+                                                             threshold=0.6)
+            metrics_dicts[precision][image_name] = {
+                MIDDLE_KEY:
+                key_point_metrics(key_points_predicted[1],
+                                  key_points_true[1]),
+                START_END_KEY:
+                key_point_metrics(
+                    np.vstack(
+                        (key_points_predicted[0], key_points_predicted[2])),
+                    np.vstack((key_points_true[0], key_points_true[2])))
+            }
+        print(f"{index}: {image_name} compared")
+
+    comparison = {}
+    for precision in precisions:
+        comparison[precision] = {
+            MIDDLE_KEY:
+            evaluate_total_metrics(metrics_dicts[precision], MIDDLE_KEY),
+            START_END_KEY:
+            evaluate_total_metrics(metrics_dicts[precision], START_END_KEY),
+            INFERENCE_TIME_KEY: np.mean(inference_times[precision]),
+            HEATMAP_DIFF_KEY: np.mean(heatmap_diffs[precision]),
+        }
+
+    comparison_json = json.dumps(comparison, indent=4)
+    print(comparison_json)
+    with open(os.path.join(run_path, "precision_comparison.json"),
+              "w") as outfile:
+        outfile.write(comparison_json)
+
+
 def plot_heatmaps(heatmaps1, heatmaps2, filename):
     plt.figure(figsize=(12, 8))
 
@@ -268,9 +425,16 @@ def main():
     model_path = args.model_path
     base_path = args.data
 
-    model = load_model(model_path)
+    if args.compare_precisions:
+        compare_precisions(model_path, base_path, args.compare_precisions)
+        return
+
+    model = load_model(model_path, args.precision)
 
-    validator = KeyPointVal(model, base_path)
+    validator = KeyPointVal(model,
+                            base_path,
+                            extraction_method=args.extraction_method,
+                            compare_extraction=args.compare_extraction)
     validator.validate()
 
 
@@ -285,6 +449,24 @@ def read_args():
                         type=str,
                         required=True,
                         help="Base path of data")
+    parser.add_argument('--extraction_method',
+                        type=str,
+                        choices=EXTRACTION_METHODS,
+                        default=MEAN_SHIFT_METHOD,
+                        help="Key point extraction for the predicted heatmaps")
+    parser.add_argument('--precision',
+                        type=str,
+                        choices=PRECISIONS,
+                        default='fp32',
+                        help="Precision the model is loaded with")
+    parser.add_argument('--compare_precisions',
+                        type=str,
+                        nargs='+',
+                        choices=PRECISIONS,
+                        help="Only compare these precisions with fp32 on the validation set")
+    parser.add_argument('--compare_extraction',
+                        action='store_true',
+                        help="Compare accuracy and time of all extraction methods")
 
     return parser.parse_args()
 
@@ -1,6 +1,10 @@
+import contextlib
+
 from torch import nn
 import torch
 
+from key_point_detection.vision_transformer import dinov2_vits14
+
 ENCODER_MODEL_NAME = 'dinov2_vits14'
 
 N_HEATMAPS = 3
@@ -9,16 +13,20 @@ INPUT_SIZE = (448, 448)
 
 DINO_CHANNELS = 384
 
+# int8 quantizes the linear layers of the encoder dynamically,
+# bf16 runs the encoder under autocast
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
 
 class Encoder(nn.Module):
-    def __init__(self, pretrained=True):
+    def __init__(self, pretrained=True, bf16=False):
         super().__init__()
-        self.model = torch.hub.load('facebookresearch/dinov2',
-                                    ENCODER_MODEL_NAME,
-                                    pretrained=pretrained)
+        # built locally, pretrained weights come from dependencies/ or are downloaded once
+        self.model = dinov2_vits14(pretrained=pretrained)
         self.model.eval()
         for param in self.model.parameters():
             param.requires_grad = False
+        self.bf16 = bf16
 
     # pylint: disable=no-self-use
     def get_number_output_channels(self):
@@ -27,12 +35,18 @@ class Encoder(nn.Module):
     def forward(self, x):
         # pylint: disable=unused-variable
         B, C, H, W = x.shape
-        with torch.no_grad():
+        # the decoder expects the dtype of the input, e.g. half after model.half()
+        dtype = x.dtype
+        # without bf16 an autocast of the caller, e.g. in training, stays active
+        precision = torch.autocast(device_type=x.device.type,
+                                   dtype=torch.bfloat16) \
+            if self.bf16 else contextlib.nullcontext()
+        with torch.no_grad(), precision:
             x = self.model.forward_features(x)['x_norm_patchtokens']
         width_out = W // 14
         height_out = H // 14
-        return x.reshape(B, height_out, width_out,
-                         DINO_CHANNELS).detach().permute(0, 3, 1, 2)
+        return x.to(dtype).reshape(B, height_out, width_out,
+                                   DINO_CHANNELS).detach().permute(0, 3, 1, 2)
 
 
 class Decoder(nn.Module):
@@ -65,11 +79,27 @@ class EncoderDecoder(nn.Module):
         return x
 
 
-def load_model(model_path):
-    encoder = Encoder(pretrained=False)
+def load_model(model_path, precision='fp32'):
+    """
+    :param precision: fp32, int8 or bf16, see PRECISIONS.
+        int8 models only run on the cpu.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Unknown precision {precision}, choose one of {PRECISIONS}")
+
+    encoder = Encoder(pretrained=False, bf16=precision == 'bf16')
     n_feature_channels = encoder.get_number_output_channels()
     decoder = Decoder(n_feature_channels, N_CHANNELS, INPUT_SIZE, N_HEATMAPS)
 
     model = EncoderDecoder(encoder, decoder)
-    model.load_state_dict(torch.load(model_path))
+    model.load_state_dict(torch.load(model_path, map_location='cpu'))
+
+    if precision == 'int8':
+        # the linear layers of the transformer blocks hold almost all weights and flops,
+        # dynamic quantization needs no calibration data
+        model.eval()
+        torch.ao.quantization.quantize_dynamic(model.encoder, {nn.Linear},
+                                               dtype=torch.qint8,
+                                               inplace=True)
     return model
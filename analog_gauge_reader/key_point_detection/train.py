@@ -16,33 +16,83 @@ sys.path.append(parent_dir)
 
 # pylint: disable=wrong-import-position
 from key_point_dataset import RUN_PATH, KeypointImageDataSet, \
-    TRAIN_PATH, IMG_PATH, LABEL_PATH
+    KeypointStoreDataSet, TRAIN_PATH, IMG_PATH, LABEL_PATH, STORE_PATH, \
+    build_store, store_is_current, data_signature
 from key_point_validator import KeyPointVal
+from batch_augmentation import BatchAugmentation
+from feature_cache import FEATURE_PATH, N_AUGMENTED_VIEWS, FeatureCacheDataSet, \
+    build_feature_cache, feature_cache_is_current
 from model import ENCODER_MODEL_NAME, Encoder, Decoder, EncoderDecoder, \
     INPUT_SIZE, N_HEATMAPS, N_CHANNELS
 
 BATCH_SIZE = 8
+NUM_WORKERS = 4
+# batches each worker loads ahead
+PREFETCH_FACTOR = 4
+# optimizer steps between throughput logs
+LOG_EVERY = 20
 
 
 class KeyPointTrain:
-    def __init__(self, base_path, debug):
-
+    def __init__(self,
+                 base_path,
+                 debug,
+                 use_store=False,
+                 feature_cache=False,
+                 n_views=N_AUGMENTED_VIEWS,
+                 bf16=False,
+                 accumulation_steps=1,
+                 num_workers=NUM_WORKERS):
+        """
+        :param bf16: run forward passes under bfloat16 autocast, also on the cpu
+        :param accumulation_steps: batches whose gradients are summed per
+            optimizer step, the effective batch size is BATCH_SIZE times this
+        """
         self.debug = debug
+        self.feature_cache = feature_cache
+        self.n_views = n_views
+        self.bf16 = bf16
+        self.accumulation_steps = accumulation_steps
+        self.num_workers = num_workers
 
         image_folder = os.path.join(base_path, TRAIN_PATH, IMG_PATH)
         annotation_folder = os.path.join(base_path, TRAIN_PATH, LABEL_PATH)
+        self.feature_folder = os.path.join(base_path, TRAIN_PATH,
+                                           f"{FEATURE_PATH}_{n_views}")
+        self.data_signature = data_signature(image_folder, annotation_folder)
 
         self.feature_extractor = Encoder(pretrained=True)
 
-        self.train_dataset = KeypointImageDataSet(
-            img_dir=image_folder,
-            annotations_dir=annotation_folder,
-            train=True,
-            val=False)
-        self.train_dataloader = DataLoader(self.train_dataset,
-                                           batch_size=BATCH_SIZE,
-                                           shuffle=True,
-                                           num_workers=4)
+        if use_store:
+            store_folder = os.path.join(base_path, TRAIN_PATH, STORE_PATH)
+            if not store_is_current(store_folder, image_folder,
+                                    annotation_folder):
+                print(f"Building image and heatmap store in {store_folder}")
+                build_store(image_folder, annotation_folder, store_folder)
+            # augmented per batch in the workers, see BatchAugmentation
+            self.train_dataset = KeypointStoreDataSet(store_folder,
+                                                      train=True,
+                                                      val=False,
+                                                      batch_augmentation=True)
+            self.collate_fn = BatchAugmentation(train=True)
+            # without augmentation, for the first view of the feature cache
+            self.plain_dataset = KeypointStoreDataSet(store_folder,
+                                                      train=False,
+                                                      val=False)
+        else:
+            self.train_dataset = KeypointImageDataSet(
+                img_dir=image_folder,
+                annotations_dir=annotation_folder,
+                train=True,
+                val=False)
+            self.collate_fn = None
+            self.plain_dataset = KeypointImageDataSet(
+                img_dir=image_folder,
+                annotations_dir=annotation_folder,
+                train=False,
+                val=False)
+        self.train_dataloader = self._create_dataloader(
+            self.train_dataset, self.collate_fn)
 
         self.decoder = self._create_decoder()
 
@@ -59,6 +109,20 @@ class KeyPointTrain:
             print(f"Number of feature channels is {n_feature_channels}")
         return Decoder(n_feature_channels, N_CHANNELS, INPUT_SIZE, N_HEATMAPS)
 
+    def _create_dataloader(self, dataset, collate_fn=None):
+        # workers stay alive between epochs and load ahead while the model trains
+        worker_options = {
+            'persistent_workers': True,
+            'prefetch_factor': PREFETCH_FACTOR
+        } if self.num_workers > 0 else {}
+        return DataLoader(dataset,
+                          batch_size=BATCH_SIZE,
+                          shuffle=True,
+                          num_workers=self.num_workers,
+                          collate_fn=collate_fn,
+                          pin_memory=torch.cuda.is_available(),
+                          **worker_options)
+
     def train(self, num_epochs, learning_rate):
 
         device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -67,6 +131,27 @@ class KeyPointTrain:
 
         self.full_model.to(device)
 
+        if self.feature_cache:
+            # the encoder is frozen, so its features only need to be computed once
+            if not feature_cache_is_current(self.feature_folder,
+                                            self.data_signature):
+                print(f"Caching encoder features in {self.feature_folder}")
+                build_feature_cache(self.feature_extractor,
+                                    self.plain_dataset,
+                                    self.train_dataset,
+                                    self.feature_folder,
+                                    self.data_signature,
+                                    n_views=self.n_views,
+                                    device=device,
+                                    batch_size=BATCH_SIZE,
+                                    num_workers=self.num_workers,
+                                    collate_fn=self.collate_fn)
+            self.train_dataloader = self._create_dataloader(
+                FeatureCacheDataSet(self.feature_folder))
+            model = self.decoder
+        else:
+            model = self.full_model
+
         optimizer = optim.Adam(self.full_model.parameters(), lr=learning_rate)
         scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer,
                                                          mode='min',
@@ -74,30 +159,52 @@ class KeyPointTrain:
                                                          patience=50)
 
         # Train the model
+        step = 0
         for epoch in range(num_epochs):
-            running_loss = 0.0
-            for inputs, annotations in self.train_dataloader:
+            # summed on the device, so the loss is only synchronized once per epoch
+            running_loss = torch.zeros((), device=device)
+            throughput = _Throughput()
+            optimizer.zero_grad()
+            for index, (inputs, annotations) in enumerate(
+                    throughput.timed(self.train_dataloader)):
                 # Forward pass
-                inputs, annotations = inputs.to(device), annotations.to(device)
-                outputs = self.full_model(inputs)
-                loss = self.criterion(outputs, annotations)
-
-                # Backward pass and optimization
-                optimizer.zero_grad()
-                loss.backward()
-
-                optimizer.step()
-
-                running_loss += loss.item()
-
-            loss = running_loss / len(self.train_dataloader)
+                inputs = inputs.to(device, non_blocking=True)
+                annotations = annotations.to(device, non_blocking=True)
+                with torch.autocast(device_type=device.type,
+                                    dtype=torch.bfloat16,
+                                    enabled=self.bf16):
+                    outputs = model(inputs)
+                # the loss in fp32, BCELoss is not autocast safe
+                loss = self.criterion(outputs.float(), annotations)
+                running_loss += loss.detach()
+
+                # Backward pass, gradients are averaged over the batches of the group,
+                # the last group of the epoch can be smaller
+                n_batches = len(self.train_dataloader)
+                group_start = index - index % self.accumulation_steps
+                group_size = min(self.accumulation_steps,
+                                 n_batches - group_start)
+                (loss / group_size).backward()
+
+                if index + 1 == group_start + group_size:
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    step += 1
+                    if step % LOG_EVERY == 0:
+                        throughput_msg = f"Step {step}: {throughput.report()}"
+                        logging.info(throughput_msg)
+                        if self.debug:
+                            print(throughput_msg)
+
+            loss = running_loss.item() / len(self.train_dataloader)
             self.loss[epoch + 1] = loss
 
             # print new learning rate and loss
             before_lr = optimizer.param_groups[0]["lr"]
             scheduler.step(loss)
             after_lr = optimizer.param_groups[0]["lr"]
-            loss_msg = f"Epoch {epoch + 1}: Loss = {loss}, lr {before_lr} -> {after_lr}"
+            loss_msg = f"Epoch {epoch + 1}: Loss = {loss}, lr {before_lr} -> {after_lr}, " \
+                f"{throughput.report(total=True)}"
             print(loss_msg)
             logging.info(loss_msg)
 
@@ -107,6 +214,39 @@ class KeyPointTrain:
         return self.full_model
 
 
+class _Throughput:
+    """
+    Images per second and the time spent waiting for the data loader,
+    since the last report or for the whole epoch.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.images = 0
+        self.data_wait = 0.0
+        self._last = (self.start, 0, 0.0)
+
+    def timed(self, dataloader):
+        iterator = iter(dataloader)
+        while True:
+            wait_start = time.perf_counter()
+            try:
+                inputs, annotations = next(iterator)
+            except StopIteration:
+                return
+            self.data_wait += time.perf_counter() - wait_start
+            self.images += len(inputs)
+            yield inputs, annotations
+
+    def report(self, total=False):
+        now = time.perf_counter()
+        start, images, data_wait = (self.start, 0,
+                                    0.0) if total else self._last
+        self._last = (now, self.images, self.data_wait)
+        elapsed = max(now - start, 1e-9)
+        return (f"{(self.images - images) / elapsed:.1f} images/s, "
+                f"data wait {self.data_wait - data_wait:.2f}s of {elapsed:.2f}s")
+
+
 def main():
     args = read_args()
 
@@ -119,6 +259,8 @@ def main():
     debug = args.debug
     # fix seed for reproducibility
     torch.manual_seed(0)
+    if args.threads:
+        torch.set_num_threads(args.threads)
 
     # Setup run directory
     time_str = time.strftime("%Y%m%d-%H%M%S")
@@ -138,7 +280,14 @@ def main():
     if debug:
         print("initializing trainer")
 
-    trainer = KeyPointTrain(base_path, debug)
+    trainer = KeyPointTrain(base_path,
+                            debug,
+                            use_store=args.store,
+                            feature_cache=args.feature_cache,
+                            n_views=args.views,
+                            bf16=args.bf16,
+                            accumulation_steps=args.accumulation_steps,
+                            num_workers=args.workers)
     if debug:
         print("initialized trainer successfully")
 
@@ -169,7 +318,10 @@ def main():
         'number of decoder channels': N_CHANNELS,
         'initial learning rate': learning_rate,
         'epochs': num_epochs,
-        'batch size': BATCH_SIZE
+        'batch size': BATCH_SIZE,
+        'gradient accumulation steps': args.accumulation_steps,
+        'bf16': args.bf16,
+        'feature cache views': args.views if args.feature_cache else None
     }
 
     param_file_path = os.path.join(run_path, "paramaters.txt")
@@ -205,6 +357,37 @@ def read_args():
                         help="Base path of data")
     parser.add_argument('--val', action='store_true')
     parser.add_argument('--debug', action='store_true')
+    parser.add_argument(
+        '--store',
+        action='store_true',
+        help="Read the training data from a memory mapped store, "
+        "built in train/store on first use")
+    parser.add_argument(
+        '--feature_cache',
+        action='store_true',
+        help="Compute the encoder features once and train only the decoder "
+        "on the cached features")
+    parser.add_argument('--views',
+                        type=int,
+                        required=False,
+                        default=N_AUGMENTED_VIEWS,
+                        help="Cached views per image with --feature_cache, "
+                        "the first one without augmentation")
+    parser.add_argument('--bf16',
+                        action='store_true',
+                        help="Train with bfloat16 autocast, also on the cpu")
+    parser.add_argument('--accumulation_steps',
+                        type=int,
+                        default=1,
+                        help="Batches per optimizer step")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=NUM_WORKERS,
+                        help="DataLoader worker processes")
+    parser.add_argument('--threads',
+                        type=int,
+                        default=None,
+                        help="Torch intra-op threads of the training process")
 
     return parser.parse_args()
 
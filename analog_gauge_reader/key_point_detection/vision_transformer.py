@@ -0,0 +1,181 @@
+"""
+Self contained DINOv2 ViT-S/14, so the key point model is built without torch.hub.
+Inference only version of dinov2/models/vision_transformer.py
+<https://github.com/facebookresearch/dinov2> (Apache 2.0), with the same
+module names, so state dicts of the hub model load unchanged.
+"""
+import math
+import os
+import logging
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+PATCH_SIZE = 14
+EMBED_DIM = 384
+DEPTH = 12
+NUM_HEADS = 6
+MLP_RATIO = 4
+# image size the position embedding was trained for, 37 x 37 patches
+IMG_SIZE = 518
+
+PRETRAINED_URL = "https://dl.fbaipublicfiles.com/dinov2/dinov2_vits14/dinov2_vits14_pretrain.pth"
+PRETRAINED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               os.pardir, "dependencies",
+                               "dinov2_vits14_pretrain.pth")
+
+
+class PatchEmbed(nn.Module):
+    def __init__(self, patch_size, in_chans, embed_dim):
+        super().__init__()
+        self.proj = nn.Conv2d(in_chans,
+                              embed_dim,
+                              kernel_size=patch_size,
+                              stride=patch_size)
+
+    def forward(self, x):
+        # B C H W -> B HW C
+        return self.proj(x).flatten(2).transpose(1, 2)
+
+
+class Attention(nn.Module):
+    def __init__(self, dim, num_heads):
+        super().__init__()
+        self.num_heads = num_heads
+        self.qkv = nn.Linear(dim, dim * 3, bias=True)
+        self.proj = nn.Linear(dim, dim, bias=True)
+
+    def forward(self, x):
+        B, N, C = x.shape
+        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads,
+                                  C // self.num_heads).permute(2, 0, 3, 1, 4)
+        q, k, v = qkv[0], qkv[1], qkv[2]
+        if torch.onnx.is_in_onnx_export():
+            # torch 2.0 can not export the fused attention to onnx
+            attn = (q * (C // self.num_heads)**-0.5) @ k.transpose(-2, -1)
+            x = attn.softmax(dim=-1) @ v
+        else:
+            x = F.scaled_dot_product_attention(q, k, v)
+        return self.proj(x.transpose(1, 2).reshape(B, N, C))
+
+
+class Mlp(nn.Module):
+    def __init__(self, dim, hidden_dim):
+        super().__init__()
+        self.fc1 = nn.Linear(dim, hidden_dim)
+        self.act = nn.GELU()
+        self.fc2 = nn.Linear(hidden_dim, dim)
+
+    def forward(self, x):
+        return self.fc2(self.act(self.fc1(x)))
+
+
+class LayerScale(nn.Module):
+    def __init__(self, dim, init_values=1.0):
+        super().__init__()
+        self.gamma = nn.Parameter(init_values * torch.ones(dim))
+
+    def forward(self, x):
+        return x * self.gamma
+
+
+class Block(nn.Module):
+    def __init__(self, dim, num_heads, mlp_ratio):
+        super().__init__()
+        self.norm1 = nn.LayerNorm(dim, eps=1e-6)
+        self.attn = Attention(dim, num_heads)
+        self.ls1 = LayerScale(dim)
+        self.norm2 = nn.LayerNorm(dim, eps=1e-6)
+        self.mlp = Mlp(dim, int(dim * mlp_ratio))
+        self.ls2 = LayerScale(dim)
+
+    def forward(self, x):
+        x = x + self.ls1(self.attn(self.norm1(x)))
+        x = x + self.ls2(self.mlp(self.norm2(x)))
+        return x
+
+
+class DinoVisionTransformer(nn.Module):
+    def __init__(self,
+                 img_size=IMG_SIZE,
+                 patch_size=PATCH_SIZE,
+                 embed_dim=EMBED_DIM,
+                 depth=DEPTH,
+                 num_heads=NUM_HEADS,
+                 mlp_ratio=MLP_RATIO):
+        super().__init__()
+        self.patch_size = patch_size
+        num_patches = (img_size // patch_size)**2
+
+        self.patch_embed = PatchEmbed(patch_size, 3, embed_dim)
+        self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
+        self.pos_embed = nn.Parameter(
+            torch.zeros(1, num_patches + 1, embed_dim))
+        self.blocks = nn.ModuleList(
+            [Block(embed_dim, num_heads, mlp_ratio) for _ in range(depth)])
+        self.norm = nn.LayerNorm(embed_dim, eps=1e-6)
+        # only used in the dinov2 training, kept for the state dict
+        self.mask_token = nn.Parameter(torch.zeros(1, embed_dim))
+
+    def interpolate_pos_encoding(self, x, w, h):
+        previous_dtype = x.dtype
+        npatch = x.shape[1] - 1
+        N = self.pos_embed.shape[1] - 1
+        if npatch == N and w == h:
+            return self.pos_embed
+        pos_embed = self.pos_embed.float()
+        class_pos_embed = pos_embed[:, 0]
+        patch_pos_embed = pos_embed[:, 1:]
+        dim = x.shape[-1]
+        # small offset against floating point errors in the interpolation, same as dinov2
+        w0 = w // self.patch_size + 0.1
+        h0 = h // self.patch_size + 0.1
+
+        patch_pos_embed = F.interpolate(
+            patch_pos_embed.reshape(1, int(math.sqrt(N)), int(math.sqrt(N)),
+                                    dim).permute(0, 3, 1, 2),
+            scale_factor=(w0 / math.sqrt(N), h0 / math.sqrt(N)),
+            mode="bicubic",
+        )
+        patch_pos_embed = patch_pos_embed.permute(0, 2, 3, 1).view(1, -1, dim)
+        return torch.cat((class_pos_embed.unsqueeze(0), patch_pos_embed),
+                         dim=1).to(previous_dtype)
+
+    def forward_features(self, x):
+        # pylint: disable=unused-variable
+        B, C, w, h = x.shape
+        x = self.patch_embed(x)
+        x = torch.cat((self.cls_token.expand(x.shape[0], -1, -1), x), dim=1)
+        x = x + self.interpolate_pos_encoding(x, w, h)
+
+        for block in self.blocks:
+            x = block(x)
+
+        x_norm = self.norm(x)
+        return {
+            "x_norm_clstoken": x_norm[:, 0],
+            "x_norm_patchtokens": x_norm[:, 1:],
+            "x_prenorm": x,
+        }
+
+    def forward(self, x):
+        return self.forward_features(x)["x_norm_clstoken"]
+
+
+def dinov2_vits14(pretrained=True):
+    """
+    :param pretrained: load the dinov2 weights from PRETRAINED_PATH,
+        if the file does not exist they are downloaded once into the torch hub cache
+    """
+    model = DinoVisionTransformer()
+    if pretrained:
+        if os.path.isfile(PRETRAINED_PATH):
+            state_dict = torch.load(PRETRAINED_PATH, map_location='cpu')
+        else:
+            logging.info("No weights at %s, download %s", PRETRAINED_PATH,
+                         PRETRAINED_URL)
+            state_dict = torch.hub.load_state_dict_from_url(
+                PRETRAINED_URL, map_location='cpu')
+        model.load_state_dict(state_dict)
+    return model
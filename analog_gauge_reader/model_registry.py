@@ -0,0 +1,183 @@
+import os
+import logging
+import threading
+
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+from key_point_detection.model import load_model, INPUT_SIZE, \
+    PRECISIONS as KEY_POINT_PRECISIONS
+from inference_backend import check_backend, load_yolo_onnx, load_key_point_onnx, \
+    TORCH_BACKEND, ONNX_BACKEND
+
+YOLO_KIND = 'yolo'
+KEY_POINT_KIND = 'key_point'
+
+DEFAULT_DEVICE = 'cpu'
+DEFAULT_PRECISION = 'fp32'
+# int8 and bf16 only change the key point model, yolo then runs in fp32
+PRECISIONS = ('fp32', 'fp16', 'int8', 'bf16')
+DEFAULT_BACKEND = TORCH_BACKEND
+
+
+class ModelRegistry:
+    """
+    Process wide cache of loaded models.
+    Every model is loaded once per (path, device, precision, backend), warmed
+    up with a dummy inference and then the same instance is handed to every stage.
+    """
+    def __init__(self):
+        self.device = DEFAULT_DEVICE
+        self.precision = DEFAULT_PRECISION
+        self.backend = DEFAULT_BACKEND
+        self.threads = None
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def configure(self, device=None, precision=None, backend=None,
+                  threads=None):
+        """
+        Set the device, precision and backend used when a stage does not ask
+        for one. threads limits the cpu threads of torch and onnxruntime.
+        """
+        if device is not None:
+            self.device = device
+        if precision is not None:
+            _check_precision(precision)
+            self.precision = precision
+        if backend is not None:
+            check_backend(backend, self.device)
+            self.backend = backend
+        if threads:
+            self.threads = threads
+            torch.set_num_threads(threads)
+
+    def get(self, kind, model_path, device=None, precision=None, backend=None):
+        device = self.device if device is None else device
+        precision = self.precision if precision is None else precision
+        backend = self.backend if backend is None else backend
+        _check_precision(precision)
+        check_backend(backend, device)
+        requested_precision = precision
+        precision = _supported_precision(kind, precision, device, backend)
+        # the onnx backend ignores the device, check_backend only allows the cpu
+        if backend == ONNX_BACKEND:
+            device = 'cpu'
+
+        key = (kind, os.path.abspath(model_path), device, precision, backend)
+        # hold the lock while loading, so two stages never load the same model twice
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                if precision != requested_precision:
+                    logging.warning("%s %s model can not run in %s on %s, using %s",
+                                    backend, kind, requested_precision, device,
+                                    precision)
+                logging.info("Loading %s model %s on %s with %s using %s",
+                             kind, model_path, device, precision, backend)
+                if backend == ONNX_BACKEND:
+                    model = _ONNX_LOADERS[kind](model_path, self.threads)
+                else:
+                    model = _LOADERS[kind](model_path, device, precision)
+                self._models[key] = model
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+def _check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Unknown precision {precision}, choose one of {PRECISIONS}")
+
+
+def _supported_precision(kind, precision, device, backend):
+    """
+    Precision the model actually runs with, so equivalent requests
+    share one cache entry.
+    """
+    # onnx models always run in fp32, int8 and bf16 only change the key point model
+    if backend == ONNX_BACKEND or (kind == YOLO_KIND
+                                   and precision in ('int8', 'bf16')):
+        return 'fp32'
+    # half precision kernels are missing for most cpu ops, same as ultralytics
+    if precision == 'fp16' and device == 'cpu':
+        return 'fp32'
+    return precision
+
+
+def _load_yolo(model_path, device, precision):
+    model = YOLO(model_path)
+    # overrides are merged into the arguments of every predict call
+    model.overrides['device'] = device
+    model.overrides['half'] = precision == 'fp16'
+
+    model.predict(np.zeros((INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=np.uint8))
+    return model
+
+
+def _load_key_point_model(model_path, device, precision):
+    if precision == 'int8' and device != 'cpu':
+        raise ValueError("int8 key point models only run on the cpu")
+    model = load_model(model_path,
+                       precision if precision in KEY_POINT_PRECISIONS else 'fp32')
+    model.eval()
+    if precision == 'fp16':
+        model.half()
+    model.to(device)
+
+    dtype = next(model.parameters()).dtype
+    with torch.no_grad():
+        model(torch.zeros((1, 3, *INPUT_SIZE), dtype=dtype, device=device))
+    return model
+
+
+_LOADERS = {
+    YOLO_KIND: _load_yolo,
+    KEY_POINT_KIND: _load_key_point_model,
+}
+
+# onnx models always run in fp32 on the cpu
+_ONNX_LOADERS = {
+    YOLO_KIND: load_yolo_onnx,
+    KEY_POINT_KIND: load_key_point_onnx,
+}
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+def get_yolo_model(model_path, device=None, precision=None, backend=None):
+    return MODEL_REGISTRY.get(YOLO_KIND, model_path, device, precision,
+                              backend)
+
+
+def get_key_point_model(model_path, device=None, precision=None,
+                        backend=None):
+    return MODEL_REGISTRY.get(KEY_POINT_KIND, model_path, device, precision,
+                              backend)
+
+
+def preload_models(detection_model_path,
+                   key_point_model_path,
+                   segmentation_model_path,
+                   center_model_path=None,
+                   device=None,
+                   precision=None,
+                   backend=None,
+                   threads=None):
+    """
+    Load and warm up all models of the pipeline once, before the first frame.
+    :param device: device all models run on, also becomes the default
+    :param precision: see PRECISIONS, also becomes the default
+    :param backend: torch or onnx, also becomes the default
+    :param threads: cpu threads for inference, None keeps the library default
+    """
+    MODEL_REGISTRY.configure(device, precision, backend, threads)
+    get_yolo_model(detection_model_path)
+    get_key_point_model(key_point_model_path)
+    get_yolo_model(segmentation_model_path)
+    if center_model_path is not None:
+        get_yolo_model(center_model_path)
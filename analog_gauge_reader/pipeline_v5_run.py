@@ -9,27 +9,17 @@ import numpy as np
 from PIL import Image
 
 from plots_circle import RUN_PATH, Plotter
-from gauge_detection.detection_inference import detection_gauge_face
-from key_point_detection.key_point_inference import KeyPointInference, detect_key_points
-from geometry.circle import fit_circle, get_line_circle_point, \
-    get_point_from_angle, get_polar_angle, get_theta_middle, get_circle_error
-from angle_reading_fit.angle_converter import AngleConverter
-from angle_reading_fit.line_fit import line_fit, line_fit_ransac
-from segmentation.segmenation_inference import get_start_end_line, segment_gauge_needle, \
-    get_fitted_line, cut_off_line
+from plots_overlay import OverlayRenderer  # pylint: disable=unused-import
+from gauge_reader import GaugeReader, Calibration, ChangeGate, plot_reading, get_result_dicts, \
+    parallel_stage_threads, crop_image, RESOLUTION, WRAP_AROUND_FIX, RANSAC  # pylint: disable=unused-import
 from evaluation import constants
+from key_point_detection.key_point_extraction import MEAN_SHIFT_METHOD, EXTRACTION_METHODS
+# re-exported so callers warm up the same registry the stages use
+from model_registry import preload_models  # pylint: disable=unused-import
 
 from pathlib import Path
 
 OCR_THRESHOLD = 0.7
-RESOLUTION = (
-    448, 448
-)  # make sure both dimensions are multiples of 14 for keypoint detection
-
-# Several flags to set or unset for pipeline
-WRAP_AROUND_FIX = True
-RANSAC = True
-
 WARP_OCR = True
 
 # if random_rotations true then random rotations.
@@ -39,48 +29,6 @@ ZERO_POINT_ROTATION = True
 OCR_ROTATION = RANDOM_ROTATIONS or ZERO_POINT_ROTATION
 
 
-def crop_image(img, box, flag=False, two_dimensional=False):
-    """
-    crop image
-    :param img: orignal image
-    :param box: in the xyxy format
-    :return: cropped image
-    """
-    img = np.copy(img)
-    if two_dimensional:
-        cropped_img = img[box[1]:box[3],
-                          box[0]:box[2]]  # image has format [y, x]
-    else:
-        cropped_img = img[box[1]:box[3],
-                          box[0]:box[2], :]  # image has format [y, x, rgb]
-
-    height = int(box[3] - box[1])
-    width = int(box[2] - box[0])
-
-    # want to preserve aspect ratio but make image square, so do padding
-    if height > width:
-        delta = height - width
-        left, right = delta // 2, delta - (delta // 2)
-        top = bottom = 0
-    else:
-        delta = width - height
-        top, bottom = delta // 2, delta - (delta // 2)
-        left = right = 0
-
-    pad_color = [0, 0, 0]
-    new_img = cv2.copyMakeBorder(cropped_img,
-                                 top,
-                                 bottom,
-                                 left,
-                                 right,
-                                 cv2.BORDER_CONSTANT,
-                                 value=pad_color)
-
-    if flag:
-        return new_img, (top, bottom, left, right)
-    return new_img
-
-
 def move_point_resize(point, original_resolution, resized_resolution):
     new_point_x = point[0] * resized_resolution[0] / original_resolution[0]
     new_point_y = point[1] * resized_resolution[1] / original_resolution[1]
@@ -106,12 +54,12 @@ def rescale_circle_resize(circle_params, original_resolution,
 
 def process_image(image, detection_model_path, key_point_model_path,
                   segmentation_model_path, run_path, debug, eval_mode,
-                  start_marking, end_marking, unit, image_is_raw=False):
-
-    result = []
-    errors = {}
-    result_full = {}
-
+                  start_marking, end_marking, unit, image_is_raw=False,
+                  key_point_method=MEAN_SHIFT_METHOD):
+    """
+    Thin wrapper around GaugeReader for the command line:
+    reads one image and writes results and plots to run_path.
+    """
     if image_is_raw:
         logging.info("Start processing image at path %s", image)
         image = Image.open(image).convert("RGB")
@@ -121,268 +69,28 @@ def process_image(image, detection_model_path, key_point_model_path,
 
     plotter = Plotter(run_path, image)
 
-    if eval_mode:
-        result_full[constants.IMG_SIZE_KEY] = {
-            'width': image.shape[1],
-            'height': image.shape[0]
-        }
-
     if debug:
         plotter.save_img()
 
-    # ------------------Gauge detection-------------------------
-    if debug:
-        print("-------------------")
-        print("Gauge Detection")
-
-    logging.info("Start Gauge Detection")
-
-    box, all_boxes = detection_gauge_face(image, detection_model_path)
+    # models come from the registry, so building the reader per image is cheap
+    reader = GaugeReader(detection_model_path,
+                         key_point_model_path,
+                         segmentation_model_path,
+                         Calibration(start_marking, end_marking, unit),
+                         key_point_method=key_point_method)
+    reading = reader.read(image, keep_details=debug or eval_mode)
 
     if debug:
-        plotter.plot_bounding_box_img(all_boxes)
-
-    # crop image to only gauge face
-    cropped_img = crop_image(image, box)
-
-    # resize
-    cropped_resized_img = cv2.resize(cropped_img,
-                                     dsize=RESOLUTION,
-                                     interpolation=cv2.INTER_CUBIC)
-
-    if eval_mode:
-        result_full[constants.GAUGE_DET_KEY] = {
-            'x': box[0].item(),
-            'y': box[1].item(),
-            'width': box[2].item() - box[0].item(),
-            'height': box[3].item() - box[1].item(),
-        }
-
-    if debug:
-        plotter.set_image(cropped_resized_img)
-        plotter.plot_image('cropped')
-
-    logging.info("Finish Gauge Detection")
-
-    # ------------------Key Point Detection-------------------------
-
-    if debug:
-        print("-------------------")
-        print("Key Point Detection")
-
-    logging.info("Start key point detection")
-
-    key_point_inferencer = KeyPointInference(key_point_model_path)
-    heatmaps = key_point_inferencer.predict_heatmaps(cropped_resized_img)
-    key_point_list = detect_key_points(heatmaps)
-
-    key_points = key_point_list[1]
-    start_point = key_point_list[0]
-    end_point = key_point_list[2]
-
-    if eval_mode:
-        if start_point.shape == (1, 2):
-            result_full[constants.KEYPOINT_START_KEY] = {
-                'x': start_point[0][0],
-                'y': start_point[0][1]
-            }
-        else:
-            result_full[constants.KEYPOINT_START_KEY] = constants.FAILED
-        if end_point.shape == (1, 2):
-            result_full[constants.KEYPOINT_END_KEY] = {
-                'x': end_point[0][0],
-                'y': end_point[0][1]
-            }
-        else:
-            result_full[constants.KEYPOINT_END_KEY] = constants.FAILED
-        result_full[constants.KEYPOINT_NOTCH_KEY] = []
-        for point in key_points:
-            result_full[constants.KEYPOINT_NOTCH_KEY].append({
-                'x': point[0],
-                'y': point[1]
-            })
-
-    if debug:
-        plotter.plot_heatmaps(heatmaps)
-        plotter.plot_key_points(key_point_list)
-
-    logging.info("Finish key point detection")
-
-    # ------------------Circle Fitting-------------------------
-
-    if debug:
-        print("-------------------")
-        print("Circle Fitting")
-
-    logging.info("Start circle fitting")
-
-    circle_params = fit_circle(key_points[:, 0], key_points[:, 1])
-    # try:
-    #     ellipse_params = cart_to_pol(coeffs)
-    # except ValueError:
-    #     logging.error("Ellipse parameters not an ellipse.")
-    #     errors[constants.NOT_AN_ELLIPSE_ERROR_KEY] = True
-    #     result.append({constants.READING_KEY: constants.FAILED})
-    #     result_full[constants.OCR_NUM_KEY] = constants.FAILED
-    #     result_full[constants.NEEDLE_MASK_KEY] = constants.FAILED
-    #     write_files(result, result_full, errors, run_path, eval_mode)
-    #     raise Exception("Ellipse parameters not an ellipse")
-
-    circle_error = get_circle_error(key_points, circle_params)
-    errors["circle fit error"] = circle_error
-
-    if debug:
-        plotter.plot_circle(key_points, circle_params, 'key_points')
-
-    logging.info("Finish circle fitting")
-
-    # calculate zero point
-
-    # Find bottom point to set there the zero for wrap around
-    if WRAP_AROUND_FIX and start_point.shape == (1, 2) \
-        and end_point.shape == (1, 2):
-        theta_start = get_polar_angle(start_point.flatten(), circle_params)
-        theta_end = get_polar_angle(end_point.flatten(), circle_params)
-        theta_zero = get_theta_middle(theta_start, theta_end)
-    else:
-        bottom_middle = np.array((RESOLUTION[0] / 2, RESOLUTION[1]))
-        theta_zero = get_polar_angle(bottom_middle, circle_params)
-
-    zero_point = get_point_from_angle(theta_zero, circle_params)
-    if debug:
-        plotter.plot_zero_point_circle(np.array(zero_point),
-                                        np.vstack((start_point, end_point)),
-                                        circle_params)
-
-    # # ------------------OCR-------------------------
-
-    # ------------------Segmentation-------------------------
-
-    if debug:
-        print("-------------------")
-        print("Segmentation")
-
-    logging.info("Start segmentation")
-
-    try:
-        needle_mask_x, needle_mask_y = segment_gauge_needle(
-            cropped_resized_img, segmentation_model_path)
-    except AttributeError:
-        logging.error("Segmentation failed, no needle found")
-        errors[constants.SEGMENTATION_FAILED_KEY] = True
-        result.append({constants.READING_KEY: constants.FAILED})
-        result_full[constants.NEEDLE_MASK_KEY] = constants.FAILED
-        write_files(result, result_full, errors, run_path, eval_mode)
-        raise Exception("Segmentation failed, no needle found")
-
-    if eval_mode:
-        result_full[constants.NEEDLE_MASK_KEY] = {
-            'x': needle_mask_x.tolist(),
-            'y': needle_mask_y.tolist()
-        }
-
-    needle_line_coeffs, needle_error = get_fitted_line(needle_mask_x,
-                                                       needle_mask_y)
-    needle_line_start_x, needle_line_end_x = get_start_end_line(needle_mask_x)
-    needle_line_start_y, needle_line_end_y = get_start_end_line(needle_mask_y)
-
-    needle_line_start_x, needle_line_end_x = cut_off_line(
-        [needle_line_start_x, needle_line_end_x], needle_line_start_y,
-        needle_line_end_y, needle_line_coeffs)
-
-    errors["Needle line residual variance"] = needle_error
-
-    if debug:
-        plotter.plot_segmented_line(needle_mask_x, needle_mask_y,
-                                    (needle_line_start_x, needle_line_end_x),
-                                    needle_line_coeffs)
-
-    logging.info("Finish segmentation")
-
-    # ------------------Project OCR Numbers to circle-------------------------
-
-    # ------------------Project start and end points to circle-------------------------
-
-    start_point_xy = [start_point[0][0], start_point[0][1]]
-    end_point_xy = [end_point[0][0], end_point[0][1]]
-    theta_start = get_polar_angle(start_point_xy, circle_params)
-    theta_end = get_polar_angle(end_point_xy, circle_params)
-
-    # ------------------Project Needle to circle-------------------------
-
-    point_needle_circle = get_line_circle_point(
-        needle_line_coeffs, (needle_line_start_x, needle_line_end_x),
-        circle_params)
-
-    if point_needle_circle.shape[0] == 0:
-        logging.error("Needle line and circle do not intersect!")
-        errors[constants.OCR_NONE_DETECTED_KEY] = True
-        result.append({constants.READING_KEY: constants.FAILED})
-        write_files(result, result_full, errors, run_path, eval_mode)
-        raise Exception("Needle line and circle do not intersect")
-
-    if debug:
-        plotter.plot_circle(point_needle_circle.reshape(1, 2),
-                             circle_params, 'needle_point')
-
-    # ------------------Fit line to angles and get reading of needle-------------------------
-
-    # Find angle of needle circle point
-    needle_angle = get_polar_angle(point_needle_circle, circle_params)
-
-    angle_converter = AngleConverter(theta_zero)
-
-    angle_number_list = []
-    # for number in number_labels:
-    #     angle_number_list.append(
-    #         (angle_converter.convert_angle(number.theta), number.number))
-
-    angle_number_list.append((angle_converter.convert_angle(theta_start), start_marking))
-    angle_number_list.append((angle_converter.convert_angle(theta_end), end_marking))
-    angle_number_arr = np.array(angle_number_list)
-
-    if RANSAC:
-        reading_line_coeff, inlier_mask, outlier_mask = line_fit_ransac(
-            angle_number_arr[:, 0], angle_number_arr[:, 1])
-    else:
-        reading_line_coeff = line_fit(angle_number_arr[:, 0],
-                                      angle_number_arr[:, 1])
-
-    reading_line = np.poly1d(reading_line_coeff)
-    reading_line_res = np.sum(
-        abs(
-            np.polyval(reading_line_coeff, angle_number_arr[:, 0]) -
-            angle_number_arr[:, 0]))
-    reading_line_mean_err = reading_line_res / len(angle_number_arr)
-    errors["Mean residual on fitted angle line"] = reading_line_mean_err
-
-    needle_angle_conv = angle_converter.convert_angle(needle_angle)
-
-    reading = reading_line(needle_angle_conv)
-
-    result.append({
-        constants.READING_KEY: reading,
-        constants.MEASURE_UNIT_KEY: unit
-    })
-
-    if debug:
-        if RANSAC:
-            plotter.plot_linear_fit_ransac(angle_number_arr,
-                                           (needle_angle_conv, reading),
-                                           reading_line, inlier_mask,
-                                           outlier_mask)
-        else:
-            plotter.plot_linear_fit(angle_number_arr,
-                                    (needle_angle_conv, reading), reading_line)
-
-        print(f"Final reading is: {reading} {unit}")
-        plotter.plot_final_reading_circle([], point_needle_circle,
-                                           round(reading, 1), circle_params)
+        plot_reading(plotter, reading)
 
     # ------------------Write result to file-------------------------
-    write_files(result, result_full, errors, run_path, eval_mode)
+    result, result_full = get_result_dicts(reading)
+    write_files(result, result_full, reading.errors, run_path, eval_mode)
 
-    return {"value": reading, "unit": unit}
+    if not reading.is_valid():
+        raise Exception(reading.failure)
+
+    return reading.to_dict()
 
 
 def write_files(result, result_full, errors, run_path, eval_mode):
@@ -455,7 +163,8 @@ def main():
                       eval_mode=args.eval,
                       start_marking=args.start_marking,
                       end_marking=args.end_marking,
-                      unit=args.unit)
+                      unit=args.unit,
+                      key_point_method=args.key_point_method)
     elif os.path.isdir(input_path):
         for image_name in os.listdir(input_path):
             img_path = os.path.join(input_path, image_name)
@@ -470,7 +179,8 @@ def main():
                               eval_mode=args.eval,
                               start_marking=args.start_marking,
                               end_marking=args.end_marking,
-                              unit=args.unit)
+                              unit=args.unit,
+                              key_point_method=args.key_point_method)
 
             # pylint: disable=broad-except
             # For now want to catch general exceptions and still continue with the other images.
@@ -526,6 +236,11 @@ def read_args():
     parser.add_argument('--unit',
                         type=str,
                         required=True)
+    parser.add_argument('--key_point_method',
+                        type=str,
+                        choices=EXTRACTION_METHODS,
+                        default=MEAN_SHIFT_METHOD,
+                        help="How key points are extracted from the heatmaps")
     return parser.parse_args()
 
 
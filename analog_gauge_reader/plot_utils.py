@@ -0,0 +1,11 @@
+import matplotlib.pyplot as plt
+
+
+def save_figure(path):
+    """
+    Save the current figure to path and close it, a long running process
+    runs out of memory if the figures of every plot stay open.
+    """
+    figure = plt.gcf()
+    figure.savefig(path)
+    plt.close(figure)
@@ -10,6 +10,7 @@ from PIL import Image
 
 # pylint: disable=no-member
 from evaluation import constants
+from plot_utils import save_figure
 from geometry.ellipse import get_ellipse_pts, get_point_from_angle
 
 matplotlib.use('Agg')
@@ -35,21 +36,21 @@ class Plotter:
         plt.figure()
         plt.imshow(self.image)
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_any_image(self, img, title):
         plt.figure()
         plt.imshow(img)
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_point_img(self, img, points, title):
         plt.figure()
         plt.imshow(img)
         plt.scatter(points[:, 0], points[:, 1])
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_ocr_visualization(self, vis, degree=None):
         plt.figure()
@@ -60,7 +61,7 @@ class Plotter:
         else:
             path = os.path.join(self.run_path,
                                 f"ocr_visualization_results{degree}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_bounding_box_img(self, boxes):
         """
@@ -85,7 +86,7 @@ class Plotter:
         plt.imshow(img)
 
         path = os.path.join(self.run_path, "bbox_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_test_point(self, point, title):
         plt.figure(figsize=(12, 8))
@@ -96,7 +97,7 @@ class Plotter:
         plt.tight_layout()
 
         path = os.path.join(self.run_path, f"{title}_point_result.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_key_points(self, key_point_list):
         plt.figure(figsize=(12, 8))
@@ -128,7 +129,7 @@ class Plotter:
         plt.tight_layout()
 
         path = os.path.join(self.run_path, "key_point_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_just_ellipse(self, image, ellipse_params, title):
@@ -137,7 +138,7 @@ class Plotter:
         x, y = get_ellipse_pts(ellipse_params)
         plt.plot(x, y)  # plot ellipse
         path = os.path.join(self.run_path, f"ellipse_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_ellipse(self,
                      points,
@@ -149,8 +150,6 @@ class Plotter:
         plot ellipse and points with annotations.
         points is a 2d numpy array with one point per row
         """
-        plt.figure()
-
         fig, ax = plt.subplots()
         fig.set_size_inches(8, 6)
 
@@ -177,7 +176,7 @@ class Plotter:
         plt.plot(x, y)  # plot ellipse
 
         path = os.path.join(self.run_path, f"ellipse_results_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_zero_point_ellipse(self, zero_point, start_end_point,
@@ -186,8 +185,6 @@ class Plotter:
         plot ellipse and points with annotations.
         points is a 2d numpy array with one point per row
         """
-        plt.figure()
-
         fig, ax = plt.subplots()
         fig.set_size_inches(8, 6)
 
@@ -216,7 +213,7 @@ class Plotter:
         plt.legend(handles=[zero_patch, start_end_patch])
 
         path = os.path.join(self.run_path, "ellipse_zero_point.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_project_points_ellipse(self, number_labels, ellipse_params):
@@ -272,8 +269,6 @@ class Plotter:
                           annotation_colors=annotation_colors)
 
     def plot_ocr(self, readings, title):
-        plt.figure()
-
         threshold = 0.9
         fig, ax = plt.subplots()
 
@@ -301,7 +296,7 @@ class Plotter:
                                       edgecolor='none'))
         plt.title(f"ocr results {title}")
         path = os.path.join(self.run_path, f"ocr_results_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_segmented_line(self, x_coords, y_coords, x_start_end,
@@ -314,16 +309,15 @@ class Plotter:
         plt.plot(x_start_end, line_fn(x_start_end), color='red')
 
         path = os.path.join(self.run_path, "segmentation_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
         # plt.show()
 
     def plot_heatmaps(self, heatmaps):
-        plt.figure(figsize=(12, 8))
-
         titles = ['Start', 'Middle', 'End']
 
         if heatmaps.shape[0] == 1:
+            plt.figure(figsize=(12, 8))
             heatmap_plot = plt.imshow(heatmaps[0],
                                       cmap=plt.cm.viridis,
                                       vmin=0,
@@ -352,7 +346,7 @@ class Plotter:
 
         # plt.tight_layout()
         path = os.path.join(self.run_path, "heatmaps_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_linear_fit(self, ocr_numbers, needle, line):
@@ -376,7 +370,7 @@ class Plotter:
 
         # Show the plot
         path = os.path.join(self.run_path, "reading_line_fit.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_linear_fit_ransac(self, ocr_numbers, needle, line, inlier_mask,
                                outlier_mask):
@@ -406,4 +400,4 @@ class Plotter:
 
         # Show the plot
         path = os.path.join(self.run_path, "reading_line_fit.jpg")
-        plt.savefig(path)
\ No newline at end of file
+        save_figure(path)
\ No newline at end of file
@@ -10,8 +10,9 @@ from PIL import Image
 
 # pylint: disable=no-member
 from evaluation import constants
+from plot_utils import save_figure
 # from geometry.ellipse import get_ellipse_pts, get_point_from_angle
-from geometry.circle import get_circle_pts, get_point_from_angle
+from geometry.circle import get_circle_pts, get_points_from_angles
 
 matplotlib.use('Agg')
 
@@ -36,21 +37,21 @@ class Plotter:
         plt.figure()
         plt.imshow(self.image)
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_any_image(self, img, title):
         plt.figure()
         plt.imshow(img)
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_point_img(self, img, points, title):
         plt.figure()
         plt.imshow(img)
         plt.scatter(points[:, 0], points[:, 1])
         path = os.path.join(self.run_path, f"image_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_ocr_visualization(self, vis, degree=None):
         plt.figure()
@@ -61,7 +62,7 @@ class Plotter:
         else:
             path = os.path.join(self.run_path,
                                 f"ocr_visualization_results{degree}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_bounding_box_img(self, boxes):
         """
@@ -86,7 +87,7 @@ class Plotter:
         plt.imshow(img)
 
         path = os.path.join(self.run_path, "bbox_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_test_point(self, point, title):
         plt.figure(figsize=(12, 8))
@@ -97,7 +98,7 @@ class Plotter:
         plt.tight_layout()
 
         path = os.path.join(self.run_path, f"{title}_point_result.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_key_points(self, key_point_list):
         plt.figure(figsize=(12, 8))
@@ -129,7 +130,7 @@ class Plotter:
         plt.tight_layout()
 
         path = os.path.join(self.run_path, "key_point_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_just_circle(self, image, circle_params, title):
@@ -138,7 +139,7 @@ class Plotter:
         x, y = get_circle_pts(circle_params)
         plt.plot(x, y)  # plot circle
         path = os.path.join(self.run_path, f"circle_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_circle(self,
                      points,
@@ -150,8 +151,6 @@ class Plotter:
         plot circle and points with annotations.
         points is a 2d numpy array with one point per row
         """
-        plt.figure()
-
         fig, ax = plt.subplots()
         fig.set_size_inches(8, 6)
 
@@ -178,7 +177,7 @@ class Plotter:
         plt.plot(x, y)  # plot circle
 
         path = os.path.join(self.run_path, f"circle_results_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_zero_point_circle(self, zero_point, start_end_point,
@@ -187,8 +186,6 @@ class Plotter:
         plot circle and points with annotations.
         points is a 2d numpy array with one point per row
         """
-        plt.figure()
-
         fig, ax = plt.subplots()
         fig.set_size_inches(8, 6)
 
@@ -220,22 +217,14 @@ class Plotter:
         plt.legend(handles=[zero_patch, start_end_patch])
 
         path = os.path.join(self.run_path, "circle_zero_point.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_project_points_circle(self, number_labels, circle_params):
-        projected_points = []
-        annotations = []
-
-        for number in number_labels:
-            proj_point = get_point_from_angle(number.theta, circle_params)
-            projected_points.append(proj_point)
-            annotations.append(number.reading)
-
-        projected_points_arr = np.array(projected_points)
-
-        if len(projected_points) == 1:
-            np.expand_dims(projected_points_arr, axis=0)
+        projected_points_arr = get_points_from_angles(
+            [number.theta for number in number_labels],
+            circle_params).reshape(-1, 2)
+        annotations = [number.reading for number in number_labels]
 
         ocr_color = '#38761d'
         annotation_colors = [ocr_color for _ in annotations]
@@ -248,22 +237,13 @@ class Plotter:
 
     def plot_final_reading_circle(self, number_labels, needle_point, reading,
                                    circle_params):
-        projected_points = []
-        annotations = []
-
-        for number in number_labels:
-            proj_point = get_point_from_angle(number.theta, circle_params)
-            projected_points.append(proj_point)
-            annotations.append(number.reading)
-
-        projected_points.append(needle_point)
+        projected_points_arr = np.vstack(
+            (get_points_from_angles([number.theta for number in number_labels],
+                                    circle_params).reshape(-1, 2),
+             np.reshape(needle_point, (1, 2))))
+        annotations = [number.reading for number in number_labels]
         annotations.append(reading)
 
-        projected_points_arr = np.array(projected_points)
-
-        if len(projected_points) == 1:
-            np.expand_dims(projected_points_arr, axis=0)
-
         ocr_color = '#38761d'
         final_reading_color = '#2b00ff'
         annotation_colors = [ocr_color for _ in annotations]
@@ -276,8 +256,6 @@ class Plotter:
                           annotation_colors=annotation_colors)
 
     def plot_ocr(self, readings, title):
-        plt.figure()
-
         threshold = 0.9
         fig, ax = plt.subplots()
 
@@ -305,7 +283,7 @@ class Plotter:
                                       edgecolor='none'))
         plt.title(f"ocr results {title}")
         path = os.path.join(self.run_path, f"ocr_results_{title}.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_segmented_line(self, x_coords, y_coords, x_start_end,
@@ -318,16 +296,15 @@ class Plotter:
         plt.plot(x_start_end, line_fn(x_start_end), color='red')
 
         path = os.path.join(self.run_path, "segmentation_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
         # plt.show()
 
     def plot_heatmaps(self, heatmaps):
-        plt.figure(figsize=(12, 8))
-
         titles = ['Start', 'Middle', 'End']
 
         if heatmaps.shape[0] == 1:
+            plt.figure(figsize=(12, 8))
             heatmap_plot = plt.imshow(heatmaps[0],
                                       cmap=plt.cm.viridis,
                                       vmin=0,
@@ -356,7 +333,7 @@ class Plotter:
 
         # plt.tight_layout()
         path = os.path.join(self.run_path, "heatmaps_results.jpg")
-        plt.savefig(path)
+        save_figure(path)
         # plt.show()
 
     def plot_linear_fit(self, ocr_numbers, needle, line):
@@ -380,7 +357,7 @@ class Plotter:
 
         # Show the plot
         path = os.path.join(self.run_path, "reading_line_fit.jpg")
-        plt.savefig(path)
+        save_figure(path)
 
     def plot_linear_fit_ransac(self, ocr_numbers, needle, line, inlier_mask,
                                outlier_mask):
@@ -410,4 +387,4 @@ class Plotter:
 
         # Show the plot
         path = os.path.join(self.run_path, "reading_line_fit.jpg")
-        plt.savefig(path)
+        save_figure(path)
@@ -0,0 +1,219 @@
+import os
+
+import cv2
+import numpy as np
+
+from evaluation import constants
+from geometry.circle import get_circle_pts, get_points_from_angles
+
+# colors in RGB, the images are converted to BGR only when written
+RED = (255, 0, 0)
+GREEN = (65, 255, 0)
+BLUE = (43, 0, 255)
+MAGENTA = (255, 0, 255)
+ORANGE = (255, 165, 0)
+GOLD = (255, 215, 0)
+OCR_GREEN = (56, 118, 29)
+LINE_BLUE = (31, 119, 180)
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+# size of the reading line fit chart and its margin
+CHART_SIZE = (640, 480)
+CHART_MARGIN = 50
+
+
+class OverlayRenderer:
+    """
+    Drop in for plots_circle.Plotter that draws the overlays directly onto a
+    copy of the image with OpenCV. Writes the same files as the Plotter, without
+    matplotlib figures, so memory stays constant and a frame takes milliseconds.
+    """
+    def __init__(self, run_path, image):
+        self.run_path = run_path
+        os.makedirs(self.run_path, exist_ok=True)
+        self.image = image
+
+    def set_image(self, image):
+        self.image = image
+
+    def save_img(self):
+        self._write(constants.ORIGINAL_IMG_FILE_NAME, self.image)
+
+    def plot_image(self, title):
+        self._write(f"image_{title}.jpg", self.image)
+
+    def plot_bounding_box_img(self, boxes):
+        img = np.copy(self.image)
+        for bbox in boxes:
+            cv2.rectangle(img, (int(bbox[0]), int(bbox[1])),
+                          (int(bbox[2]), int(bbox[3])),
+                          color=(0, 255, 0),
+                          thickness=3)
+        self._write("bbox_results.jpg", img)
+
+    def plot_heatmaps(self, heatmaps):
+        """
+        heatmaps side by side, with values between 0 and 1 in the viridis color map
+        """
+        tiles = []
+        for heatmap in heatmaps:
+            gray = (np.clip(heatmap, 0, 1) * 255).astype(np.uint8)
+            tile = cv2.applyColorMap(gray, cv2.COLORMAP_VIRIDIS)
+            tiles.append(cv2.cvtColor(tile, cv2.COLOR_BGR2RGB))
+        self._write("heatmaps_results.jpg", np.hstack(tiles))
+
+    def plot_key_points(self, key_point_list):
+        """
+        start, middle and end key points side by side
+        """
+        tiles = []
+        for key_points in key_point_list:
+            img = np.copy(self.image)
+            _draw_markers(img, key_points, RED, cv2.MARKER_TILTED_CROSS)
+            tiles.append(img)
+        self._write("key_point_results.jpg", np.hstack(tiles))
+
+    def plot_circle(self,
+                    points,
+                    circle_params,
+                    title,
+                    annotations=None,
+                    annotation_colors=None):
+        img = np.copy(self.image)
+        _draw_circle(img, circle_params)
+        _draw_points(img, points, RED)
+        if annotations is not None and annotation_colors is not None:
+            for point, annotation, color in zip(points, annotations,
+                                                annotation_colors):
+                _draw_label(img, str(annotation), point, color)
+        self._write(f"circle_results_{title}.jpg", img)
+
+    def plot_zero_point_circle(self,
+                               zero_point,
+                               start_end_point,
+                               circle_params,
+                               center_point=(0, 0)):
+        img = np.copy(self.image)
+        _draw_circle(img, circle_params)
+        _draw_points(img, start_end_point, RED)
+        _draw_points(img, np.reshape(zero_point, (1, 2)), GREEN)
+        _draw_points(img, np.reshape(center_point, (1, 2)), MAGENTA)
+        self._write("circle_zero_point.jpg", img)
+
+    def plot_segmented_line(self, x_coords, y_coords, x_start_end,
+                            line_coeffs):
+        img = np.copy(self.image)
+        mask = np.zeros(img.shape[:2], dtype=bool)
+        x = np.clip(np.asarray(x_coords, dtype=int), 0, img.shape[1] - 1)
+        y = np.clip(np.asarray(y_coords, dtype=int), 0, img.shape[0] - 1)
+        mask[y, x] = True
+        img[mask] = LINE_BLUE
+        line_fn = np.poly1d(line_coeffs)
+        x_start, x_end = x_start_end
+        cv2.line(img, _pixel((x_start, line_fn(x_start))),
+                 _pixel((x_end, line_fn(x_end))), RED, 2)
+        self._write("segmentation_results.jpg", img)
+
+    def plot_final_reading_circle(self, number_labels, needle_point, reading,
+                                  circle_params):
+        points = np.vstack(
+            (get_points_from_angles([number.theta for number in number_labels],
+                                    circle_params).reshape(-1, 2),
+             np.reshape(needle_point, (1, 2))))
+        annotations = [number.reading for number in number_labels]
+        colors = [OCR_GREEN for _ in number_labels]
+        annotations.append(reading)
+        colors.append(BLUE)
+        self.plot_circle(points,
+                         circle_params,
+                         title='final',
+                         annotations=annotations,
+                         annotation_colors=colors)
+
+    def plot_linear_fit(self, ocr_numbers, needle, line):
+        chart = _Chart(ocr_numbers, needle, line)
+        chart.scatter(ocr_numbers, ORANGE)
+        chart.line(line, LINE_BLUE)
+        chart.scatter(np.reshape(needle, (1, 2)), RED)
+        self._write("reading_line_fit.jpg", chart.image)
+
+    def plot_linear_fit_ransac(self, ocr_numbers, needle, line, inlier_mask,
+                               outlier_mask):
+        chart = _Chart(ocr_numbers, needle, line)
+        chart.scatter(ocr_numbers[inlier_mask], ORANGE)
+        chart.scatter(ocr_numbers[outlier_mask], GOLD)
+        chart.line(line, LINE_BLUE)
+        chart.scatter(np.reshape(needle, (1, 2)), RED)
+        self._write("reading_line_fit.jpg", chart.image)
+
+    def _write(self, file_name, img):
+        path = os.path.join(self.run_path, file_name)
+        cv2.imwrite(path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+
+
+class _Chart:
+    """
+    Reading over angle on the circle, from 0 to 2 pi.
+    """
+    def __init__(self, ocr_numbers, needle, line):
+        width, height = CHART_SIZE
+        self.image = np.full((height, width, 3), 255, dtype=np.uint8)
+        line_y = line(np.array([0, 2 * np.pi]))
+        y_values = np.concatenate((ocr_numbers[:, 1], [needle[1]], line_y))
+        self.y_min, self.y_max = float(np.min(y_values)), float(
+            np.max(y_values))
+        if self.y_max == self.y_min:
+            self.y_max = self.y_min + 1
+        cv2.rectangle(self.image, (CHART_MARGIN, CHART_MARGIN),
+                      (width - CHART_MARGIN, height - CHART_MARGIN), BLACK, 1)
+        for value, anchor in ((self.y_min, height - CHART_MARGIN),
+                              (self.y_max, CHART_MARGIN)):
+            cv2.putText(self.image, f"{value:.1f}", (2, anchor),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, BLACK, 1)
+
+    def to_pixel(self, x, y):
+        width, height = CHART_SIZE
+        px = CHART_MARGIN + x / (2 * np.pi) * (width - 2 * CHART_MARGIN)
+        py = height - CHART_MARGIN - (y - self.y_min) / (
+            self.y_max - self.y_min) * (height - 2 * CHART_MARGIN)
+        return _pixel((px, py))
+
+    def scatter(self, points, color):
+        for x, y in points:
+            cv2.circle(self.image, self.to_pixel(x, y), 5, color, -1)
+
+    def line(self, line, color):
+        start = self.to_pixel(0, line(0))
+        end = self.to_pixel(2 * np.pi, line(2 * np.pi))
+        cv2.line(self.image, start, end, color, 2)
+
+
+def _pixel(point):
+    return int(round(float(point[0]))), int(round(float(point[1])))
+
+
+def _draw_circle(img, circle_params):
+    x, y = get_circle_pts(circle_params)
+    pts = np.round(np.stack((x, y), axis=1)).astype(np.int32)
+    cv2.polylines(img, [pts], True, LINE_BLUE, 2)
+
+
+def _draw_points(img, points, color):
+    for point in points:
+        cv2.circle(img, _pixel(point), 5, color, -1)
+
+
+def _draw_markers(img, points, color, marker):
+    for point in points:
+        cv2.drawMarker(img, _pixel(point), color, marker, 12, 2)
+
+
+def _draw_label(img, text, point, color):
+    x, y = _pixel(point)
+    org = (x + 10, y - 10)
+    (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX,
+                                                0.8, 2)
+    cv2.rectangle(img, (org[0], org[1] - height - baseline),
+                  (org[0] + width, org[1] + baseline), WHITE, -1)
+    cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
+sys.path.append(parent_dir)
+
+# pylint: disable=wrong-import-position
+from segmentation.segmenation_inference import get_fitted_line, \
+    TLS_LINE_FIT, ODR_LINE_FIT
+from evaluation import constants
+
+
+def load_needle_masks(run_path):
+    """
+    Collect the predicted needle masks of all result_full.json files below run_path.
+    :return: dict image name -> (x coordinates, y coordinates)
+    """
+    needle_masks = {}
+    for root, _, files in os.walk(run_path):
+        if constants.RESULT_FULL_FILE_NAME not in files:
+            continue
+        with open(os.path.join(root, constants.RESULT_FULL_FILE_NAME),
+                  'r') as file:
+            result_dict = json.load(file)
+        needle_mask = result_dict.get(constants.NEEDLE_MASK_KEY,
+                                      constants.FAILED)
+        if needle_mask == constants.FAILED or len(needle_mask['x']) < 2:
+            continue
+        needle_masks[os.path.basename(root)] = (np.array(needle_mask['x']),
+                                                np.array(needle_mask['y']))
+    return needle_masks
+
+
+def time_line_fit(needle_masks, method, repeats):
+    """
+    :return: mean time per mask in seconds and the fitted lines
+    """
+    lines = {}
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for name, (x_coords, y_coords) in needle_masks.items():
+            lines[name] = get_fitted_line(x_coords, y_coords, method)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeats * len(needle_masks)), lines
+
+
+def angle_difference(coeffs_1, coeffs_2):
+    # angle between two lines in degrees, independent of the direction
+    diff = abs(np.arctan(coeffs_1[0]) - np.arctan(coeffs_2[0]))
+    return np.rad2deg(min(diff, np.pi - diff))
+
+
+def main():
+    args = read_args()
+
+    needle_masks = load_needle_masks(args.run_path)
+    if not needle_masks:
+        print(f"No needle masks found in {args.run_path}")
+        return
+    n_pixels = [len(x_coords) for x_coords, _ in needle_masks.values()]
+    print(f"{len(needle_masks)} needle masks, "
+          f"{np.mean(n_pixels):.0f} pixels on average")
+
+    tls_time, tls_lines = time_line_fit(needle_masks, TLS_LINE_FIT,
+                                        args.repeats)
+    odr_time, odr_lines = time_line_fit(needle_masks, ODR_LINE_FIT,
+                                        args.repeats)
+
+    angle_diffs = [
+        angle_difference(tls_lines[name][0], odr_lines[name][0])
+        for name in needle_masks
+    ]
+    res_var_diffs = [
+        abs(tls_lines[name][1] - odr_lines[name][1]) for name in needle_masks
+    ]
+
+    print(f"odr: {odr_time * 1000:.3f} ms per mask")
+    print(f"tls: {tls_time * 1000:.3f} ms per mask")
+    print(f"speedup: {odr_time / tls_time:.1f}x")
+    print(f"angle difference in degrees: mean {np.mean(angle_diffs):.4f}, "
+          f"max {np.max(angle_diffs):.4f}")
+    print(f"residual variance difference: mean {np.mean(res_var_diffs):.4f}, "
+          f"max {np.max(res_var_diffs):.4f}")
+
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--run_path',
+                        type=str,
+                        required=True,
+                        help="Run folder of the pipeline, run with --eval")
+    parser.add_argument('--repeats',
+                        type=int,
+                        default=5,
+                        help="How often every mask is fitted")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
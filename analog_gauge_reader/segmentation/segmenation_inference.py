@@ -1,8 +1,16 @@
-from ultralytics import YOLO
 import numpy as np
 import cv2
 from scipy import odr
 
+from model_registry import get_yolo_model
+
+TLS_LINE_FIT = 'tls'
+ODR_LINE_FIT = 'odr'
+LINE_FIT_METHODS = (TLS_LINE_FIT, ODR_LINE_FIT)
+
+# smallest x component of the line direction, limits the slope to 1e6
+MIN_DIRECTION_X = 1e-6
+
 
 def segment_gauge_needle(image, model_path='best.pt'):
     """
@@ -11,16 +19,40 @@ def segment_gauge_needle(image, model_path='best.pt'):
     :param model_path: path to yolov8 detection model
     :return: segmentation of needle
     """
-    model = YOLO(model_path)  # load model
+    model = get_yolo_model(model_path)  # loaded once per process
 
     results = model.predict(
         image)  # run inference, detects gauge face and needle
 
+    return _get_needle_coords(results[0], image)
+
+
+def segment_gauge_needle_batch(images, model_path='best.pt'):
+    """
+    same as segment_gauge_needle, but for a list of images in one forward pass
+    :param images: list of numpy images
+    :param model_path: path to yolov8 segmentation model
+    :return: list with (x_coords, y_coords) per image, None where no needle was found
+    """
+    model = get_yolo_model(model_path)  # loaded once per process
+
+    results = model.predict(images)
+
+    needle_coords = []
+    for result, image in zip(results, images):
+        try:
+            needle_coords.append(_get_needle_coords(result, image))
+        except AttributeError:
+            needle_coords.append(None)
+    return needle_coords
+
+
+def _get_needle_coords(result, image):
     # get list of detected boxes, already sorted by confidence
     try:
-        needle_mask = results[0].masks.data[0].numpy()
+        needle_mask = result.masks.data[0].numpy()
     except:
-        needle_mask = results[0].masks.data[0].cpu().numpy()
+        needle_mask = result.masks.data[0].cpu().numpy()
     needle_mask_resized = cv2.resize(needle_mask,
                                      dsize=(image.shape[1], image.shape[0]),
                                      interpolation=cv2.INTER_NEAREST)
@@ -60,7 +92,49 @@ def segment_gauge_needle(image, model_path='best.pt'):
     return x_coords, y_coords
 
 
-def get_fitted_line(x_coords, y_coords):
+def get_fitted_line(x_coords, y_coords, method=TLS_LINE_FIT):
+    """
+    Fit a line y = m * x + b minimizing the orthogonal distances to the points.
+    :param method: 'tls' solves the total least squares in closed form,
+        'odr' runs the iterative orthogonal distance regression of scipy
+    :return: line coefficients [m, b] and residual variance
+    """
+    if method == TLS_LINE_FIT:
+        return _get_fitted_line_tls(x_coords, y_coords)
+    if method == ODR_LINE_FIT:
+        return _get_fitted_line_odr(x_coords, y_coords)
+    raise ValueError(
+        f"Unknown line fit {method}, choose one of {LINE_FIT_METHODS}")
+
+
+def _get_fitted_line_tls(x_coords, y_coords):
+    """
+    The total least squares line goes through the centroid along the
+    eigenvector of the largest eigenvalue of the covariance matrix.
+    The smallest eigenvalue is the mean squared orthogonal distance.
+    """
+    points = np.stack((x_coords, y_coords), axis=1).astype(np.float64)
+    centroid = np.mean(points, axis=0)
+    centered = points - centroid
+    covariance = centered.T @ centered / len(points)
+
+    # eigenvalues in ascending order
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    direction_x, direction_y = eigenvectors[:, 1]
+
+    # vertical needle, keep the slope finite so cut_off_line still works
+    if abs(direction_x) < MIN_DIRECTION_X:
+        direction_x = MIN_DIRECTION_X if direction_x >= 0 else -MIN_DIRECTION_X
+    slope = direction_y / direction_x
+    intercept = centroid[1] - slope * centroid[0]
+
+    # same definition as odr: sum of squared residuals over degrees of freedom
+    n_points = len(points)
+    residual_variance = max(eigenvalues[0], 0) * n_points / max(n_points - 2, 1)
+    return np.array([slope, intercept]), residual_variance
+
+
+def _get_fitted_line_odr(x_coords, y_coords):
     """
     Do orthogonal distance regression (odr) for this.
     """
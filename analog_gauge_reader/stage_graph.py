@@ -0,0 +1,127 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Stage:
+    """
+    One step of the pipeline. function is called with the values named in
+    consumes as keyword arguments and returns the values named in produces,
+    as a tuple if it produces several.
+    """
+    def __init__(self, name, function, consumes=(), produces=()):
+        self.name = name
+        self.function = function
+        self.consumes = tuple(consumes)
+        self.produces = tuple(produces)
+
+    def run(self, values):
+        start = time.perf_counter()
+        result = self.function(**{key: values[key] for key in self.consumes})
+        if len(self.produces) == 1:
+            result = (result, )
+        return dict(zip(self.produces, result)), time.perf_counter() - start
+
+
+class StageTimings:
+    """
+    Seconds each stage took and the wall time of the whole graph.
+    The sum of the stages is what running them one after another would take.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.wall_time = 0.0
+
+    @property
+    def sequential_time(self):
+        return sum(self.stages.values())
+
+    def __str__(self):
+        stages = ", ".join(f"{name} {seconds * 1000:.0f}ms"
+                           for name, seconds in self.stages.items())
+        return (f"{stages}; wall {self.wall_time * 1000:.0f}ms, "
+                f"sequential {self.sequential_time * 1000:.0f}ms")
+
+
+def needed_stages(stages, wanted):
+    """
+    Stages whose products are wanted, directly or through a later stage.
+    """
+    needed_keys = set(wanted)
+    needed = []
+    # a stage only consumes products of stages before it
+    for stage in reversed(stages):
+        if needed_keys.intersection(stage.produces):
+            needed.append(stage)
+            needed_keys.update(stage.consumes)
+    return needed[::-1]
+
+
+def run_stages(stages, inputs, executor=None, wanted=None):
+    """
+    Run every stage as soon as everything it consumes is available.
+    With an executor, stages that do not depend on each other run at the same
+    time. Torch and onnxruntime release the GIL, so threads are enough.
+    :param stages: list of Stage, a stage must come after the stages it consumes from
+    :param inputs: dict with the values that are available from the start
+    :param executor: concurrent.futures executor, None runs the stages one after another
+    :param wanted: names of the values the caller needs, stages nobody
+        needs are skipped. None runs all stages.
+    :return: dict with the inputs and all products, StageTimings
+    """
+    values = dict(inputs)
+    timings = StageTimings()
+    pending = list(stages) if wanted is None else needed_stages(stages, wanted)
+    skipped = [stage.name for stage in stages if stage not in pending]
+    if skipped:
+        logging.info("Skip stages %s, their products are not needed", skipped)
+    running = {}
+    start = time.perf_counter()
+
+    while pending or running:
+        ready = [
+            stage for stage in pending
+            if all(key in values for key in stage.consumes)
+        ]
+        if not ready and not running:
+            missing = {
+                stage.name: [key for key in stage.consumes if key not in values]
+                for stage in pending
+            }
+            raise ValueError(f"Stages can not run, missing inputs: {missing}")
+
+        for stage in ready:
+            pending.remove(stage)
+            if executor is None:
+                products, seconds = stage.run(values)
+                values.update(products)
+                timings.stages[stage.name] = seconds
+            else:
+                running[executor.submit(stage.run, values)] = stage
+
+        if running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                products, seconds = future.result()
+                values.update(products)
+                timings.stages[stage.name] = seconds
+
+    timings.wall_time = time.perf_counter() - start
+    logging.info("Stage timings: %s", timings)
+    return values, timings
+
+
+def thread_budget(n_parallel, n_cores=None):
+    """
+    Intra-op threads per stage, so n_parallel stages running at the same time
+    do not use more threads than there are cores.
+    """
+    n_cores = os.cpu_count() if n_cores is None else n_cores
+    return max(1, (n_cores or 1) // n_parallel)
+
+
+def create_stage_executor(n_parallel):
+    return ThreadPoolExecutor(max_workers=n_parallel,
+                              thread_name_prefix="stage")
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+
+# Append path of parent directory to system to import all modules correctly
+parent_dir = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
+sys.path.append(parent_dir)
+
+# pylint: disable=wrong-import-position
+from geometry.circle import get_polar_angle, get_polar_angles, \
+    get_point_from_angle, get_points_from_angles, project_point, project_points, \
+    get_line_circle_point, get_line_circle_points, get_theta_middle, get_theta_middles
+
+N_SAMPLES = 500
+
+
+def _random_circles(rng, n_samples):
+    return np.column_stack((rng.uniform(100, 350, n_samples),
+                            rng.uniform(100, 350, n_samples),
+                            rng.uniform(20, 200, n_samples)))
+
+
+def test_polar_angles():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 448, (N_SAMPLES, 2))
+    circles = _random_circles(rng, N_SAMPLES)
+    expected = [
+        get_polar_angle(point, circle)
+        for point, circle in zip(points, circles)
+    ]
+    np.testing.assert_allclose(get_polar_angles(points, circles), expected)
+
+
+def test_points_from_angles_and_projection():
+    rng = np.random.default_rng(1)
+    thetas = rng.uniform(0, 2 * np.pi, N_SAMPLES)
+    points = rng.uniform(0, 448, (N_SAMPLES, 2))
+    circle = _random_circles(rng, 1)[0]
+    np.testing.assert_allclose(
+        get_points_from_angles(thetas, circle),
+        [get_point_from_angle(theta, circle) for theta in thetas])
+    np.testing.assert_allclose(project_points(points, circle),
+                               [project_point(point, circle) for point in points])
+
+
+def test_line_circle_points():
+    rng = np.random.default_rng(2)
+    circles = _random_circles(rng, N_SAMPLES)
+    line_coeffs = np.column_stack((rng.uniform(-5, 5, N_SAMPLES),
+                                   rng.uniform(-500, 800, N_SAMPLES)))
+    x = np.sort(rng.uniform(0, 448, (N_SAMPLES, 2)), axis=1)
+
+    points, valid = get_line_circle_points(line_coeffs, x, circles)
+    for index in range(N_SAMPLES):
+        expected = get_line_circle_point(line_coeffs[index], x[index],
+                                         circles[index])
+        assert valid[index] == (expected is not None)
+        if expected is not None:
+            np.testing.assert_allclose(points[index], expected, atol=1e-8)
+        else:
+            assert np.all(np.isnan(points[index]))
+    # both cases have to be covered
+    assert 0 < np.count_nonzero(valid) < N_SAMPLES
+
+
+def test_theta_middles():
+    rng = np.random.default_rng(3)
+    theta_1 = rng.uniform(0, 2 * np.pi, N_SAMPLES)
+    theta_2 = rng.uniform(0, 2 * np.pi, N_SAMPLES)
+    np.testing.assert_allclose(get_theta_middles(theta_1, theta_2), [
+        get_theta_middle(first, second)
+        for first, second in zip(theta_1, theta_2)
+    ])
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+# Append path of parent directory to system to import all modules correctly
+parent_dir = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
+sys.path.append(parent_dir)
+
+# pylint: disable=wrong-import-position
+from key_point_detection.model import Encoder, Decoder, EncoderDecoder, \
+    DINO_CHANNELS, N_CHANNELS, N_HEATMAPS
+
+# small input, the encoder works on any multiple of the patch size
+SIZE = (56, 56)
+
+
+def _model():
+    encoder = Encoder(pretrained=False)
+    decoder = Decoder(DINO_CHANNELS, N_CHANNELS, SIZE, N_HEATMAPS)
+    return EncoderDecoder(encoder, decoder).eval()
+
+
+def test_encoder_keeps_input_dtype():
+    encoder = Encoder(pretrained=False)
+    features = encoder(torch.zeros((1, 3, *SIZE)))
+    assert features.dtype == torch.float32
+    assert features.shape == (1, DINO_CHANNELS, SIZE[0] // 14, SIZE[1] // 14)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(),
+                    reason="half precision runs on the gpu only")
+def test_half_model_runs():
+    model = _model().half().to('cuda')
+    with torch.no_grad():
+        heatmaps = model(
+            torch.zeros((1, 3, *SIZE), dtype=torch.half, device='cuda'))
+    assert heatmaps.dtype == torch.half
+    assert heatmaps.shape == (1, N_HEATMAPS) + SIZE
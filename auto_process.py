@@ -1,6 +1,7 @@
-from capture_image import captureImage
-from read_image import readImage
+from capture_image import captureImage, CameraReader
+from read_image import readImage, loadModels
 from send_data import sendData, deleteData
+from frame_buffer import SharedFrameRing
 from concurrent.futures import ProcessPoolExecutor
 from multiprocessing import Process, Queue
 from PIL import Image
@@ -8,11 +9,15 @@ import time
 import sys
 import os
 import cv2
+import json
 from datetime import datetime
 
 from pathlib import Path
 from config import verify_model_files, CAPTURE_INTERVAL
 
+# frames that can wait for the inference worker before capture blocks
+N_FRAME_SLOTS = 2
+
 # Add project root to sys.path for absolute imports
 # sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
@@ -71,11 +76,9 @@ def isActiveCamera(name):
     return -1
 
 
-def postCapture(name, rgd_img, index):
-    redirect_subprocess_output(index)
-
+def postCapture(name, rgd_img, index, camera_details):
     try:
-        data = readImage(name, rgd_img)
+        data = readImage(name, rgd_img, index, camera_details)
         if data is None:
             print("No data returned from image processing")
             return
@@ -101,7 +104,38 @@ def postCapture(name, rgd_img, index):
     #    deleteData(name, path)
 
 
-def fullProcess(index, interval):
+def loadCameraDetails():
+    """
+    Calibration and metadata of every camera, keyed by camera index,
+    from the same config_calibration.json as scheduled_runs.py.
+    """
+    with open("config_calibration.json", "r") as f:
+        camera_dict_raw = json.load(f)
+    return {int(k) : v for k, v in camera_dict_raw.items()}
+
+
+def inferenceWorker(ring, camera_dict):
+    """
+    Persistent inference process, models are loaded once and the frames are
+    read in place from the shared memory ring.
+    """
+    redirect_subprocess_output("worker")
+    loadModels()
+    try:
+        while True:
+            slot, index, name, frame = ring.readFrame()
+            try:
+                if index not in camera_dict:
+                    print(f"No calibration for camera {index} in config_calibration.json, frame skipped")
+                    continue
+                postCapture(name, frame, index, camera_dict[index])
+            finally:
+                ring.releaseSlot(slot)
+    except KeyboardInterrupt:
+        print("Stopping inference worker")
+
+
+def fullProcess(index, interval, ring):
     redirect_camera_output(index)
     
     print(f"Start running full process for camera {index}")
@@ -110,16 +144,16 @@ def fullProcess(index, interval):
     if not capture.isOpened():
         print(f"Failed to open camera {index}")
         return
+    # grabs in the background, a frame is only decoded when a reading is due
+    capture = CameraReader(capture)
 
     try:
         while True:
             name, frame = captureImage(capture, index)
             if frame is not None:
-                p = Process(target=postCapture, args=(name, frame, index))
-                p.daemon = True  # Dies when main process dies
-                p.start()
-                # Note: Not joining process to avoid blocking
-                
+                # copied into a free slot, blocks only if the worker is more than N_FRAME_SLOTS frames behind
+                ring.writeFrame(index, name, frame)
+
             time.sleep(interval)
             print(f"Break for {interval} seconds ...")
             
@@ -137,6 +171,11 @@ def main():
     interval = CAPTURE_INTERVAL
     if len(sys.argv) == 2:
         interval = int(sys.argv[1])
+
+    camera_dict = loadCameraDetails()
+    if not camera_dict:
+        print("Error loading the camera configuration file.")
+        return
         
     try:
         activeCams = scanActiveCameras()
@@ -144,8 +183,18 @@ def main():
             print("No active cameras found")
             return
             
-        # For now, just run the first camera (you can extend this for multiple cameras)
-        fullProcess(activeCams[0], interval)
+        ring = SharedFrameRing(N_FRAME_SLOTS)
+        worker = Process(target=inferenceWorker, args=(ring, camera_dict))
+        worker.daemon = True  # Dies when main process dies
+        worker.start()
+
+        try:
+            # For now, just run the first camera (you can extend this for multiple cameras)
+            fullProcess(activeCams[0], interval, ring)
+        finally:
+            worker.terminate()
+            worker.join()
+            ring.close()
         
     except KeyboardInterrupt:
         print("Stop upon keyboard interrupt")
@@ -66,6 +66,8 @@ def main():
             "end_marking": 100.0,
             "unit": "psi"
         }""")
+        print("Optionally add \"change_threshold\" (e.g. 3.0) to reuse the last reading while the gauge does not change,")
+        print("and \"forced_refresh\" (seconds, default 600) after which the gauge is read again in any case.")
         print("\nPaste your input and press Enter:")
 
         user_input_str = input()
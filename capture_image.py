@@ -1,9 +1,76 @@
 import cv2
 import os
 import math
+import threading
+import time
 from datetime import datetime
 
 SAVE_PATH = "captured_images"
+# seconds to wait for a frame grabbed after the previous capture
+GRAB_TIMEOUT = 5
+
+
+class CameraReader:
+    """
+    Keeps the camera buffer empty with a background thread that only grab()s frames.
+    A frame is decoded only when a reading is due, instead of decoding and
+    discarding the whole buffer at every capture.
+    The capture is only used by the grab thread, so retrieve() asks it to decode
+    the next grabbed frame. It waits for the grab in progress, at most one frame
+    period of the camera, and gets a frame that is never older than the call.
+    """
+    def __init__(self, capture):
+        self.capture = capture
+        # guards the state below, never held while the capture grabs or decodes
+        self._state = threading.Condition()
+        self._requested = False
+        # number of decoded frames and the latest one, (ret, frame)
+        self._frame_count = 0
+        self._frame = (False, None)
+        self._failed = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._grabLoop, daemon=True)
+        self._thread.start()
+
+    def _grabLoop(self):
+        while not self._stopped.is_set():
+            # grab blocks until the camera delivers the next frame, which paces this loop
+            ret = self.capture.grab()
+            with self._state:
+                decode = ret and self._requested
+                if decode:
+                    self._requested = False
+            frame = self.capture.retrieve() if decode else None
+            with self._state:
+                self._failed = not ret
+                if decode:
+                    self._frame = frame
+                    self._frame_count += 1
+                self._state.notify_all()
+            if not ret:
+                time.sleep(0.1)
+
+    def retrieve(self, timeout=GRAB_TIMEOUT):
+        """
+        Decodes the next grabbed frame.
+        Returns (ret, frame) like cv2.VideoCapture.read.
+        """
+        with self._state:
+            frame_count = self._frame_count
+            self._requested = True
+            if not self._state.wait_for(
+                    lambda: self._frame_count > frame_count or self._failed,
+                    timeout) or self._frame_count == frame_count:
+                self._requested = False
+                return False, None
+            return self._frame
+
+    def release(self):
+        with self._state:
+            self._stopped.set()
+            self._state.notify_all()
+        self._thread.join(timeout=GRAB_TIMEOUT)
+        self.capture.release()
 
 
 # returns:
@@ -13,9 +80,13 @@ def captureImage(capture, index):
 
     print(f"Capture from camera {index}")
 
-    # flush buffer before taking new picture
-    for _ in range(0, math.floor(capture.get(cv2.CAP_PROP_BUFFERSIZE)) + 1):
-            ret, frame = capture.read()
+    if isinstance(capture, CameraReader):
+        ret, frame = capture.retrieve()
+    else:
+        # flush buffer before taking new picture, only the last frame is decoded
+        for _ in range(0, math.floor(capture.get(cv2.CAP_PROP_BUFFERSIZE)) + 1):
+            capture.grab()
+        ret, frame = capture.retrieve()
 
     if ret:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
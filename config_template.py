@@ -6,6 +6,11 @@ INFLUX_PASSWORD = ""
 INFLUX_USERNAME = ""
 INFLUX_BUCKET = ""
 INFLUX_ORG = ""
+# Readings are spooled on disk and sent in batches of up to INFLUX_BATCH_SIZE,
+# at the latest INFLUX_FLUSH_INTERVAL seconds after they were queued
+INFLUX_BATCH_SIZE = 50
+INFLUX_FLUSH_INTERVAL = 5  # seconds
+INFLUX_SPOOL_PATH = os.path.expanduser("~/.gauge_reader/influx_spool")
 
 CONFIG_CALIBRATION_PATH = ""
 BASE_MODEL_PATH = os.path.expanduser()
@@ -14,11 +19,43 @@ DETECTION_MODEL_PATH = os.path.join(BASE_MODEL_PATH, "models", "gauge_detection_
 KEY_POINT_MODEL_PATH = os.path.join(BASE_MODEL_PATH, "models", "key_point_model.pt") 
 SEGMENTATION_MODEL_PATH = os.path.join(BASE_MODEL_PATH, "models", "best.pt")
 
+# Models are loaded once per process on this device ("cpu", "cuda:0")
+# with this precision ("fp32", "fp16" on gpu, "int8" or "bf16" for the key point model on cpu)
+MODEL_DEVICE = "cpu"
+MODEL_PRECISION = "fp32"
+# Inference backend, "torch" or "onnx" (onnxruntime, cpu only). With onnx the
+# models are exported next to the .pt files on the first run
+MODEL_BACKEND = "torch"
+# CPU threads used for inference, None keeps the library default
+MODEL_THREADS = None
+# Run key point detection and needle segmentation of a batch at the same time on a
+# thread pool. With MODEL_THREADS None the cores are split between the stages
+PARALLEL_STAGES = False
+# Key point extraction from the heatmaps, "mean_shift" or the faster "nms"
+KEY_POINT_METHOD = "mean_shift"
+# Cache gauge box, key points and circle per camera and only segment the needle
+# per frame, everything is detected again after this many readings or if the camera moved
+GAUGE_TRACKING = False
+TRACKING_REFRESH_INTERVAL = 30
+# Per camera in config_calibration.json: "change_threshold" (mean absolute gray level
+# difference of the gauge crop) skips all networks while the gauge does not change and
+# sends the last reading with status "carried_forward", at the latest every "forced_refresh" seconds
+
 # Processing configuration
 CAPTURE_INTERVAL = 10  # seconds
+# Frames of all cameras arriving within this window are read in one batch
+INFERENCE_BATCH_WINDOW = 1.0  # seconds
 
 # Result path
 RESULT_PATH = os.path.expanduser("")
+# Debug plots and result files are written in the background for every
+# DIAGNOSTICS_SAMPLE_EVERY-th reading (0 for none) and, if DIAGNOSTICS_FAILURES, every failed one.
+# DIAGNOSTICS_EVAL_MODE adds result_full.json with the needle masks. Readings are skipped
+# while more than DIAGNOSTICS_QUEUE_SIZE wait to be written
+DIAGNOSTICS_SAMPLE_EVERY = 100
+DIAGNOSTICS_FAILURES = True
+DIAGNOSTICS_EVAL_MODE = False
+DIAGNOSTICS_QUEUE_SIZE = 8
 
 # Verify model files exist
 def verify_model_files():
@@ -0,0 +1,102 @@
+import atexit
+import os
+import queue
+import threading
+
+from analog_gauge_reader.pipeline_v5_run import write_files, OverlayRenderer, plot_reading, get_result_dicts
+from config import RESULT_PATH, DIAGNOSTICS_SAMPLE_EVERY, DIAGNOSTICS_FAILURES, DIAGNOSTICS_EVAL_MODE, \
+    DIAGNOSTICS_QUEUE_SIZE
+
+
+class DiagnosticsWorker:
+    """
+    Writes debug plots and result files of sampled readings in a background thread,
+    so plotting never delays the next reading.
+    Every sample_every-th reading and, with failures, every failed reading is written.
+    If the queue is full the reading is skipped, diagnostics must never block inference.
+    """
+    def __init__(self, result_path=RESULT_PATH, sample_every=DIAGNOSTICS_SAMPLE_EVERY,
+                 failures=DIAGNOSTICS_FAILURES, eval_mode=DIAGNOSTICS_EVAL_MODE,
+                 queue_size=DIAGNOSTICS_QUEUE_SIZE):
+        self.result_path = result_path
+        self.sample_every = sample_every
+        self.failures = failures
+        self.eval_mode = eval_mode
+        self.dropped = 0
+        self._count = 0
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def enabled(self):
+        return bool(self.sample_every) or self.failures
+
+    def submit(self, name, frame, reading, force=False, eval_mode=False):
+        """
+        Queue the diagnostics of one reading if it is sampled.
+        The reading must have been made with keep_details.
+        :param force: write it even if it is not sampled, e.g. for debug=True
+        :param eval_mode: also write result_full.json for this reading
+        """
+        if reading.carried_forward:
+            return
+        self._count += 1
+        sampled = self.sample_every and self._count % self.sample_every == 0
+        failed = self.failures and not reading.is_valid()
+        if not (force or sampled or failed):
+            return
+
+        # frames can be views into the shared frame ring, which are reused after the read
+        frame = frame.copy()
+        if 'image' in reading.details:
+            reading.details['image'] = frame
+        try:
+            self._jobs.put_nowait((name, frame, reading, eval_mode or self.eval_mode))
+        except queue.Full:
+            self.dropped += 1
+            print(f"Diagnostics queue full, skipped {name} ({self.dropped} skipped so far)")
+
+    def close(self, timeout=30):
+        """
+        Write the queued diagnostics and stop the thread.
+        """
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            name, frame, reading, eval_mode = job
+            try:
+                self._write(name, frame, reading, eval_mode)
+            except Exception as e:
+                print(f"Error writing diagnostics of {name}: {e}")
+
+    def _write(self, name, frame, reading, eval_mode):
+        run_path = os.path.join(self.result_path, name)
+        os.makedirs(run_path, exist_ok=True)
+        # draws with OpenCV, no matplotlib figures in the long running process
+        renderer = OverlayRenderer(run_path, frame)
+        renderer.save_img()
+        plot_reading(renderer, reading)
+        result, result_full = get_result_dicts(reading)
+        write_files(result, result_full, reading.errors, run_path, eval_mode)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def getDiagnosticsWorker():
+    """
+    Diagnostics worker of this process, created on first use and drained at exit.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = DiagnosticsWorker()
+            atexit.register(_worker.close)
+        return _worker
@@ -0,0 +1,60 @@
+from multiprocessing import Queue, shared_memory
+
+import numpy as np
+
+# largest frame a slot can hold, the cameras are configured for 1080x840
+MAX_FRAME_SHAPE = (1080, 1920, 3)
+
+
+class SharedFrameRing:
+    """
+    Ring of frame slots in shared memory with a small descriptor queue.
+    Capture processes copy a frame into a free slot and publish a descriptor,
+    the inference worker reads the frame in place and releases the slot once
+    it is done with it. Only the descriptor (slot, camera index, name, shape)
+    goes through a pipe, the frame itself is never pickled.
+    Must be created in the main process before the other processes are started.
+    """
+    def __init__(self, n_slots, max_frame_shape=MAX_FRAME_SHAPE):
+        self.n_slots = n_slots
+        self.slot_size = int(np.prod(max_frame_shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=n_slots * self.slot_size)
+
+        self.free_slots = Queue()
+        for slot in range(n_slots):
+            self.free_slots.put(slot)
+        self.descriptors = Queue()
+
+    def writeFrame(self, camera_index, name, frame, timeout=None):
+        """
+        Called from a capture process. Blocks while all slots are in use.
+        Raises queue.Empty if no slot got free within timeout.
+        """
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_size:
+            raise ValueError(f"Frame {frame.shape} {frame.dtype} does not fit into a slot of {self.slot_size} bytes")
+        slot = self.free_slots.get(timeout=timeout)
+        self._slotView(slot, frame.shape)[...] = frame
+        self.descriptors.put((slot, camera_index, name, frame.shape))
+
+    def readFrame(self, timeout=None):
+        """
+        Called from the inference worker. The returned frame is a view into the
+        shared memory and only valid until releaseSlot(slot) is called.
+        Raises queue.Empty if no frame arrived within timeout.
+        Returns slot, camera_index, name, frame
+        """
+        slot, camera_index, name, shape = self.descriptors.get(timeout=timeout)
+        return slot, camera_index, name, self._slotView(slot, shape)
+
+    def releaseSlot(self, slot):
+        self.free_slots.put(slot)
+
+    def _slotView(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_size)
+
+    def close(self):
+        """
+        Free the shared memory, call once from the main process at shutdown.
+        """
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,101 @@
+import queue
+import time
+from multiprocessing import Queue
+
+from read_image import createReader, runModelBatch
+from frame_buffer import SharedFrameRing
+from config import INFERENCE_BATCH_WINDOW
+
+# seconds a camera waits for its reading before giving up on the frame
+RESULT_TIMEOUT = 120
+# frame slots per camera, one being read while the next one is written
+SLOTS_PER_CAMERA = 2
+
+
+class InferenceScheduler:
+    """
+    Central inference for all cameras.
+    Camera processes submit their frames with readFrame(). The scheduler process
+    collects the frames that arrive within a short window and reads them as one
+    batch, so every network runs one forward pass per window instead of one per camera.
+    Frames are handed over through a shared memory ring, not pickled.
+    """
+    def __init__(self, camera_dict, batch_window=INFERENCE_BATCH_WINDOW):
+        # camera_dict has the format {camera_index : {configuration key value pairs}}
+        self.camera_dict = camera_dict
+        self.batch_window = batch_window
+        self.frames = SharedFrameRing(SLOTS_PER_CAMERA * len(camera_dict))
+        self.result_queues = {camera_index: Queue() for camera_index in camera_dict}
+
+    def readFrame(self, camera_index, name, frame):
+        """
+        Called from a camera process, blocks until the frame is read.
+        Returns the same as runModel, a dict with value and unit or None
+        """
+        deadline = time.time() + RESULT_TIMEOUT
+        try:
+            self.frames.writeFrame(camera_index, name, frame, timeout=RESULT_TIMEOUT)
+        except queue.Empty:
+            print(f"No free frame slot for {name} within {RESULT_TIMEOUT}s")
+            return None
+        while True:
+            try:
+                result_name, result = self.result_queues[camera_index].get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                print(f"No result for {name} within {RESULT_TIMEOUT}s")
+                return None
+            # results of frames we gave up on earlier are dropped
+            if result_name == name:
+                return result
+
+    def run(self):
+        """
+        Main loop of the scheduler process.
+        """
+        reader = createReader()
+        print(f"Inference scheduler running for cameras {list(self.camera_dict.keys())}")
+        while True:
+            requests = self._collectRequests()
+            slots = [request[0] for request in requests]
+            camera_indices = [request[1] for request in requests]
+            names = [request[2] for request in requests]
+            # views into the shared memory, valid until the slots are released
+            frames = [request[3] for request in requests]
+            camera_details_list = [self.camera_dict[camera_index] for camera_index in camera_indices]
+
+            start = time.time()
+            try:
+                results = runModelBatch(reader, names, frames, camera_details_list,
+                                        camera_indices=camera_indices)
+            except Exception as e:
+                print(f"Error in batched inference: {e}")
+                results = [None] * len(requests)
+            for slot in slots:
+                self.frames.releaseSlot(slot)
+            print(f"Read batch of {len(requests)} frames from cameras {camera_indices} in {time.time() - start:.2f}s")
+
+            for camera_index, name, result in zip(camera_indices, names, results):
+                self.result_queues[camera_index].put((name, result))
+
+    def _collectRequests(self):
+        # block until the first frame arrives, then wait at most one window for the other cameras
+        requests = [self.frames.readFrame()]
+        deadline = time.time() + self.batch_window
+        waiting = set(self.camera_dict.keys()) - {requests[0][1]}
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self.frames.readFrame(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            waiting.discard(request[1])
+        return requests
+
+    def close(self):
+        """
+        Free the frame ring, call from the main process after all other processes stopped.
+        """
+        self.frames.close()
@@ -11,8 +11,12 @@ from pathlib import Path
 #     sys.path.insert(0, str(PROJECT_ROOT))
 
 # Now import works
-from analog_gauge_reader.pipeline_v5_run import process_image
-from config import DETECTION_MODEL_PATH, KEY_POINT_MODEL_PATH, SEGMENTATION_MODEL_PATH, RESULT_PATH, CONFIG_CALIBRATION_PATH
+from analog_gauge_reader.pipeline_v5_run import preload_models, GaugeReader, Calibration, ChangeGate, \
+    parallel_stage_threads
+from diagnostics import getDiagnosticsWorker
+from config import DETECTION_MODEL_PATH, KEY_POINT_MODEL_PATH, SEGMENTATION_MODEL_PATH, RESULT_PATH, CONFIG_CALIBRATION_PATH, \
+    MODEL_DEVICE, MODEL_PRECISION, MODEL_BACKEND, MODEL_THREADS, KEY_POINT_METHOD, GAUGE_TRACKING, \
+    TRACKING_REFRESH_INTERVAL, PARALLEL_STAGES
 
 # params:
 # imageName is the name of image without .jpg (name = f"{index}_{timestamp}")
@@ -25,58 +29,102 @@ def readImage(imageName, rgd_img, camera_index, camera_details):
     return data
 
 
-def runModel(imageName, rgd_img, camera_index, camera_details, debug=True, eval_mode=True):
+def loadModels(parallel_stages=False):
+    """
+    Load and warm up all models once for this process.
+    Every later runModel call reuses the same model instances.
+    With parallel_stages and no MODEL_THREADS the cores are split between the stages.
+    """
+    print("Loading models...")
+    threads = MODEL_THREADS
+    if parallel_stages and threads is None:
+        threads = parallel_stage_threads()
+    preload_models(DETECTION_MODEL_PATH,
+                   KEY_POINT_MODEL_PATH,
+                   SEGMENTATION_MODEL_PATH,
+                   device=MODEL_DEVICE,
+                   precision=MODEL_PRECISION,
+                   backend=MODEL_BACKEND,
+                   threads=threads)
+    print("Models loaded")
+
+
+def runModel(imageName, rgd_img, camera_index, camera_details, debug=False, eval_mode=False):
     """
     Run the gauge reading model directly on an OpenCV frame (NumPy array).
+    Plots and result files are written off the hot path by the diagnostics worker,
+    for the sampled frames (DIAGNOSTICS_* in config) and for every frame with debug.
 
     Args:
         rgd_img (np.ndarray): Raw OpenCV RGB frame
-        run_path (str): Path to save logs/results/plots
-        debug (bool): Enable debugging plots
-        eval_mode (bool): Enable full result output
+        debug (bool): Enable debugging plots for this frame
+        eval_mode (bool): Enable full result output for this frame
+    Returns:
+        dict {'value': ..., 'unit': ..., 'carried_forward': ...}, None if the reading failed
     """
     print("Running model on in-memory frame...")
-    base_path = RESULT_PATH
-    os.makedirs(base_path, exist_ok=True)
-    run_path = os.path.join(base_path, imageName)
-    # detection_model_path = "models/gauge_detection_model.pt"
-    # key_point_model_path = "models/key_point_model.pt"
-    # segmentation_model_path = "models/segmentation_model.pt"
-
-    # Ensure run path exists
-    os.makedirs(run_path, exist_ok=True)
-
-    # Convert OpenCV BGR to RGB, as expected by process_image()
-    #image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-
-    start_marking = camera_details["start_marking"]
-    end_marking = camera_details["end_marking"]
-    unit = camera_details["unit"]
-    # index = (int)(imageName[0])
-    # with open(CONFIG_CALIBRATION_PATH) as f:
-    #     data = json.load(f)
-    #     for obj in data:
-    #         if obj["index"] == index:
-    #             start_marking = obj["start_marking"]
-    #             end_marking = obj["end_marking"]
-    #             unit = obj["unit"]
-    #             break
-    # Run the full gauge-reading pipeline
-    result = process_image(
-        image=rgd_img,
-        detection_model_path=DETECTION_MODEL_PATH,
-        key_point_model_path=KEY_POINT_MODEL_PATH,
-        segmentation_model_path=SEGMENTATION_MODEL_PATH,
-        run_path=run_path,
-        debug=debug,
-        eval_mode=eval_mode,
-        start_marking=start_marking,
-        end_marking=end_marking,
-        unit=unit,
-        image_is_raw=False  # It's a NumPy array already
-    )
-    return result  # dict with {'value': ..., 'unit': ...}
+    diagnostics = getDiagnosticsWorker()
+    # models come from the registry, so building the reader per frame is cheap
+    reader = GaugeReader(DETECTION_MODEL_PATH, KEY_POINT_MODEL_PATH, SEGMENTATION_MODEL_PATH,
+                         Calibration.from_camera_details(camera_details),
+                         key_point_method=KEY_POINT_METHOD)
+    reading = reader.read(rgd_img, keep_details=debug or eval_mode or diagnostics.enabled)
+    diagnostics.submit(imageName, rgd_img, reading, force=debug or eval_mode, eval_mode=eval_mode)
+
+    if not reading.is_valid():
+        print(f"Reading {imageName} failed: {reading.failure}")
+        return None
+    return reading.to_dict()
+
+def createReader():
+    """
+    Build a gauge reader for batched inference, the models are loaded once here.
+    """
+    loadModels(parallel_stages=PARALLEL_STAGES)
+    return GaugeReader(DETECTION_MODEL_PATH, KEY_POINT_MODEL_PATH, SEGMENTATION_MODEL_PATH,
+                       key_point_method=KEY_POINT_METHOD,
+                       tracking=GAUGE_TRACKING,
+                       refresh_interval=TRACKING_REFRESH_INTERVAL,
+                       parallel_stages=PARALLEL_STAGES)
+
+
+def runModelBatch(reader, imageNames, rgd_imgs, camera_details_list, debug=False, eval_mode=False, camera_indices=None):
+    """
+    Run the gauge reading model on the frames of several cameras at once.
+    Every network does one forward pass for all frames together.
+
+    Args:
+        reader (GaugeReader): reader from createReader()
+        imageNames (list): one name per frame, diagnostics are saved under this name
+        rgd_imgs (list): raw OpenCV RGB frames
+        camera_details_list (list): calibration of the camera of each frame
+        debug (bool): Enable debugging plots for all frames
+        eval_mode (bool): Enable full result output for all frames
+        camera_indices (list): camera of each frame, lets the reader track the gauge per camera
+            and skip frames where the gauge did not change (change_threshold in the camera details)
+    Returns:
+        list with a dict {'value': ..., 'unit': ..., 'carried_forward': ...} per frame, None where the reading failed
+    """
+    print(f"Running model on {len(rgd_imgs)} in-memory frames...")
+    diagnostics = getDiagnosticsWorker()
+    calibrations = [Calibration.from_camera_details(camera_details) for camera_details in camera_details_list]
+    gates = [ChangeGate.from_camera_details(camera_details) for camera_details in camera_details_list]
+    readings = reader.read_batch(rgd_imgs, calibrations,
+                                 keep_details=debug or eval_mode or diagnostics.enabled,
+                                 camera_ids=camera_indices, gates=gates)
+    if reader.stage_timings is not None:
+        print(f"Stage timings: {reader.stage_timings}")
+
+    results = []
+    for imageName, rgd_img, reading in zip(imageNames, rgd_imgs, readings):
+        diagnostics.submit(imageName, rgd_img, reading, force=debug or eval_mode, eval_mode=eval_mode)
+
+        if reading.is_valid():
+            results.append(reading.to_dict())
+        else:
+            print(f"Reading {imageName} failed: {reading.failure}")
+            results.append(None)
+    return results
 
 # def runModel_original(imagePath):
 #     print(f"Running model on {imagePath}")
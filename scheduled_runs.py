@@ -1,6 +1,8 @@
-from capture_image import captureImage
-from read_image import readImage, runModel
+from capture_image import captureImage, CameraReader
+from read_image import readImage, runModel, loadModels
 from send_data import sendData
+from inference_scheduler import InferenceScheduler
+from stage_pipeline import CameraPipeline
 from multiprocessing import Process
 import time
 import sys
@@ -23,14 +25,13 @@ def redirect_camera_output(cam_index, camera_name):
     sys.stderr = log_file
     print(f"[{datetime.now()}] Logging started for camera {cam_index}_{camera_name}")
 
-def redirect_subprocess_output(cam_index, camera_name):
-    #now = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_filename = f"logs/subprocess_output_{cam_index}_{camera_name}_{datetime.now().strftime('%Y%m%d_%H')}.log"
+def redirect_scheduler_output():
+    log_filename = f"logs/inference_scheduler_{datetime.now().strftime('%Y%m%d_%H')}.log"
     os.makedirs("logs", exist_ok=True)
     log_file = open(log_filename, "a")
     sys.stdout = log_file
     sys.stderr = log_file
-    print(f"[{datetime.now()}] Logging started for postCapture of camera {cam_index}_{camera_name}")
+    print(f"[{datetime.now()}] Logging started for inference scheduler")
 
 
 def scanActiveCameras():
@@ -69,49 +70,50 @@ def isActiveCamera(name):
     return -1
 
 
-def postCapture(name, rgd_img, camera_index, camera_details):
-    redirect_subprocess_output(camera_index, {camera_details['camera_name']})
-
-    try:
-        print("reading image")
-        # data = readImage(name, rgd_img, camera_index, camera_details)
+def inferReading(name, rgd_img, camera_index, camera_details, scheduler=None):
+    """
+    Inference stage, returns the reading of the frame or None.
+    """
+    print("reading image")
+    # data = readImage(name, rgd_img, camera_index, camera_details)
+    if scheduler is not None:
+        # batched together with the frames of the other cameras
+        data = scheduler.readFrame(camera_index, name, rgd_img)
+    else:
         data = runModel(name, rgd_img, camera_index, camera_details)
-        print(f"Data inferred from {camera_index}_{camera_details['camera_name']}: {data}")
-        if data is None:
-            print("No data returned from image processing")
-            return
-            
-        data_full = {
-            "oilfield" : camera_details["oilfield_name"],
-            "wellhead" : camera_details["wellhead_name"],
-            "gauge" : camera_details["gauge_name"],
-            "reading" : data["value"],
-            "unit" : data["unit"],
-            "sensor_name" : camera_details["sensor_name"]
-        }
-        ack = sendData(data_full)  # Wrap in list as expected by sendData
-        # if ack == 2:
-        #     print("CV failed to read, try again later")
-        #     return
-            
-        # count = 0
-        # while ack != 1 and count < 20:
-        #     time.sleep(3)
-        #     count += 1
-        #     ack = sendData(data)
-            
-        # print(f"Data processing complete. Acknowledgment: {ack}")
-        print(f"Data processing complete for {camera_index}_{camera_details['camera_name']}")
-        
-    except Exception as e:
-        print(f"Error in postCapture: {e}")
-
-    # uncomment below later
-    # if (ack == 1):
-    #    deleteData(name, path)
+    print(f"Data inferred from {camera_index}_{camera_details['camera_name']}: {data}")
+    if data is None:
+        print("No data returned from image processing")
+    return data
+
+
+def publishReading(data, camera_index, camera_details):
+    """
+    Publish stage, queues the reading for InfluxDB.
+    """
+    data_full = {
+        "oilfield" : camera_details["oilfield_name"],
+        "wellhead" : camera_details["wellhead_name"],
+        "gauge" : camera_details["gauge_name"],
+        "reading" : data["value"],
+        "unit" : data["unit"],
+        "sensor_name" : camera_details["sensor_name"],
+        # gauge unchanged since the last reading, the networks did not run
+        "status" : "carried_forward" if data.get("carried_forward") else "ok"
+    }
+    # one spool per camera, every camera runs in its own process
+    return sendData(data_full, spool_name=f"camera_{camera_index}")
+
+
+def runScheduler(scheduler):
+    redirect_scheduler_output()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        print("Stopping inference scheduler")
 
 
-def fullProcess(camera_index, camera_details, interval):
+def fullProcess(camera_index, camera_details, interval, scheduler=None):
     redirect_camera_output(camera_index, {camera_details['camera_name']})
 
     # camera_details in a dict with the format {camera_index : {configuration key value pairs}}
@@ -130,38 +132,39 @@ def fullProcess(camera_index, camera_details, interval):
     capture.set(cv2.CAP_PROP_FRAME_WIDTH, 1080)
     capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 840)
     capture.set(cv2.CAP_PROP_FPS, 5)
+    # grabs in the background, a frame is only decoded when a reading is due
+    capture = CameraReader(capture)
+
+    # load models before the first capture, the inference stage then reuses them for every frame.
+    # With a scheduler the models live in the scheduler process instead.
+    if scheduler is None:
+        loadModels()
 
     show_feed = True
 
-    try:
-        while True:
-            start = time.time()
-            name, frame = captureImage(capture, camera_index)
-            if frame is not None:
-                # --- NEW: show the frame ---
-                if show_feed:
-                    preview = frame.copy()
-                    cv2.putText(preview, f"Cam {camera_index}", (10, 30),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                    cv2.imshow(f"Camera {camera_index}", preview)
-                    # Press 'q' to close this display
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        show_feed = False
-                        cv2.destroyWindow(f"Camera {camera_index}")
-                postCapture(name, frame, camera_index, camera_details)
-                print(f"[{datetime.now()}] Camera {camera_index}_{camera_details['camera_name']}: Data processed successfully")
-
-            else:
-                print(f"[{datetime.now()}] Camera {camera_index}_{camera_details['camera_name']}: Failed to capture image")
-                time.sleep(2)  # <- Give the USB bus and camera time to recover
-                continue
-
-
-            elapsed = time.time() - start
-            sleep_time = max(0, interval - elapsed)
-            print(f"[{datetime.now()}] Camera {camera_index}_{camera_details['camera_name']}: Sleeping {sleep_time:.1f}s")
-            # time.sleep(30)
+    def showFrame(name, frame):
+        nonlocal show_feed
+        if show_feed:
+            preview = frame.copy()
+            cv2.putText(preview, f"Cam {camera_index}", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            cv2.imshow(f"Camera {camera_index}", preview)
+            # Press 'q' to close this display
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                show_feed = False
+                cv2.destroyWindow(f"Camera {camera_index}")
+
+    # capture keeps the interval, inference and publish run behind it in their own threads.
+    # If inference falls behind, the oldest waiting frame is dropped.
+    pipeline = CameraPipeline(
+        f"Camera {camera_index}_{camera_details['camera_name']}",
+        capture=lambda: captureImage(capture, camera_index),
+        infer=lambda name, frame: inferReading(name, frame, camera_index, camera_details, scheduler),
+        publish=lambda name, data: publishReading(data, camera_index, camera_details),
+        interval=interval)
 
+    try:
+        pipeline.run(on_frame=showFrame)
     except KeyboardInterrupt:
         print(f"Stopping camera {camera_index}_{camera_details['camera_name']} processing")
     finally:
@@ -193,9 +196,14 @@ def main():
             print("No active cameras found")
             return
         
-        processes = []
+        # one scheduler reads the frames of all cameras in batches
+        scheduler = InferenceScheduler({camera_index: camera_dict[camera_index] for camera_index in activeCams})
+        scheduler_process = Process(target=runScheduler, args=(scheduler,))
+        scheduler_process.start()
+
+        processes = [scheduler_process]
         for camera_index in activeCams:
-            p = Process(target=fullProcess, args=(camera_index, camera_dict[camera_index], interval))
+            p = Process(target=fullProcess, args=(camera_index, camera_dict[camera_index], interval, scheduler))
             p.start()
             processes.append(p)
 
@@ -206,6 +214,8 @@ def main():
             print("Main process interrupted. Terminating cameras...")
             for p in processes:
                 p.terminate()
+        finally:
+            scheduler.close()
 
 
         # print(activeCams)
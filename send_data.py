@@ -54,16 +54,255 @@ def deleteData(name, path):
 '''
 
 # send_data.py
+import atexit
 import datetime
 import os
+import random
+import threading
+import time
 from influxdb_client import InfluxDBClient, Point, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
-from config import INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG, INFLUX_BUCKET
+from influxdb_client.rest import ApiException
+from config import INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG, INFLUX_BUCKET, \
+    INFLUX_BATCH_SIZE, INFLUX_FLUSH_INTERVAL, INFLUX_SPOOL_PATH
 import logging
 
 logger = logging.getLogger("sendData")
 logging.basicConfig(level=logging.INFO)
 
+SEGMENT_SUFFIX = ".seg"
+OFFSET_FILE = "offset"
+# a new segment is started once the current one is this large
+SEGMENT_SIZE = 1024 * 1024  # bytes
+MIN_BACKOFF = 1  # seconds
+MAX_BACKOFF = 60  # seconds
+
+
+class InfluxWriter:
+    """
+    Persistent writer for one process.
+    Readings are appended to a spool of segment files on disk first, so
+    enqueue() never waits for the network and nothing is lost if InfluxDB
+    is unreachable or the process restarts. A background thread sends the
+    spool in order in batches of up to batch_size lines, at the latest
+    flush_interval seconds after a line was added, and retries failed
+    batches with exponential backoff.
+    The offset file holds the position up to which the spool was sent,
+    fully sent segments are deleted.
+    Every spool directory must only be used by one process at a time.
+    """
+    def __init__(self, spool_dir, url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG,
+                 bucket=INFLUX_BUCKET, batch_size=INFLUX_BATCH_SIZE,
+                 flush_interval=INFLUX_FLUSH_INTERVAL, record_file="record.txt"):
+        self.spool_dir = spool_dir
+        self.org = org
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.record_file = record_file
+        os.makedirs(spool_dir, exist_ok=True)
+
+        # one client for the lifetime of the writer, it keeps the http connections open
+        self.client = InfluxDBClient(url=url, token=token, org=org)
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+        self._condition = threading.Condition()
+        self._closed = False
+        self._segments = self._listSegments()
+        self._committed = self._readOffset()
+        if not self._segments:
+            self._segments = [1]
+        _truncatePartialLine(self._segmentPath(self._segments[-1]))
+        self._segment_file = open(self._segmentPath(self._segments[-1]), "ab")
+        self._pending = self._countPending()
+        if self._pending:
+            logger.info(f"Replaying {self._pending} spooled readings from {spool_dir}")
+
+        self._thread = threading.Thread(target=self._run, name="InfluxWriter", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, line):
+        """
+        Append one line protocol record to the spool, returns once it is on disk.
+        """
+        data = (line.rstrip("\n") + "\n").encode("utf-8")
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("InfluxWriter is closed")
+            if self._segment_file.tell() + len(data) > SEGMENT_SIZE and self._segment_file.tell() > 0:
+                self._rollSegment()
+            self._segment_file.write(data)
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._condition.notify()
+
+    def close(self, timeout=10):
+        """
+        Stop the background thread after a last attempt to send the spool.
+        Whatever could not be sent stays in the spool for the next start.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._segment_file.close()
+        self.client.close()
+
+    def _run(self):
+        backoff = MIN_BACKOFF
+        while True:
+            with self._condition:
+                # wait for a full batch or the flush interval
+                if not self._closed and self._pending < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+                if self._pending == 0:
+                    if closed:
+                        return
+                    continue
+                lines, end = self._readBatch()
+                if not lines:
+                    self._pending = 0
+                    continue
+
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=lines,
+                                     write_precision=WritePrecision.NS)
+            except Exception as e:
+                if isinstance(e, ApiException) and e.status == 400:
+                    # malformed line protocol is never accepted, retrying would block the spool
+                    logger.error(f"InfluxDB rejected {len(lines)} readings, dropping them: {e}")
+                    with self._condition:
+                        self._commit(end, len(lines))
+                    continue
+                if closed:
+                    logger.warning(f"Could not send {len(lines)} spooled readings before closing: {e}")
+                    return
+                delay = backoff * random.uniform(0.5, 1.0)
+                logger.warning(f"Failed to send {len(lines)} readings, retry in {delay:.1f}s: {e}")
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                with self._condition:
+                    self._condition.wait_for(lambda: self._closed, timeout=delay)
+                continue
+
+            backoff = MIN_BACKOFF
+            with self._condition:
+                self._commit(end, len(lines))
+            if self.record_file:
+                # debug: write line protocol to local file for traceability
+                with open(self.record_file, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+            logger.info(f"Sent {len(lines)} readings to InfluxDB")
+
+    def _readBatch(self):
+        """
+        Read up to batch_size lines after the committed offset.
+        Returns the lines and the (segment, offset) after the last of them.
+        """
+        lines = []
+        segment, offset = self._committed
+        for current in self._segments:
+            if current < segment:
+                continue
+            if current > segment:
+                segment, offset = current, 0
+            with open(self._segmentPath(segment), "rb") as f:
+                f.seek(offset)
+                for raw in f:
+                    # a line without newline was cut off by a crash, it is never sent
+                    if not raw.endswith(b"\n"):
+                        break
+                    offset += len(raw)
+                    if raw.strip():
+                        lines.append(raw.decode("utf-8").rstrip("\n"))
+                    if len(lines) >= self.batch_size:
+                        return lines, (segment, offset)
+        return lines, (segment, offset)
+
+    def _commit(self, end, n_lines):
+        self._committed = end
+        self._writeOffset(end)
+        self._pending = max(0, self._pending - n_lines)
+        # delete sent segments, except the one being written
+        while len(self._segments) > 1 and self._segments[0] < end[0]:
+            os.remove(self._segmentPath(self._segments.pop(0)))
+
+    def _rollSegment(self):
+        self._segment_file.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._segment_file = open(self._segmentPath(self._segments[-1]), "ab")
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.spool_dir, f"{segment:09d}{SEGMENT_SUFFIX}")
+
+    def _listSegments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.spool_dir)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _readOffset(self):
+        path = os.path.join(self.spool_dir, OFFSET_FILE)
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                segment, offset = f.read().split()
+            return int(segment), int(offset)
+        first = self._segments[0] if self._segments else 1
+        return first, 0
+
+    def _writeOffset(self, end):
+        # write and rename, so a crash never leaves a half written offset
+        path = os.path.join(self.spool_dir, OFFSET_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{end[0]} {end[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _countPending(self):
+        count = 0
+        segment, offset = self._committed
+        for current in self._segments:
+            if current < segment:
+                continue
+            with open(self._segmentPath(current), "rb") as f:
+                if current == segment:
+                    f.seek(offset)
+                count += sum(1 for raw in f if raw.endswith(b"\n") and raw.strip())
+        return count
+
+
+def _truncatePartialLine(path):
+    # drop a line cut off by a crash, otherwise the next line would be appended to it
+    if not os.path.isfile(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def getInfluxWriter(spool_name="default"):
+    """
+    Writer of this process for the spool INFLUX_SPOOL_PATH/spool_name,
+    created on first use and closed at exit.
+    """
+    with _writers_lock:
+        writer = _writers.get(spool_name)
+        if writer is None:
+            writer = InfluxWriter(os.path.join(INFLUX_SPOOL_PATH, spool_name))
+            _writers[spool_name] = writer
+            atexit.register(writer.close)
+        return writer
+
+
 def deleteData(name, path):
     # delete original image
     # os.remove(path)
@@ -74,7 +313,7 @@ def deleteData(name, path):
     print(f"{name}.jpg has been deleted from {path}")
     return 1
 
-def sendData(data):
+def sendData(data, spool_name="default"):
     """
     data: either a dict or a list where data[0] is dict
     expected keys in dict:
@@ -86,6 +325,9 @@ def sendData(data):
       - confidence (optional float 0..1)
       - timestamp (optional, ISO string or datetime)
       - sensor_name (optional)
+    spool_name: spool of the InfluxWriter, use one per process
+    The reading is only queued, InfluxWriter sends it in the background.
+    Returns 1 if queued, 2 if there is nothing valid to send, 0 on error.
     """
     if isinstance(data, list):
         if not data:  # empty list
@@ -102,10 +344,6 @@ def sendData(data):
         print("Reading failed, no valid data to send")
         return 2
 
-    # prepare influx client (create per-call is simpler in processes)
-    client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
-    write_api = client.write_api(write_options=SYNCHRONOUS)
-
     try:
         ts = payload.get("timestamp")
         if ts is None:
@@ -124,21 +362,11 @@ def sendData(data):
             .time(ts, WritePrecision.NS)
         )
 
-        write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
+        getInfluxWriter(spool_name).enqueue(point.to_line_protocol())
 
-        # debug: write line protocol to local file for traceability
-        with open("record.txt", "a") as f:
-            f.write(point.to_line_protocol() + "\n")
-
-        logger.info(f"Sent {payload['reading']} for {payload.get('oilfield')}/{payload.get('wellhead')}/{payload.get('gauge')}")
+        logger.info(f"Queued {payload['reading']} for {payload.get('oilfield')}/{payload.get('wellhead')}/{payload.get('gauge')}")
         return 1
 
     except Exception as e:
-        logger.exception("Failed to send data to InfluxDB")
+        logger.exception("Failed to queue data for InfluxDB")
         return 0
-
-    finally:
-        try:
-            client.close()
-        except:
-            pass
@@ -22,6 +22,10 @@ setup(
         'Pillow',
         'numpy'
     ],
+    extras_require={
+        # MODEL_BACKEND = "onnx"
+        'onnx': ['onnx', 'onnxruntime<1.20'],
+    },
     include_package_data=True,
     zip_safe=False,
 )
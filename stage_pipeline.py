@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# frames waiting for inference, older frames are dropped when inference falls behind
+FRAME_QUEUE_SIZE = 1
+# readings waiting to be published
+READING_QUEUE_SIZE = 10
+# seconds between two metrics reports
+METRICS_INTERVAL = 60
+
+
+class DropOldestQueue:
+    """
+    Bounded queue between two stages. put() never blocks, if the queue is
+    full the oldest item is dropped to make room for the new one.
+    """
+    def __init__(self, maxsize):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._condition = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, item):
+        with self._condition:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._condition.notify()
+
+    def get(self):
+        """
+        Blocks until an item is available, returns None once the queue is closed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+
+class StageMetrics:
+    """
+    Latency of one stage, reset after every report.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def report(self):
+        with self._lock:
+            mean = self.total / self.count if self.count else 0.0
+            text = f"{self.name}: {self.count} runs, mean {mean * 1000:.0f}ms, max {self.max * 1000:.0f}ms"
+            self._reset()
+        return text
+
+
+class CameraPipeline:
+    """
+    Capture, inference and publish of one camera as three stages.
+    Capture runs in the calling thread at a fixed interval, inference and publish
+    each run in their own thread, connected by drop-oldest queues. A slow inference
+    or publish therefore never delays the next capture.
+
+    capture() returns (name, frame) or (None, None),
+    infer(name, frame) returns the reading or None,
+    publish(name, reading) sends it.
+    """
+    def __init__(self, label, capture, infer, publish, interval,
+                 frame_queue_size=FRAME_QUEUE_SIZE, reading_queue_size=READING_QUEUE_SIZE,
+                 metrics_interval=METRICS_INTERVAL):
+        self.label = label
+        self.capture = capture
+        self.infer = infer
+        self.publish = publish
+        self.interval = interval
+        self.metrics_interval = metrics_interval
+
+        self.frames = DropOldestQueue(frame_queue_size)
+        self.readings = DropOldestQueue(reading_queue_size)
+        self.metrics = {stage: StageMetrics(stage) for stage in ("capture", "inference", "publish")}
+        self._threads = [
+            threading.Thread(target=self._inferenceLoop, name=f"{label}_inference", daemon=True),
+            threading.Thread(target=self._publishLoop, name=f"{label}_publish", daemon=True),
+        ]
+
+    def run(self, on_frame=None):
+        """
+        Capture loop, runs until interrupted.
+        on_frame(name, frame) is called in this thread for every captured frame, e.g. for a preview.
+        """
+        for thread in self._threads:
+            thread.start()
+        last_report = time.time()
+        try:
+            while True:
+                start = time.time()
+                name, frame = self.capture()
+                self.metrics["capture"].record(time.time() - start)
+                if frame is None:
+                    print(f"[{datetime.now()}] {self.label}: Failed to capture image")
+                    time.sleep(2)  # <- Give the USB bus and camera time to recover
+                    continue
+
+                if on_frame is not None:
+                    on_frame(name, frame)
+                self.frames.put((name, frame, time.time()))
+
+                if time.time() - last_report >= self.metrics_interval:
+                    self.reportMetrics()
+                    last_report = time.time()
+
+                # keep the capture cadence, whatever inference is doing
+                sleep_time = max(0, self.interval - (time.time() - start))
+                time.sleep(sleep_time)
+        finally:
+            self.frames.close()
+            self.readings.close()
+
+    def reportMetrics(self):
+        print(f"[{datetime.now()}] {self.label} metrics: "
+              f"{self.metrics['capture'].report()} | "
+              f"frame queue depth {len(self.frames)} (max {self.frames.max_depth}), dropped {self.frames.dropped} | "
+              f"{self.metrics['inference'].report()} | "
+              f"reading queue depth {len(self.readings)} (max {self.readings.max_depth}), dropped {self.readings.dropped} | "
+              f"{self.metrics['publish'].report()}")
+
+    def _inferenceLoop(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            name, frame, captured = item
+            start = time.time()
+            try:
+                reading = self.infer(name, frame)
+            except Exception as e:
+                print(f"Error in inference of {name}: {e}")
+                reading = None
+            self.metrics["inference"].record(time.time() - start)
+            if reading is not None:
+                self.readings.put((name, reading, captured))
+
+    def _publishLoop(self):
+        while True:
+            item = self.readings.get()
+            if item is None:
+                return
+            name, reading, captured = item
+            start = time.time()
+            try:
+                self.publish(name, reading)
+            except Exception as e:
+                print(f"Error publishing {name}: {e}")
+            self.metrics["publish"].record(time.time() - start)
+            print(f"[{datetime.now()}] {self.label}: {name} published {time.time() - captured:.1f}s after capture")
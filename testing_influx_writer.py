@@ -0,0 +1,96 @@
+"""
+Manual test of the InfluxWriter against a local stand-in for the InfluxDB write endpoint.
+Checks batching, ordering, retries during an outage and replay of the spool after a restart.
+
+python testing_influx_writer.py
+"""
+import gzip
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from send_data import InfluxWriter
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    received = []
+    requests = 0
+    available = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        StandInHandler.requests += 1
+        if not StandInHandler.available:
+            self.send_response(503)
+            self.end_headers()
+            return
+        StandInHandler.received.extend(body.decode("utf-8").splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def waitUntil(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def createWriter(url, spool_dir):
+    return InfluxWriter(spool_dir, url=url, token="token", org="org", bucket="bucket",
+                        batch_size=3, flush_interval=0.5, record_file=None)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    spool_dir = tempfile.mkdtemp(prefix="influx_spool_")
+    lines = [f"gauge_readings,gauge=g1 value={i} {1700000000000000000 + i}" for i in range(10)]
+
+    try:
+        # batches by size and by flush interval
+        writer = createWriter(url, spool_dir)
+        for line in lines[:5]:
+            writer.enqueue(line)
+        assert waitUntil(lambda: len(StandInHandler.received) == 5), StandInHandler.received
+        assert StandInHandler.received == lines[:5]
+        print(f"Sent 5 readings in {StandInHandler.requests} requests")
+
+        # outage, readings stay in the spool and are retried
+        StandInHandler.available = False
+        for line in lines[5:8]:
+            writer.enqueue(line)
+        requests = StandInHandler.requests
+        assert waitUntil(lambda: StandInHandler.requests > requests)
+        writer.close(timeout=2)
+        assert len(StandInHandler.received) == 5
+        print("Readings kept in the spool during the outage")
+
+        # restart, the spool is replayed in order before new readings
+        StandInHandler.available = True
+        writer = createWriter(url, spool_dir)
+        for line in lines[8:]:
+            writer.enqueue(line)
+        assert waitUntil(lambda: len(StandInHandler.received) == 10), StandInHandler.received
+        assert StandInHandler.received == lines
+        writer.close()
+        print("Spool replayed in order after restart")
+
+        print("All InfluxWriter checks passed")
+    finally:
+        server.shutdown()
+        shutil.rmtree(spool_dir)
+
+
+if __name__ == "__main__":
+    main()